@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """
+    A thread safe LRU cache whose values expire ttl seconds after being loaded.
+
+    Concurrent misses for the same key share a single call to load,
+    and failed loads aren't cached.
+    """
+
+    def __init__(self, ttl, maxsize=1024, timer=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.timer = timer
+        self.values = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        """Returns whether the key is cached, and its value. Call with the lock held"""
+        entry = self.values.get(key)
+        if entry is not None and entry[0] > self.timer():
+            self.values.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+        self.misses += 1
+        return False, None
+
+    def _store(self, key, value):
+        """Call with the lock held"""
+        del self.loading[key]
+        self.values[key] = (self.timer() + self.ttl, value)
+        self.values.move_to_end(key)
+        while len(self.values) > self.maxsize:
+            self.values.popitem(last=False)
+
+    def get(self, key, load):
+        with self.lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            future = self.loading.get(key)
+            loader = future is None
+            if loader:
+                future = self.loading[key] = Future()
+        if not loader:
+            return future.result()
+        try:
+            value = load()
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self._store(key, value)
+        future.set_result(value)
+        return value
+
+    async def get_async(self, key, load):
+        """The same as get, for a coroutine function load, used from one event loop"""
+        with self.lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            future = self.loading.get(key)
+            loader = future is None
+            if loader:
+                future = self.loading[key] = asyncio.get_running_loop().create_future()
+        if not loader:
+            return await asyncio.shield(future)
+        try:
+            value = await load()
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            # Don't warn about the exception if nothing else was waiting for it
+            future.exception()
+            raise
+        with self.lock:
+            self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def metrics(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.values)}
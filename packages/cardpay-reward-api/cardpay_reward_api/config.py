@@ -30,6 +30,14 @@ class Settings(BaseSettings):
     DB_STRING: str = "postgresql://postgres@localhost:5432/postgres"
     EVM_FULL_NODE_URL: str = "https://sokol-archive.blockscout.com"
     SENTRY_DSN: str = None
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    EVM_POOL_SIZE: int = 10
+    REWARD_POOL_BALANCE_TTL: float = 5
+    PROOF_CACHE_SIZE: int = 10_000
+    PROOF_CACHE_TTL: float = 600
+    PROOF_CACHE_VERSION_TTL: float = 1
+    PROOF_BATCH_MAX_PAYEES: int = 1000
 
     class Config:
         fields = {
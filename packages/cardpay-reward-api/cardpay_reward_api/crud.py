@@ -1,17 +1,189 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import String, any_, bindparam, func, select, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import models, schemas
 
+PROOF_COLUMNS = [
+    "rootHash",
+    "paymentCycle",
+    "tokenAddress",
+    "payee",
+    "proofArray",
+    "rewardProgramId",
+    "amount",
+    "leaf",
+    "validFrom",
+    "validTo",
+    "explanationId",
+    "explanationData",
+]
+STREAM_CHUNK_SIZE = 1000
 
-def get_proofs(db: Session, proof_filter: schemas.ProofFilter, param):
-    query = db.query(models.Proof)
+
+def as_hex_string(v):
+    """The same as HexBytes(v).hex() for a hex string, without decoding it"""
+    return "0x" + (v[2:] if v.startswith("0x") else v).lower()
+
+
+def proofs_query(proof_filter: schemas.ProofFilter, cursor=None):
+    """
+    Only the columns of the response are selected, in id order so that pages can
+    continue from the id of the last proof (the cursor) using the payee index
+    """
+    proofs = models.Proof.__table__
+    query = select(proofs.c.id, *[proofs.c[name] for name in PROOF_COLUMNS])
     if proof_filter.payee is not None:
-        query = query.filter(models.Proof.payee == proof_filter.payee)
+        query = query.where(proofs.c.payee == proof_filter.payee)
     if proof_filter.rewardProgramId is not None:
-        query = query.filter(
-            models.Proof.rewardProgramId == proof_filter.rewardProgramId
-        )
+        query = query.where(proofs.c.rewardProgramId == proof_filter.rewardProgramId)
     if proof_filter.token is not None:
-        query = query.filter(models.Proof.tokenAddress == proof_filter.token)
+        query = query.where(proofs.c.tokenAddress == proof_filter.token)
+    if cursor is not None:
+        query = query.where(proofs.c.id > cursor)
+    return query.order_by(proofs.c.id)
+
+
+async def get_proofs_version(db: AsyncSession):
+    """
+    Changes whenever the indexer adds roots, which is the only time proofs change
+    """
+    result = await db.execute(
+        select(func.count(models.Root.id), func.max(models.Root.id))
+    )
+    return tuple(result.one())
+
+
+async def get_proof_summaries(
+    db: AsyncSession, proof_filter: schemas.ProofFilter, current_block=None
+):
+    """
+    The total amount and number of proofs of a payee for each reward program and
+    token, optionally only of proofs that are valid at current_block
+    """
+    summaries = models.ProofSummary.__table__
+    query = select(summaries).where(summaries.c.payee == proof_filter.payee)
+    if proof_filter.rewardProgramId is not None:
+        query = query.where(summaries.c.rewardProgramId == proof_filter.rewardProgramId)
+    if proof_filter.token is not None:
+        query = query.where(summaries.c.tokenAddress == proof_filter.token)
+    if current_block is not None:
+        query = query.where(
+            summaries.c.validFrom <= current_block, summaries.c.validTo > current_block
+        )
+    totals = {}
+    for row in await db.execute(query):
+        key = (row.rewardProgramId, row.tokenAddress)
+        if key not in totals:
+            totals[key] = {
+                "payee": row.payee,
+                "rewardProgramId": row.rewardProgramId,
+                "tokenAddress": row.tokenAddress,
+                "amount": 0,
+                "proofs": 0,
+                "validFrom": row.validFrom,
+                "validTo": row.validTo,
+            }
+        total = totals[key]
+        # Amounts are in wei, so are added as ints rather than in the database
+        total["amount"] += int(row.amount)
+        total["proofs"] += row.proofs
+        total["validFrom"] = min(total["validFrom"], row.validFrom)
+        total["validTo"] = max(total["validTo"], row.validTo)
+    return [
+        {**total, "amount": str(total["amount"])} for _, total in sorted(totals.items())
+    ]
 
-    return query.offset(param["skip"]).limit(param["limit"]).all()
+
+def to_response(row):
+    proof = dict(row._mapping)
+    proof["leaf"] = as_hex_string(proof["leaf"])
+    proof["proofArray"] = [as_hex_string(p) for p in proof["proofArray"] or []]
+    return proof
+
+
+async def get_proofs(db: AsyncSession, proof_filter: schemas.ProofFilter, param):
+    """
+    A page of proofs as response dicts, and the cursor of the next page
+    (None if this is the last)
+    """
+    result = await db.execute(
+        proofs_query(proof_filter, param.get("cursor"))
+        .offset(param["skip"])
+        .limit(param["limit"])
+    )
+    rows = result.all()
+    proofs = [to_response(row) for row in rows]
+    for proof in proofs:
+        del proof["id"]
+    next_cursor = rows[-1].id if rows and len(rows) == param["limit"] else None
+    return proofs, next_cursor
+
+
+async def iter_proofs(db: AsyncSession, proof_filter: schemas.ProofFilter, cursor=None):
+    """
+    All the proofs after the cursor as response dicts, read a chunk at a time
+    """
+    while True:
+        result = await db.execute(
+            proofs_query(proof_filter, cursor).limit(STREAM_CHUNK_SIZE)
+        )
+        rows = result.all()
+        for row in rows:
+            proof = to_response(row)
+            cursor = proof.pop("id")
+            yield proof
+        if len(rows) < STREAM_CHUNK_SIZE:
+            return
+
+
+async def iter_proofs_by_payee(db: AsyncSession, batch: schemas.ProofBatch):
+    """
+    The proofs of each of a batch of payees, as (payee, proofs) pairs, reading
+    the proofs of all the payees a chunk at a time in (payee, id) order.
+    Payees without proofs come last, with no proofs.
+    """
+    proofs = models.Proof.__table__
+    payees = list(dict.fromkeys(batch.payees))
+    if db.bind.dialect.name == "postgresql":
+        # One array parameter, however many payees there are
+        in_batch = proofs.c.payee == any_(
+            bindparam("payees", payees, type_=postgresql.ARRAY(String))
+        )
+    else:
+        in_batch = proofs.c.payee.in_(payees)
+    query = select(proofs.c.id, *[proofs.c[name] for name in PROOF_COLUMNS]).where(
+        in_batch
+    )
+    if batch.rewardProgramId is not None:
+        query = query.where(proofs.c.rewardProgramId == batch.rewardProgramId)
+    if batch.token is not None:
+        query = query.where(proofs.c.tokenAddress == batch.token)
+    found = set()
+    payee, group = None, []
+    after = None
+    while True:
+        chunk = query
+        if after is not None:
+            chunk = chunk.where(tuple_(proofs.c.payee, proofs.c.id) > tuple_(*after))
+        result = await db.execute(
+            chunk.order_by(proofs.c.payee, proofs.c.id).limit(STREAM_CHUNK_SIZE)
+        )
+        rows = result.all()
+        for row in rows:
+            if row.payee != payee:
+                if group:
+                    yield payee, group
+                payee, group = row.payee, []
+                found.add(payee)
+            proof = to_response(row)
+            del proof["id"]
+            group.append(proof)
+        if len(rows) < STREAM_CHUNK_SIZE:
+            break
+        after = (rows[-1].payee, rows[-1].id)
+    if group:
+        yield payee, group
+    for payee in payees:
+        if payee not in found:
+            yield payee, []
@@ -1,3 +1,33 @@
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 Base = declarative_base()
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def create_async_db_engine(db_string, pool_size=10, max_overflow=20, **kwargs):
+    """
+    An asyncio engine for a DB_STRING, using asyncpg for postgres and aiosqlite
+    for sqlite, whatever driver the string names
+    """
+    url = make_url(db_string)
+    backend = url.get_backend_name()
+    url = url.set(drivername=ASYNC_DRIVERS[backend])
+    if backend == "postgresql":
+        kwargs.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            # Drop connections the database or a proxy closed while idle
+            pool_pre_ping=True,
+        )
+    elif url.database not in (None, "", ":memory:"):
+        # aiosqlite otherwise opens a connection, and a thread, per session
+        kwargs.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+        )
+    return create_async_engine(url, **kwargs)
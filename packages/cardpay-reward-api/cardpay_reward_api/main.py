@@ -1,48 +1,64 @@
 import json
 import logging
 import os
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
 
+import requests
 import sentry_sdk
 import uvicorn
-from fastapi import Depends, FastAPI
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
 from web3 import Web3
 
 from . import crud, schemas
+from .cache import TTLCache
 from .config import config, get_settings
+from .database import create_async_db_engine
 
 LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
 logging.basicConfig(level=LOGLEVEL)
 
 settings = get_settings()
-engine = create_engine(settings.DB_STRING)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_async_db_engine(
+    settings.DB_STRING,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+)
+SessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 app = FastAPI()
 
 
-def get_db():
-    try:
-        db = SessionLocal()
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
+@lru_cache
 def get_w3():
-    w3 = Web3(Web3.HTTPProvider(settings.EVM_FULL_NODE_URL))
-    yield w3
+    # One keep-alive connection pool to the node for the lifetime of the app
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=settings.EVM_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return Web3(Web3.HTTPProvider(settings.EVM_FULL_NODE_URL, session=session))
 
 
-def get_reward_pool(w3=Depends(get_w3)):
+@lru_cache
+def get_reward_pool():
     with open("abis/reward-pool.json") as contract_file:
         contract = json.load(contract_file)
-    reward_contract = w3.eth.contract(
+    return get_w3().eth.contract(
         address=config[settings.ENVIRONMENT]["reward_pool"], abi=contract
     )
-    yield reward_contract
+
+
+balance_cache = TTLCache(ttl=settings.REWARD_POOL_BALANCE_TTL)
+proof_cache = TTLCache(ttl=settings.PROOF_CACHE_TTL, maxsize=settings.PROOF_CACHE_SIZE)
+proofs_version_cache = TTLCache(ttl=settings.PROOF_CACHE_VERSION_TTL, maxsize=1)
 
 
 if settings.SENTRY_DSN is not None:
@@ -56,8 +72,8 @@ if settings.SENTRY_DSN is not None:
     )
 
 
-def param(skip: int = 0, limit: int = 100):
-    return {"skip": skip, "limit": limit}
+def param(skip: int = 0, limit: int = 100, cursor: Optional[int] = None):
+    return {"skip": skip, "limit": limit, "cursor": cursor}
 
 
 @app.get("/about/")
@@ -74,13 +90,112 @@ async def root():
     return {"status": "ok"}
 
 
-@app.get("/merkle-proofs/{payee}", response_model=List[schemas.Proof])
-def read_proofs(
-    db: Session = Depends(get_db),
+@app.get(
+    "/merkle-proofs/{payee}",
+    response_model=List[schemas.Proof],
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def read_proofs(
+    db: AsyncSession = Depends(get_db),
     proof_filter: dict = Depends(schemas.ProofFilter),
     param: dict = Depends(param),
+    accept: Optional[str] = Header(None),
+):
+    """
+    Pages of proofs are in id order. When there may be more, the X-Next-Cursor
+    header has the cursor to request the next page with.
+
+    With `Accept: application/x-ndjson`, all the proofs after the cursor are
+    streamed instead, one JSON object per line.
+    """
+    if accept is not None and "application/x-ndjson" in accept:
+        return StreamingResponse(
+            (
+                json.dumps(proof) + "\n"
+                async for proof in crud.iter_proofs(db, proof_filter, param["cursor"])
+            ),
+            media_type="application/x-ndjson",
+        )
+    # Proofs only change when the indexer adds roots, so pages are cached
+    # for as long as the roots stay the same
+    version = await proofs_version_cache.get_async(
+        None, lambda: crud.get_proofs_version(db)
+    )
+    key = (
+        version,
+        proof_filter.payee,
+        proof_filter.rewardProgramId,
+        proof_filter.token,
+        param["skip"],
+        param["limit"],
+        param["cursor"],
+    )
+
+    async def load():
+        proofs, next_cursor = await crud.get_proofs(
+            db, proof_filter=proof_filter, param=param
+        )
+        # The rows are already in the shape of the response, so skip validating them
+        return JSONResponse(proofs).body, next_cursor
+
+    body, next_cursor = await proof_cache.get_async(key, load)
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.post(
+    "/merkle-proofs/",
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def read_proofs_of_payees(
+    batch: schemas.ProofBatch,
+    db: AsyncSession = Depends(get_db),
 ):
-    return crud.get_proofs(db, proof_filter=proof_filter, param=param)
+    """
+    The proofs of up to PROOF_BATCH_MAX_PAYEES payees, optionally of one reward
+    program and token, streamed as one JSON object per line, with the payee and
+    all of its proofs. Every payee gets a line, even if it has no proofs.
+    """
+    if len(batch.payees) > settings.PROOF_BATCH_MAX_PAYEES:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {settings.PROOF_BATCH_MAX_PAYEES} payees can be requested at once",
+        )
+    return StreamingResponse(
+        (
+            json.dumps({"payee": payee, "proofs": proofs}) + "\n"
+            async for payee, proofs in crud.iter_proofs_by_payee(db, batch)
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get(
+    "/proof-summaries/{payee}",
+    response_model=List[schemas.ProofSummary],
+)
+async def read_proof_summaries(
+    db: AsyncSession = Depends(get_db),
+    proof_filter: dict = Depends(schemas.ProofFilter),
+    current_block: Optional[int] = None,
+):
+    """
+    The total amount of the proofs of a payee for each reward program and token,
+    with the earliest validFrom and latest validTo of those proofs.
+
+    With current_block, only proofs that are valid at that block
+    (validFrom <= current_block < validTo) are counted.
+    """
+    return await crud.get_proof_summaries(db, proof_filter, current_block)
+
+
+@app.get("/cache-metrics/")
+async def cache_metrics():
+    return {
+        "proofs": proof_cache.metrics(),
+        "proofs_version": proofs_version_cache.metrics(),
+        "reward_pool_balance": balance_cache.metrics(),
+    }
 
 
 @app.get(
@@ -92,7 +207,10 @@ def read_reward_pool_balance(
     token: str,
     reward_pool=Depends(get_reward_pool),
 ):
-    balance_in_wei = reward_pool.caller.rewardBalance(rewardProgramId, token)
+    balance_in_wei = balance_cache.get(
+        (rewardProgramId, token),
+        lambda: reward_pool.caller.rewardBalance(rewardProgramId, token),
+    )
     return {
         "rewardProgramId": rewardProgramId,
         "token": token,
@@ -30,12 +30,28 @@ class Proof(BaseModel):
         orm_mode = True
 
 
+class ProofSummary(BaseModel):
+    payee: str
+    rewardProgramId: str
+    tokenAddress: str
+    amount: str
+    proofs: int
+    validFrom: int
+    validTo: int
+
+
 class ProofFilter(BaseModel):
     rewardProgramId: Optional[str]
     token: Optional[str]
     payee: str
 
 
+class ProofBatch(BaseModel):
+    payees: List[str]
+    rewardProgramId: Optional[str]
+    token: Optional[str]
+
+
 class RewardPoolBalance(BaseModel):
     rewardProgramId: str
     token: str
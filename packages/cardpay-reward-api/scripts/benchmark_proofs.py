@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+
+from cardpay_reward_api import crud, models, schemas
+from cardpay_reward_api.database import Base, create_async_db_engine
+from sqlalchemy import Column, Integer, PickleType, String, create_engine, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy.orm import Session
+
+TOKEN = "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f"
+PROGRAMS = [f"0x{n:040x}" for n in range(1, 5)]
+
+
+class LegacyProof(Base):
+    """The proofs table before it stopped pickling and was indexed"""
+
+    __tablename__ = "proofs_legacy"
+    id = Column(Integer, primary_key=True, index=True)
+    rootHash = Column(String)
+    paymentCycle = Column(Integer)
+    tokenAddress = Column(String)
+    payee = Column(String)
+    proofArray = Column(MutableList.as_mutable(PickleType), default=[])
+    rewardProgramId = Column(String)
+    amount = Column(String)
+    leaf = Column(String, unique=True)
+    validFrom = Column(Integer)
+    validTo = Column(Integer)
+    explanationId = Column(String, nullable=True)
+    explanationData = Column(PickleType, default={})
+
+
+def payee(n):
+    return f"0x{n:040x}"
+
+
+def make_rows(start, count, payees, rng):
+    return [
+        {
+            "rootHash": "0x" + "00" * 32,
+            "paymentCycle": n // payees,
+            "tokenAddress": TOKEN,
+            "payee": payee(n % payees),
+            "proofArray": [rng.getrandbits(256).to_bytes(32, "big").hex()] * 18,
+            "rewardProgramId": PROGRAMS[n % len(PROGRAMS)],
+            "amount": str(rng.getrandbits(64)),
+            "leaf": f"{n:0128x}",
+            "validFrom": n // payees,
+            "validTo": n // payees + 100_000,
+            "explanationId": "flat_payment",
+            "explanationData": {"amount": "1", "token": TOKEN},
+        }
+        for n in range(start, start + count)
+    ]
+
+
+def fill(engine, rows, payees, batch_size=10_000):
+    rng = random.Random(0)
+    with engine.begin() as connection:
+        for start in range(0, rows, batch_size):
+            batch = make_rows(start, min(batch_size, rows - start), payees, rng)
+            connection.execute(insert(models.Proof.__table__), batch)
+            connection.execute(insert(LegacyProof.__table__), batch)
+
+
+def legacy_get_proofs(db):
+    async def get_proofs(proof_filter, param):
+        query = db.query(LegacyProof).filter(LegacyProof.payee == proof_filter.payee)
+        if proof_filter.rewardProgramId is not None:
+            query = query.filter(
+                LegacyProof.rewardProgramId == proof_filter.rewardProgramId
+            )
+        proofs = query.offset(param["skip"]).limit(param["limit"]).all()
+        db.expunge_all()
+        return [schemas.Proof.from_orm(proof).json() for proof in proofs]
+
+    return get_proofs
+
+
+def current_get_proofs(db):
+    async def get_proofs(proof_filter, param):
+        proofs, _ = await crud.get_proofs(db, proof_filter, param)
+        return json.dumps(proofs)
+
+    return get_proofs
+
+
+async def time_requests(get_proofs, filters):
+    """Time fetching and serializing proofs as /merkle-proofs/{payee} does"""
+    times = []
+    for proof_filter in filters:
+        start = time.perf_counter()
+        await get_proofs(proof_filter, {"skip": 0, "limit": 100, "cursor": None})
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.99)]
+
+
+async def compare(engine, filters):
+    legacy_db = Session(engine)
+    async_engine = create_async_db_engine(str(engine.url))
+    try:
+        async with AsyncSession(async_engine) as db:
+            print(f"{'schema':>8} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+            for name, get_proofs in [
+                ("legacy", legacy_get_proofs(legacy_db)),
+                ("current", current_get_proofs(db)),
+            ]:
+                p50, p99 = await time_requests(get_proofs, filters)
+                print(f"{name:>8} {p50 * 1000:>9.2f} {p99 * 1000:>9.2f}")
+    finally:
+        legacy_db.close()
+        await async_engine.dispose()
+
+
+def benchmark_proofs(db_string, rows, payees, requests):
+    engine = create_engine(db_string)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        if db.query(models.Proof).count() > 0:
+            raise Exception("Benchmark against an empty database")
+    try:
+        start = time.perf_counter()
+        fill(engine, rows, payees)
+        print(
+            f"Wrote {rows} proofs to each table in {time.perf_counter() - start:.0f}s"
+        )
+        rng = random.Random(1)
+        filters = [
+            schemas.ProofFilter(
+                payee=payee(rng.randrange(payees)),
+                rewardProgramId=rng.choice(PROGRAMS + [None]),
+            )
+            for _ in range(requests)
+        ]
+        asyncio.run(compare(engine, filters))
+    finally:
+        Base.metadata.drop_all(bind=engine, tables=[LegacyProof.__table__])
+        with engine.begin() as connection:
+            connection.execute(models.Proof.__table__.delete())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time proof lookups against the pickled, unindexed proofs table "
+        "and the current one, in an empty database"
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--payees", type=int, default=50_000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    benchmark_proofs(
+        db_string=os.getenv("DB_STRING", "sqlite:///./benchmark.db"),
+        rows=args.rows,
+        payees=args.payees,
+        requests=args.requests,
+    )
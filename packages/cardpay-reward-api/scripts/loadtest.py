@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+from cardpay_reward_api import models
+from cardpay_reward_api.database import Base
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from .benchmark_proofs import make_rows
+
+
+def get_payees(db_string, fill, payees):
+    """Payees with proofs in the database, adding synthetic proofs if asked to"""
+    engine = create_engine(db_string)
+    Base.metadata.create_all(bind=engine)
+    if fill:
+        rng = random.Random(0)
+        with engine.begin() as connection:
+            for start in range(0, fill, 10_000):
+                connection.execute(
+                    insert(models.Proof.__table__),
+                    make_rows(start, min(10_000, fill - start), payees, rng),
+                )
+    with Session(engine) as db:
+        return list(
+            db.execute(select(models.Proof.payee).distinct().limit(10_000)).scalars()
+        )
+
+
+def wait_for_server(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url).raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise Exception(f"{url} didn't start within {timeout}s")
+
+
+async def load_test(url, payees, rps, duration, timeout):
+    """
+    Send requests for random payees at a fixed rate, whether or not earlier ones
+    have finished, timing each from when it was due to be sent
+    """
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(
+        base_url=url, timeout=timeout, limits=limits
+    ) as client:
+
+        async def request(payee, due):
+            nonlocal errors
+            try:
+                response = await client.get(f"/merkle-proofs/{payee}")
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - due)
+            except httpx.HTTPError:
+                errors += 1
+
+        requests = []
+        start = time.perf_counter()
+        for n in range(int(rps * duration)):
+            due = start + n / rps
+            await asyncio.sleep(max(0, due - time.perf_counter()))
+            requests.append(asyncio.create_task(request(random.choice(payees), due)))
+        await asyncio.gather(*requests)
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{len(requests)} requests in {elapsed:.1f}s ({len(requests) / elapsed:.0f}/s)"
+    )
+    print(f"errors: {errors}")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print(f"p50: {p50 * 1000:.1f}ms p99: {p99 * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report p50/p99 latency of /merkle-proofs/{payee} at a given "
+        "rate of requests, for payees in the DB_STRING database"
+    )
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--rps", type=float, default=100)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument(
+        "--fill", type=int, default=0, help="Add this many synthetic proofs first"
+    )
+    parser.add_argument("--payees", type=int, default=10_000)
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Start the api on the url's port against the same database",
+    )
+    args = parser.parse_args()
+    db_string = os.getenv("DB_STRING", "sqlite:///./load_test.db")
+    payees = get_payees(db_string, args.fill, args.payees)
+    if not payees:
+        sys.exit("There are no proofs in the database, try --fill")
+    server = None
+    if args.serve:
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "cardpay_reward_api.main:app",
+                "--port",
+                str(httpx.URL(args.url).port or 80),
+                "--log-level",
+                "warning",
+            ],
+            env={**os.environ, "DB_STRING": db_string},
+        )
+    try:
+        wait_for_server(args.url)
+        asyncio.run(load_test(args.url, payees, args.rps, args.duration, args.timeout))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
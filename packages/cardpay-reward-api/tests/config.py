@@ -1,5 +1,7 @@
 from cardpay_reward_api.config import get_settings
+from cardpay_reward_api.database import create_async_db_engine
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
 
 settings = get_settings()
@@ -20,3 +22,14 @@ def override_get_db():
         yield db
     finally:
         db.close()
+
+
+async_engine = create_async_db_engine(settings.DB_STRING)
+AsyncTestingSessionLocal = sessionmaker(
+    async_engine, class_=AsyncSession, expire_on_commit=False
+)
+
+
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cardpay_reward_api.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_values_expire_after_ttl():
+    clock = Clock()
+    cache = TTLCache(ttl=5, timer=clock)
+    assert cache.get("a", lambda: 1) == 1
+    clock.now = 4
+    assert cache.get("a", lambda: 2) == 1
+    clock.now = 5
+    assert cache.get("a", lambda: 3) == 3
+
+
+def test_least_recently_used_values_are_evicted():
+    cache = TTLCache(ttl=5, maxsize=2)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: None)
+    cache.get("c", lambda: 3)
+    assert cache.get("a", lambda: None) == 1
+    assert cache.get("b", lambda: 4) == 4
+
+
+def test_failed_loads_are_not_cached():
+    cache = TTLCache(ttl=5)
+
+    def fail():
+        raise ValueError("node unavailable")
+
+    with pytest.raises(ValueError):
+        cache.get("a", fail)
+    assert cache.get("a", lambda: 1) == 1
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(ttl=5)
+    calls = []
+    release = threading.Event()
+
+    def load():
+        calls.append(1)
+        assert release.wait(timeout=10)
+        return 1
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = [executor.submit(cache.get, "a", load) for _ in range(8)]
+        while not calls:
+            pass
+        release.set()
+        assert [result.result() for result in results] == [1] * 8
+    assert len(calls) == 1
+
+
+def test_concurrent_async_misses_share_one_load():
+    cache = TTLCache(ttl=5)
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def main():
+        return await asyncio.gather(*[cache.get_async("a", load) for _ in range(8)])
+
+    assert asyncio.run(main()) == [1] * 8
+    assert len(calls) == 1
+    assert asyncio.run(cache.get_async("a", load)) == 1
+    assert cache.metrics() == {"hits": 1, "misses": 8, "size": 1}
+
+
+def test_failed_async_loads_are_not_cached():
+    cache = TTLCache(ttl=5)
+
+    async def fail():
+        raise ValueError("database unavailable")
+
+    async def load():
+        return 1
+
+    with pytest.raises(ValueError):
+        asyncio.run(cache.get_async("a", fail))
+    assert asyncio.run(cache.get_async("a", load)) == 1
@@ -1,16 +1,26 @@
+import json
+
 import pytest
+from cardpay_reward_api import crud, schemas
 from cardpay_reward_api.config import config
 from cardpay_reward_api.database import Base
-from cardpay_reward_api.main import app, get_db
-from cardpay_reward_api.models import Proof
+from cardpay_reward_api.main import (
+    app,
+    balance_cache,
+    get_db,
+    get_reward_pool,
+    proof_cache,
+    proofs_version_cache,
+)
+from cardpay_reward_api.models import Proof, ProofSummary, Root
 from fastapi.testclient import TestClient
 
-from .config import engine, override_get_db
+from .config import engine, override_get_async_db, override_get_db, settings
 from .utils import check_duplicates_for_proofs, validate_proof_response_fields
 
 # this overrides the get_db function yielding a different session with different engine
 # it is only needed when using dependencies in fastapi
-app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -99,7 +109,8 @@ mock_proofs = [
 ]
 
 
-def test_read_proofs(mock_db):
+@pytest.fixture(scope="module")
+def indexed_proofs(mock_db):
     with mock_db.begin():
         proofs = []
         for o in mock_proofs:
@@ -118,8 +129,194 @@ def test_read_proofs(mock_db):
                 )
             )
         mock_db.bulk_save_objects(proofs)
+    return mock_db
+
+
+def test_read_proofs(indexed_proofs):
     response = client.get("/merkle-proofs/0x159ADe032073d930E85f95AbBAB9995110c43C71")
     res = response.json()
     assert len(res) == 3
     validate_proof_response_fields(res)
     check_duplicates_for_proofs(res)
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_read_proofs_by_cursor(indexed_proofs):
+    url = "/merkle-proofs/0x159ADe032073d930E85f95AbBAB9995110c43C71"
+    first_page = client.get(url, params={"limit": 2})
+    assert [o["leaf"] for o in first_page.json()] == [
+        o["leaf"] for o in mock_proofs[:2]
+    ]
+    second_page = client.get(
+        url, params={"limit": 2, "cursor": first_page.headers["X-Next-Cursor"]}
+    )
+    assert [o["leaf"] for o in second_page.json()] == [mock_proofs[2]["leaf"]]
+    assert "X-Next-Cursor" not in second_page.headers
+
+
+def test_read_proofs_matches_the_response_model(indexed_proofs):
+    res = client.get("/merkle-proofs/0x159ADe032073d930E85f95AbBAB9995110c43C71").json()
+    with indexed_proofs.begin():
+        proofs = indexed_proofs.query(Proof).order_by(Proof.id).all()
+        assert res == [schemas.Proof.from_orm(proof).dict() for proof in proofs]
+
+
+def test_stream_proofs(indexed_proofs, monkeypatch):
+    monkeypatch.setattr(crud, "STREAM_CHUNK_SIZE", 2)
+    url = "/merkle-proofs/0x159ADe032073d930E85f95AbBAB9995110c43C71"
+    response = client.get(url, headers={"Accept": "application/x-ndjson"})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert [json.loads(line) for line in lines] == client.get(url).json()
+    cursor = client.get(url, params={"limit": 1}).headers["X-Next-Cursor"]
+    response = client.get(
+        url, params={"cursor": cursor}, headers={"Accept": "application/x-ndjson"}
+    )
+    assert len(response.text.splitlines()) == 2
+
+
+class FakeRewardPool:
+    def __init__(self):
+        self.calls = 0
+        self.caller = self
+
+    def rewardBalance(self, reward_program_id, token):
+        self.calls += 1
+        return 2 * 10**18
+
+
+def test_reward_pool_balance_is_cached():
+    reward_pool = FakeRewardPool()
+    app.dependency_overrides[get_reward_pool] = lambda: reward_pool
+    balance_cache.clear()
+    try:
+        url = (
+            "/reward-pool-balance/0x5E4E148baae93424B969a0Ea67FF54c315248BbA/"
+            + reward_token_address
+        )
+        for _ in range(3):
+            assert client.get(url).json() == {
+                "rewardProgramId": "0x5E4E148baae93424B969a0Ea67FF54c315248BbA",
+                "token": reward_token_address,
+                "balanceInEth": 2,
+            }
+        assert reward_pool.calls == 1
+    finally:
+        del app.dependency_overrides[get_reward_pool]
+
+
+def test_proofs_are_cached_until_roots_change(indexed_proofs, monkeypatch):
+    monkeypatch.setattr(proofs_version_cache, "ttl", 0)
+    proof_cache.clear()
+    proofs_version_cache.clear()
+    payee = "0x0000000000000000000000000000000000000001"
+    url = f"/merkle-proofs/{payee}"
+    assert client.get(url).json() == []
+    before = client.get("/cache-metrics/").json()["proofs"]
+    assert client.get(url).json() == []
+    after = client.get("/cache-metrics/").json()["proofs"]
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
+
+    # The indexer adds a root with a proof for the payee
+    with indexed_proofs.begin():
+        indexed_proofs.add(
+            Root(
+                rewardProgramId=mock_proofs[0]["rewardProgramId"],
+                rootHash="0x" + "11" * 32,
+                paymentCycle=26779078,
+                blockNumber=26779083,
+            )
+        )
+        indexed_proofs.add(
+            Proof(**{**mock_proofs[0], "payee": payee, "leaf": "0x" + "22" * 32})
+        )
+    assert [o["leaf"] for o in client.get(url).json()] == ["0x" + "22" * 32]
+
+
+def test_read_proof_summaries(mock_db):
+    payee = "0x0000000000000000000000000000000000000002"
+    token = mock_proofs[0]["tokenAddress"]
+    program = mock_proofs[0]["rewardProgramId"]
+    with mock_db.begin():
+        mock_db.add_all(
+            [
+                ProofSummary(
+                    payee=payee,
+                    rewardProgramId=program,
+                    tokenAddress=token,
+                    validFrom=valid_from,
+                    validTo=valid_from + 100,
+                    amount=str(10**21),
+                    proofs=2,
+                )
+                for valid_from in [100, 150]
+            ]
+            + [
+                ProofSummary(
+                    payee=payee,
+                    rewardProgramId="0xother",
+                    tokenAddress=token,
+                    validFrom=100,
+                    validTo=120,
+                    amount="5",
+                    proofs=1,
+                )
+            ]
+        )
+    url = f"/proof-summaries/{payee}"
+    assert client.get(url, params={"rewardProgramId": program}).json() == [
+        {
+            "payee": payee,
+            "rewardProgramId": program,
+            "tokenAddress": token,
+            "amount": str(2 * 10**21),
+            "proofs": 4,
+            "validFrom": 100,
+            "validTo": 250,
+        }
+    ]
+    valid = client.get(url, params={"current_block": 200}).json()
+    assert [(s["rewardProgramId"], s["amount"], s["proofs"]) for s in valid] == [
+        (program, str(10**21), 2)
+    ]
+    assert [s["rewardProgramId"] for s in client.get(url).json()] == [
+        program,
+        "0xother",
+    ]
+    assert client.get(url, params={"token": "0xother"}).json() == []
+
+
+def test_read_proofs_of_payees(indexed_proofs, monkeypatch):
+    monkeypatch.setattr(crud, "STREAM_CHUNK_SIZE", 2)
+    payee = "0x0000000000000000000000000000000000000003"
+    with indexed_proofs.begin():
+        indexed_proofs.add_all(
+            Proof(**{**mock_proofs[0], "payee": payee, "leaf": f"0x{n:064x}"})
+            for n in range(1, 3)
+        )
+    no_proofs = "0x0000000000000000000000000000000000000004"
+    mock_payee = mock_proofs[0]["payee"]
+    response = client.post(
+        "/merkle-proofs/", json={"payees": [no_proofs, mock_payee, payee, payee]}
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["payee"] for line in lines) == sorted(
+        [no_proofs, mock_payee, payee]
+    )
+    for line in lines:
+        assert line["proofs"] == client.get(f"/merkle-proofs/{line['payee']}").json()
+    assert [len(line["proofs"]) for line in lines if line["payee"] == payee] == [2]
+
+    response = client.post(
+        "/merkle-proofs/", json={"payees": [mock_payee, payee], "token": "0xother"}
+    )
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"payee": mock_payee, "proofs": []},
+        {"payee": payee, "proofs": []},
+    ]
+
+    monkeypatch.setattr(settings, "PROOF_BATCH_MAX_PAYEES", 1)
+    response = client.post("/merkle-proofs/", json={"payees": [mock_payee, payee]})
+    assert response.status_code == 422
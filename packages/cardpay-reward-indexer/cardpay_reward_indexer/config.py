@@ -37,6 +37,16 @@ class Settings(BaseSettings):
     REWARDS_BUCKET: str = config["staging"]["rewards_bucket"]
     DB_STRING: str = "postgresql://postgres@localhost:5432/postgres"
     SENTRY_DSN: str = None
+    INDEXER_WORKERS: int = 8
+    # Seconds each transaction of roots should take, which sizes its batches
+    INDEXER_BATCH_SECONDS: float = 5
+    # "poll" to index new roots every 5 seconds, or "events" to index results
+    # as they're written, from INDEXER_QUEUE_URL or by watching REWARDS_BUCKET
+    INDEXER_MODE: str = "poll"
+    INDEXER_QUEUE_URL: str = None
+    # Seconds before a queue message that hasn't been indexed is received again
+    INDEXER_QUEUE_VISIBILITY_TIMEOUT: int = 300
+    RECONCILE_INTERVAL: int = 3600
 
     class Config:
         fields = {
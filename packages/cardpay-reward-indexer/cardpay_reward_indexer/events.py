@@ -0,0 +1,313 @@
+import json
+import logging
+import os
+import queue
+import re
+import time
+from datetime import datetime
+from urllib.parse import unquote_plus
+
+import boto3
+from sqlalchemy.orm import Session
+
+from . import models
+from .indexer import Indexer
+
+RESULTS_KEY = re.compile(
+    r"rewardProgramID=([^/]+)/paymentCycle=(\d+)/results\.parquet$"
+)
+
+
+def parse_results_key(key):
+    """
+    The reward program and payment cycle of a results.parquet key or path,
+    or None if it isn't one
+    """
+    match = RESULTS_KEY.search(key)
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+class Notification:
+    """
+    A results.parquet file was written at created_at (a unix timestamp).
+    message_id is the id of the queue message it was read from, if any
+    """
+
+    def __init__(
+        self, reward_program_id, payment_cycle, created_at=None, message_id=None
+    ):
+        self.reward_program_id = reward_program_id
+        self.payment_cycle = payment_cycle
+        self.created_at = created_at if created_at is not None else time.time()
+        self.message_id = message_id
+
+    @classmethod
+    def from_key(cls, key, created_at=None, message_id=None):
+        parsed = parse_results_key(key)
+        return cls(*parsed, created_at, message_id) if parsed is not None else None
+
+
+class SQSNotifications:
+    """
+    S3 object created notifications, delivered to an SQS queue either directly
+    or through SNS.
+
+    A message is only deleted once all of its notifications are acknowledged.
+    Until then it is received again every visibility_timeout seconds, so
+    notifications that are still pending, or were lost by a restart, are
+    delivered again.
+    """
+
+    def __init__(self, queue_url, client=None, visibility_timeout=300):
+        self.queue_url = queue_url
+        self.client = client or boto3.client("sqs")
+        self.visibility_timeout = visibility_timeout
+        # The latest receipt handle and unacknowledged payment cycles of each
+        # message, by message id
+        self.messages = {}
+
+    def receive(self, timeout):
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=min(int(timeout), 20),
+            VisibilityTimeout=self.visibility_timeout,
+        )
+        notifications = []
+        for message in response.get("Messages", []):
+            message_notifications = []
+            body = json.loads(message["Body"])
+            if "Message" in body:
+                body = json.loads(body["Message"])
+            for record in body.get("Records", []):
+                if not record.get("eventName", "").startswith("ObjectCreated"):
+                    continue
+                notification = Notification.from_key(
+                    unquote_plus(record["s3"]["object"]["key"]),
+                    datetime.fromisoformat(
+                        record["eventTime"].replace("Z", "+00:00")
+                    ).timestamp(),
+                    message["MessageId"],
+                )
+                if notification is not None:
+                    message_notifications.append(notification)
+            if not message_notifications:
+                self.delete(message["ReceiptHandle"])
+                continue
+            # Each delivery of a message has a new receipt handle, and only the
+            # latest can delete it
+            self.messages[message["MessageId"]] = (
+                message["ReceiptHandle"],
+                {(n.reward_program_id, n.payment_cycle) for n in message_notifications},
+            )
+            notifications.extend(message_notifications)
+        return notifications
+
+    def acknowledge(self, notification):
+        """Delete the notification's message once all of its notifications are done"""
+        if notification.message_id not in self.messages:
+            return
+        receipt_handle, keys = self.messages[notification.message_id]
+        keys.discard((notification.reward_program_id, notification.payment_cycle))
+        if not keys:
+            del self.messages[notification.message_id]
+            self.delete(receipt_handle)
+
+    def delete(self, receipt_handle):
+        self.client.delete_message(
+            QueueUrl=self.queue_url, ReceiptHandle=receipt_handle
+        )
+
+
+class QueueNotifications:
+    """Notifications put on a local queue, e.g. by the process writing results"""
+
+    def __init__(self, notifications=None):
+        self.queue = notifications if notifications is not None else queue.Queue()
+
+    def receive(self, timeout):
+        notifications = []
+        try:
+            notifications.append(self.queue.get(timeout=timeout))
+            while True:
+                notifications.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return notifications
+
+    def acknowledge(self, notification):
+        pass
+
+
+class DirectoryNotifications:
+    """
+    Watches a local directory for results.parquet files, standing in for S3
+    notifications when the rewards bucket is a local directory.
+    Files that exist when it starts are left to the reconciliation sweep.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.seen = self.scan()
+
+    def scan(self):
+        files = {}
+        for directory, _, names in os.walk(self.path):
+            if "results.parquet" in names:
+                path = os.path.join(directory, "results.parquet")
+                files[path] = os.stat(path).st_mtime
+        return files
+
+    def receive(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            files = self.scan()
+            new = [
+                Notification.from_key(path.replace(os.sep, "/"), mtime)
+                for path, mtime in files.items()
+                if self.seen.get(path) != mtime
+            ]
+            self.seen = files
+            new = [notification for notification in new if notification is not None]
+            if new or time.monotonic() >= deadline:
+                return new
+            time.sleep(min(1, max(deadline - time.monotonic(), 0)))
+
+    def acknowledge(self, notification):
+        pass
+
+
+class EventIndexer:
+    """
+    Indexes the results of the payment cycles it's notified about, as soon as
+    their roots have been submitted, and logs the index lag: the time from the
+    results being written to their proofs being indexed.
+
+    Results are usually written before their root is submitted, so
+    notifications stay pending, and their roots are looked for every
+    pending_interval seconds, for up to pending_timeout seconds. Every
+    reconcile_interval seconds, a sweep indexes any roots that were missed.
+
+    Notifications are acknowledged once their payment cycle is indexed, or
+    they've been pending for pending_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        indexer: Indexer,
+        notifications,
+        storage_location,
+        reconcile_interval=3600,
+        pending_interval=10,
+        pending_timeout=24 * 3600,
+    ):
+        self.indexer = indexer
+        self.notifications = notifications
+        self.storage_location = storage_location
+        self.reconcile_interval = reconcile_interval
+        self.pending_interval = pending_interval
+        self.pending_timeout = pending_timeout
+        self.pending = {}
+        self.lags = []
+        self.last_reconciled = None
+        self.last_checked = None
+
+    def add(self, notifications):
+        """Returns whether any of the notifications are new"""
+        new = False
+        for notification in notifications:
+            key = (notification.reward_program_id, notification.payment_cycle)
+            if key[0] in self.indexer.archived_reward_programs:
+                self.notifications.acknowledge(notification)
+                continue
+            if key not in self.pending:
+                logging.info(f"Results written for {key[0]} payment cycle {key[1]}")
+                self.pending[key] = [notification]
+                new = True
+            elif all(
+                pending.message_id != notification.message_id
+                for pending in self.pending[key]
+            ):
+                # The results were written again, and this message needs
+                # acknowledging too. Redeliveries of a message are dropped
+                self.pending[key].append(notification)
+        return new
+
+    def finish(self, key):
+        """Stop waiting for a payment cycle and acknowledge its notifications"""
+        for notification in self.pending.pop(key):
+            self.notifications.acknowledge(notification)
+
+    def index_pending(self, db: Session):
+        """Index the pending payment cycles whose roots have been submitted"""
+        self.last_checked = time.monotonic()
+        with db.begin():
+            for key in list(self.pending):
+                if (
+                    db.query(models.Root)
+                    .filter_by(rewardProgramId=key[0], paymentCycle=key[1])
+                    .first()
+                ):
+                    self.finish(key)
+        cycles = {}
+        for reward_program_id, payment_cycle in self.pending:
+            cycles.setdefault(reward_program_id, []).append(payment_cycle)
+        for reward_program_id, payment_cycles in cycles.items():
+            try:
+                roots = self.indexer.get_submitted_roots(
+                    reward_program_id, payment_cycles
+                )
+            except Exception as e:
+                logging.error(f"Failed to get roots of {reward_program_id}: {e}")
+                continue
+            for root in sorted(roots, key=lambda root: int(root["blockNumber"])):
+                key = (reward_program_id, int(root["paymentCycle"]))
+                path = self.indexer.fetch_results(
+                    self.storage_location, reward_program_id, root
+                )
+                if path is None:
+                    continue
+                self.indexer.write_roots(db, reward_program_id, [(root, path)])
+                lag = time.time() - self.pending[key][0].created_at
+                self.finish(key)
+                self.lags.append(lag)
+                logging.info(
+                    f"Indexed {reward_program_id} payment cycle {key[1]}, "
+                    f"{lag:.1f}s after its results were written"
+                )
+        now = time.time()
+        for key, notifications in list(self.pending.items()):
+            if now - notifications[0].created_at > self.pending_timeout:
+                logging.warning(
+                    f"No root submitted for {key[0]} payment cycle {key[1]}, "
+                    "leaving it to the reconciliation sweep"
+                )
+                self.finish(key)
+
+    def run_once(self, db: Session, timeout=1):
+        if (
+            self.last_reconciled is None
+            or time.monotonic() - self.last_reconciled >= self.reconcile_interval
+        ):
+            self.last_reconciled = time.monotonic()
+            logging.info("Reconciling indexed roots with the subgraph")
+            self.indexer.reconcile(db, self.storage_location)
+        new = self.add(self.notifications.receive(timeout))
+        if new or (
+            self.pending
+            and time.monotonic() - self.last_checked >= self.pending_interval
+        ):
+            self.index_pending(db)
+
+    def lag_stats(self):
+        """The count, mean and max index lag, in seconds, since the last call"""
+        lags, self.lags = self.lags, []
+        if not lags:
+            return {"indexed": 0}
+        return {
+            "indexed": len(lags),
+            "mean_lag": sum(lags) / len(lags),
+            "max_lag": max(lags),
+        }
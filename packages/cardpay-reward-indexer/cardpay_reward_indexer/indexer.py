@@ -1,73 +1,483 @@
-import json
 import logging
-from datetime import datetime
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
 
 import eth_abi
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
-import requests
 from cloudpathlib import AnyPath
 from eth_utils import to_checksum_address
 from hexbytes import HexBytes
+from python_subgraph_client import get_client
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Session
 
 from . import models
 
-MAX_INDEX_SIZE = 100
+# Bounds on the number of roots written in one transaction
+MIN_BATCH_SIZE = 1
+MAX_BATCH_SIZE = 500
+# Seconds before a missing results file is looked for again, doubling with
+# each attempt
+MISSING_FILE_BACKOFF = 60
+MAX_MISSING_FILE_BACKOFF = 24 * 3600
+INSERT_CHUNK_SIZE = 5000
+READ_BATCH_SIZE = 50_000
+# Stays under SQLite's default limit of 999 bound parameters
+LEAF_QUERY_SIZE = 900
+ROOT_FIELDS = """
+    rootHash
+    paymentCycle
+    rewardProgram {
+        id
+    }
+    timestamp
+"""
+SUMMARY_KEY_COLUMNS = [
+    "payee",
+    "rewardProgramId",
+    "tokenAddress",
+    "validFrom",
+    "validTo",
+]
+
+
+# The value of each ascii hex digit, 0 for any other byte
+HEX_DIGITS = np.zeros(256, dtype=np.uint64)
+HEX_DIGITS[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+HEX_DIGITS[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+
+
+def hex_to_decimal(words: pa.Array):
+    """
+    Convert an array of 64 digit lower case hex strings (uint256 abi words) to
+    decimal strings, without converting each one to a python int.
+
+    The words are split into 8 32-bit limbs, which are divided by 10**9 over and
+    over, each division giving the next 9 decimal digits.
+    """
+    if len(words) == 0:
+        return pa.array([], pa.string())
+    words = words.cast(pa.binary())
+    offsets = np.frombuffer(words.buffers()[1], dtype=np.int32)[
+        words.offset : words.offset + len(words) + 1
+    ]
+    digits = np.frombuffer(words.buffers()[2], dtype=np.uint8)[offsets[0] : offsets[-1]]
+    limbs = HEX_DIGITS[digits].reshape(len(words), 8, 8) @ (
+        np.uint64(16) ** np.arange(7, -1, -1, dtype=np.uint64)
+    )
+    groups = []
+    while limbs.any():
+        remainder = np.zeros(len(words), dtype=np.uint64)
+        for k in range(8):
+            current = (remainder << np.uint64(32)) | limbs[:, k]
+            limbs[:, k] = current // np.uint64(10**9)
+            remainder = current % np.uint64(10**9)
+        groups.append(pc.utf8_lpad(pa.array(remainder).cast(pa.string()), 9, "0"))
+    if not groups:
+        return pa.array(["0"] * len(words), pa.string())
+    decimal = pc.utf8_ltrim(pc.binary_join_element_wise(*groups[::-1], ""), "0")
+    return pc.if_else(pc.equal(decimal, ""), "0", decimal)
+
+
+def strip_hex_prefix(strings: pa.Array):
+    return pc.if_else(
+        pc.starts_with(strings, "0x"), pc.utf8_slice_codeunits(strings, 2), strings
+    )
+
+
+def hex_to_binary(strings: pa.Array):
+    """Decode an array of hex strings, with or without 0x, to binary, with numpy"""
+    if strings.null_count:
+        raise ValueError("Can't decode null hex strings")
+    strings = strip_hex_prefix(strings).cast(pa.binary())
+    offsets = np.frombuffer(strings.buffers()[1], dtype=np.int32)[
+        strings.offset : strings.offset + len(strings) + 1
+    ]
+    digits = np.frombuffer(strings.buffers()[2], dtype=np.uint8)[
+        offsets[0] : offsets[-1]
+    ]
+    data = (HEX_DIGITS[digits[0::2]] << np.uint64(4)) | HEX_DIGITS[digits[1::2]]
+    return pa.Array.from_buffers(
+        pa.binary(),
+        len(strings),
+        [
+            None,
+            pa.py_buffer(((offsets - offsets[0]) // 2).astype(np.int32)),
+            pa.py_buffer(data.astype(np.uint8)),
+        ],
+    )
+
+
+def proof_array(proofs: pa.ListArray, dialect_name):
+    """
+    The proofs column of results.parquet as bound to Proof.proofArray: lists of
+    bytes on postgres, and the JSON text of 0x prefixed hex strings elsewhere
+    """
+    hashes = proofs.flatten()
+    if dialect_name == "postgresql":
+        offsets = pc.subtract(proofs.offsets, proofs.offsets[0])
+        return pa.ListArray.from_arrays(offsets, hex_to_binary(hashes))
+    hashes = pa.ListArray.from_arrays(
+        pc.subtract(proofs.offsets, proofs.offsets[0]), strip_hex_prefix(hashes)
+    )
+    return pc.if_else(
+        pc.equal(pc.list_value_length(hashes), 0),
+        "[]",
+        pc.binary_join_element_wise('["0x', pc.binary_join(hashes, '","0x'), '"]', ""),
+    )
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def summary_key(row):
+    return tuple(row[column] for column in SUMMARY_KEY_COLUMNS)
+
+
+def add_to_summaries(db: Session, rows):
+    """
+    Add the amounts of newly inserted proof rows to their payees' summaries.
+    Proofs without a token amount aren't summarised.
+    """
+    totals = {}
+    for row in rows:
+        if not row["tokenAddress"]:
+            continue
+        amount, proofs = totals.get(summary_key(row), (0, 0))
+        totals[summary_key(row)] = (amount + int(row["amount"]), proofs + 1)
+    if not totals:
+        return
+    table = models.ProofSummary.__table__
+    existing = {}
+    for payees in chunks(sorted({key[0] for key in totals}), LEAF_QUERY_SIZE):
+        for row in db.execute(select(table).where(table.c.payee.in_(payees))):
+            existing[summary_key(row._mapping)] = row
+    new_summaries = []
+    updates = []
+    for key, (amount, proofs) in totals.items():
+        summary = existing.get(key)
+        if summary is None:
+            new_summaries.append(
+                dict(
+                    zip(SUMMARY_KEY_COLUMNS, key),
+                    amount=str(amount),
+                    proofs=proofs,
+                )
+            )
+        else:
+            updates.append(
+                {
+                    "summary_id": summary.id,
+                    "amount": str(int(summary.amount) + amount),
+                    "proofs": summary.proofs + proofs,
+                }
+            )
+    for chunk in chunks(new_summaries, INSERT_CHUNK_SIZE):
+        db.execute(insert(table), chunk)
+    if updates:
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam("summary_id"))
+            .values(amount=bindparam("amount"), proofs=bindparam("proofs")),
+            updates,
+        )
 
 
 class Indexer:
-    def __init__(self, subgraph_url, archived_reward_programs):
+    def __init__(
+        self, subgraph_url, archived_reward_programs, workers=8, batch_seconds=5
+    ):
         self.subgraph_url = subgraph_url
+        self.subgraph = get_client(subgraph_url)
         self.archived_reward_programs = archived_reward_programs
+        self.workers = workers
+        # Roots are written in transactions of batch_size roots, which is
+        # adjusted so that each takes about batch_seconds
+        self.batch_seconds = batch_seconds
+        self.batch_size = MIN_BATCH_SIZE
 
     def run(self, db: Session, storage_location):
-        reward_program_ids = [o["id"] for o in self.get_reward_programs()]
-        for reward_program_id in reward_program_ids:
-            if reward_program_id not in self.archived_reward_programs:
-                self.index_for_program(db, reward_program_id, storage_location)
+        self.index_programs(db, self.get_active_reward_programs(), storage_location)
+
+    def reconcile(self, db: Session, storage_location):
+        """
+        Index every submitted root that isn't indexed yet, rediscovering the
+        roots of each program from its first block rather than its cursor.
+        A safety net for event driven indexing, which only indexes the roots
+        it hears about.
+        """
+        self.index_programs(
+            db, self.get_active_reward_programs(), storage_location, reconcile=True
+        )
+
+    def get_active_reward_programs(self):
+        return [
+            o["id"]
+            for o in self.get_reward_programs()
+            if o["id"] not in self.archived_reward_programs
+        ]
 
     def index_for_program(self, db: Session, reward_program_id, storage_location):
-        with db.begin():
-            last_submitted_root_block_number = self.get_last_indexed_root_block_number(
-                db, reward_program_id
-            )
+        self.index_programs(db, [reward_program_id], storage_location)
 
-            print(
-                f"Indexing reward program {reward_program_id} since block {last_submitted_root_block_number}"
-            )
-            logging.info(
-                f"Indexing reward program {reward_program_id} since block {last_submitted_root_block_number}"
-            )
-            logging.info("===Start===")
-            new_roots = self.get_merkle_roots(
-                reward_program_id, last_submitted_root_block_number
-            )
-            index_size = min(len(new_roots), MAX_INDEX_SIZE)
-            if len(new_roots) > 0:
-                for root in sorted(
-                    new_roots,
-                    key=lambda x: x["blockNumber"],
-                )[:index_size]:
-                    file_name = (
-                        storage_location
-                        + f"/rewardProgramID={reward_program_id}/paymentCycle={root['paymentCycle']}/results.parquet"
+    def index_programs(
+        self, db: Session, reward_program_ids, storage_location, reconcile=False
+    ):
+        """
+        Discover the new roots of several reward programs, and index every root
+        that is pending or whose missing results file is due to be looked for again.
+
+        Roots are discovered from each program's cursor, or with reconcile from
+        its first block. The subgraph queries and results downloads run
+        concurrently on a pool of threads, keeping a window of downloads ahead of
+        the writes, while the proofs are written from this thread, in batches of
+        one program's downloaded roots. The whole backlog is worked through in
+        one call, however many roots it has.
+        """
+        with db.begin():
+            cursors = {
+                cursor.rewardProgramId: cursor.blockNumber
+                for cursor in db.query(models.IndexingCursor)
+            }
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            discoveries = {
+                executor.submit(
+                    self.get_new_roots,
+                    reward_program_id,
+                    0 if reconcile else cursors.get(reward_program_id, 0),
+                ): reward_program_id
+                for reward_program_id in reward_program_ids
+            }
+            queued = deque()
+            downloads = {}
+            downloaded = []
+            while discoveries or queued or downloads or downloaded:
+                while (
+                    queued
+                    and len(downloads) + len(downloaded)
+                    < self.workers + self.batch_size
+                ):
+                    reward_program_id, root = queued.popleft()
+                    future = executor.submit(
+                        self.fetch_results, storage_location, reward_program_id, root
                     )
-                    s3_path = AnyPath(file_name)
-                    if s3_path.exists():
-                        payment_table = pq.read_table(s3_path)
-                        payment_list = payment_table.to_pylist()
-                        self.add_root_and_proofs(db, root, payment_list)
+                    downloads[future] = (reward_program_id, root)
+                futures = list(discoveries) + list(downloads)
+                if downloaded:
+                    finished = [future for future in futures if future.done()]
+                else:
+                    finished = wait(futures, return_when=FIRST_COMPLETED).done
+                for future in finished:
+                    if future in discoveries:
+                        reward_program_id = discoveries.pop(future)
+                        try:
+                            roots = future.result()
+                        except Exception as e:
+                            logging.error(
+                                f"Failed to get roots of {reward_program_id}: {e}"
+                            )
+                            continue
+                        due = self.add_discovered_roots(db, reward_program_id, roots)
+                        if not due:
+                            logging.info(
+                                f"Skipping indexing {reward_program_id}: No new roots"
+                            )
+                        queued.extend((reward_program_id, root) for root in due)
                     else:
-                        logging.info(f"{file_name} does not exist within s3")
-                db.commit()
-            else:
-                logging.info("Skipping indexing: No new roots")
-            logging.info("===Done===")
+                        reward_program_id, root = downloads.pop(future)
+                        try:
+                            path = future.result()
+                        except Exception as e:
+                            # Left pending, for the next run
+                            logging.error(
+                                f"Failed to download results of {reward_program_id} "
+                                f"payment cycle {root['paymentCycle']}: {e}"
+                            )
+                            continue
+                        downloaded.append((reward_program_id, root, path))
+                if downloaded:
+                    reward_program_id = downloaded[0][0]
+                    batch = []
+                    rest = []
+                    for program, root, path in downloaded:
+                        if (
+                            program == reward_program_id
+                            and len(batch) < self.batch_size
+                        ):
+                            batch.append((root, path))
+                        else:
+                            rest.append((program, root, path))
+                    downloaded = rest
+                    start = time.perf_counter()
+                    self.write_roots(db, reward_program_id, batch)
+                    self.adjust_batch_size(len(batch), time.perf_counter() - start)
+
+    def adjust_batch_size(self, written, elapsed):
+        """
+        Size the next batch to take batch_seconds at the rate of the last one,
+        growing at most twofold at a time
+        """
+        size = int(self.batch_seconds * written / max(elapsed, 1e-3))
+        self.batch_size = max(
+            MIN_BATCH_SIZE, min(size, 2 * self.batch_size, MAX_BATCH_SIZE)
+        )
+
+    def add_discovered_roots(self, db: Session, reward_program_id, roots):
+        """
+        Record the status of newly discovered roots, and move the program's
+        cursor past them. Returns the roots of the program to index now: the
+        pending ones, and the ones whose results file is due to be looked for again.
+        """
+        with db.begin():
+            statuses = {
+                status.paymentCycle: status
+                for status in db.query(models.RootStatus).filter_by(
+                    rewardProgramId=reward_program_id
+                )
+            }
+            indexed = {
+                payment_cycle
+                for (payment_cycle,) in db.query(models.Root.paymentCycle).filter_by(
+                    rewardProgramId=reward_program_id
+                )
+            }
+            for root in roots:
+                payment_cycle = int(root["paymentCycle"])
+                if payment_cycle in statuses:
+                    continue
+                status = models.RootStatus(
+                    rewardProgramId=reward_program_id,
+                    paymentCycle=payment_cycle,
+                    rootHash=root["rootHash"],
+                    blockNumber=int(root["blockNumber"]),
+                    timestamp=int(root["timestamp"]),
+                    status=(
+                        models.ROOT_DONE
+                        if payment_cycle in indexed
+                        else models.ROOT_PENDING
+                    ),
+                    attempts=0,
+                )
+                db.add(status)
+                statuses[payment_cycle] = status
+            if roots:
+                block_number = max(int(root["blockNumber"]) for root in roots)
+                cursor = db.get(models.IndexingCursor, reward_program_id)
+                if cursor is None:
+                    db.add(
+                        models.IndexingCursor(
+                            rewardProgramId=reward_program_id,
+                            blockNumber=block_number,
+                        )
+                    )
+                elif block_number > cursor.blockNumber:
+                    cursor.blockNumber = block_number
+            now = datetime.utcnow()
+            due = [
+                status
+                for status in statuses.values()
+                if status.status == models.ROOT_PENDING
+                or (status.status == models.ROOT_MISSING_FILE and status.retryAt <= now)
+            ]
+            return [
+                {
+                    "rootHash": status.rootHash,
+                    "paymentCycle": str(status.paymentCycle),
+                    "rewardProgram": {"id": status.rewardProgramId},
+                    "blockNumber": str(status.blockNumber),
+                    "timestamp": str(status.timestamp),
+                }
+                for status in sorted(due, key=lambda status: status.blockNumber)
+            ]
 
-    def add_root_and_proofs(self, db: Session, root, payment_list):
+    def get_new_roots(self, reward_program_id, last_submitted_root_block_number):
+        print(
+            f"Indexing reward program {reward_program_id} since block {last_submitted_root_block_number}"
+        )
         logging.info(
-            f"Indexing {len(payment_list)} proofs for payment cycle {root['paymentCycle']}"
+            f"Indexing reward program {reward_program_id} since block {last_submitted_root_block_number}"
         )
+        new_roots = self.get_merkle_roots(
+            reward_program_id, last_submitted_root_block_number
+        )
+        return sorted(new_roots, key=lambda x: int(x["blockNumber"]))
+
+    def fetch_results(self, storage_location, reward_program_id, root):
+        """
+        Download the results of a root, returning their local path,
+        or None if they haven't been written
+        """
+        file_name = (
+            storage_location
+            + f"/rewardProgramID={reward_program_id}/paymentCycle={root['paymentCycle']}/results.parquet"
+        )
+        s3_path = AnyPath(file_name)
+        if s3_path.exists():
+            return os.fspath(s3_path)
+        else:
+            logging.info(f"{file_name} does not exist within s3")
+            return None
+
+    def write_roots(self, db: Session, reward_program_id, roots):
+        """
+        Index some roots of a reward program in one transaction, marking them
+        done, or if their results file doesn't exist, missing until it's looked
+        for again after a backoff
+        """
+        with db.begin():
+            logging.info(f"===Start {reward_program_id}===")
+            for root, path in roots:
+                if path is not None:
+                    self.add_root_and_proofs(db, root, self.read_payment_batches(path))
+                self.set_root_status(db, root, path is not None)
+            logging.info(f"===Done {reward_program_id}===")
+
+    def set_root_status(self, db: Session, root, indexed):
+        status = (
+            db.query(models.RootStatus)
+            .filter_by(
+                rewardProgramId=root["rewardProgram"]["id"],
+                paymentCycle=int(root["paymentCycle"]),
+            )
+            .first()
+        )
+        if status is None:
+            status = models.RootStatus(
+                rewardProgramId=root["rewardProgram"]["id"],
+                paymentCycle=int(root["paymentCycle"]),
+                rootHash=root["rootHash"],
+                blockNumber=int(root["blockNumber"]),
+                timestamp=int(root["timestamp"]),
+                attempts=0,
+            )
+            db.add(status)
+        status.attempts += 1
+        if indexed:
+            status.status = models.ROOT_DONE
+            status.retryAt = None
+        else:
+            status.status = models.ROOT_MISSING_FILE
+            status.retryAt = datetime.utcnow() + timedelta(
+                seconds=min(
+                    MISSING_FILE_BACKOFF * 2 ** (status.attempts - 1),
+                    MAX_MISSING_FILE_BACKOFF,
+                )
+            )
+
+    def add_root_and_proofs(self, db: Session, root, payment_batches):
+        """
+        Index a root and its proofs, streaming the results one record batch at a time
+        """
+        logging.info(f"Indexing proofs for payment cycle {root['paymentCycle']}")
         existing_root = (
             db.query(models.Root)
             .filter_by(
@@ -85,46 +495,165 @@ class Indexer:
                 timestamp=datetime.fromtimestamp(int(root["timestamp"])),
             )
             db.add(new_root)
-        leafs = []
-        proofs = []
-        for payment in payment_list:
-            token, amount = self.decode_payment(payment)
-            explanation_data_v = payment.get("explanationData", {})
-            explanation_data = (
-                json.loads(explanation_data_v)
-                if isinstance(explanation_data_v, str)
-                else dict(explanation_data_v)
-            )
-            # explanation_data_v of str represents the new column format
-            # new column format: string (that can be parsed to json)
-            # old column format, map<string, string> (a dictionary)
-            i = models.Proof(
-                rootHash=payment["root"],
-                paymentCycle=payment["paymentCycle"],
-                tokenAddress=to_checksum_address(token) if token else "",
-                payee=payment["payee"],
-                proofArray=payment["proof"],
-                rewardProgramId=payment["rewardProgramID"],
-                amount=str(amount),
-                leaf=payment["leaf"],
-                validFrom=payment["validFrom"],
-                validTo=payment["validTo"],
-                explanationId=payment.get("explanationId"),
-                explanationData=explanation_data,
+        start = time.perf_counter()
+        read = 0
+        written = 0
+        for batch in payment_batches:
+            read += batch.num_rows
+            written += self.insert_proofs(
+                db, self.proof_rows(batch, db.get_bind().dialect.name)
             )
-            proofs.append(i)
-            leafs.append(payment["leaf"])
-        for existing_proof in (
-            db.query(models.Proof).filter(models.Proof.leaf.in_(leafs)).all()
-        ):
-            try:
-                i = list(p.leaf == existing_proof.leaf for p in proofs).index(
-                    True
-                )  # find index of new proofs that already has leaf in db
-                del proofs[i]  # remove that proof from the array
-            except ValueError:
-                pass
-        db.add_all(proofs)
+        elapsed = time.perf_counter() - start
+        logging.info(
+            f"Wrote {written} of {read} proofs in {elapsed:.2f}s "
+            f"({read / max(elapsed, 1e-9):.0f} rows/s)"
+        )
+
+    def proof_rows(self, batch: pa.RecordBatch, dialect_name="sqlite"):
+        """
+        Convert a record batch of results.parquet to proof rows. The columns are
+        transformed in arrow, and converted to python once, as a whole. Proof
+        arrays are converted to what is bound for the database's dialect: lists
+        of bytes for postgres' bytea[], JSON text elsewhere.
+        """
+        tokens, amounts = self.decode_leaves(batch.column("leaf"))
+        columns = {
+            "rootHash": batch.column("root"),
+            "paymentCycle": batch.column("paymentCycle"),
+            "tokenAddress": tokens,
+            "payee": batch.column("payee"),
+            "proofArray": proof_array(batch.column("proof"), dialect_name),
+            "rewardProgramId": batch.column("rewardProgramID"),
+            "amount": amounts,
+            "leaf": batch.column("leaf"),
+            "validFrom": batch.column("validFrom"),
+            "validTo": batch.column("validTo"),
+            "explanationId": (
+                batch.column("explanationId")
+                if "explanationId" in batch.schema.names
+                else pa.nulls(batch.num_rows, pa.string())
+            ),
+        }
+        explanation_data = self.explanation_data(batch)
+        if isinstance(explanation_data, pa.Array):
+            columns["explanationData"] = explanation_data
+        rows = pa.RecordBatch.from_pydict(columns).to_pylist()
+        if not isinstance(explanation_data, pa.Array):
+            for row, data in zip(rows, explanation_data):
+                row["explanationData"] = data
+        return rows
+
+    def explanation_data(self, batch: pa.RecordBatch):
+        if "explanationData" not in batch.schema.names:
+            return pa.array(["{}"] * batch.num_rows)
+        column = batch.column("explanationData")
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            # The new column format is JSON text, which is stored as is
+            return column.fill_null("{}")
+        # The old column format is map<string, string>
+        return [dict(v) if v is not None else {} for v in column.to_pylist()]
+
+    def decode_leaves(self, leaves: pa.Array):
+        """
+        Decode the token address and amount of a column of leaves, as arrow
+        string arrays.
+
+        Leaves are the abi encoding of (address, uint256, uint256, uint256,
+        uint256 tokenType, address, bytes transferData), so with the usual
+        encoding the transfer data's token and amount are at fixed offsets and
+        can be sliced out of the hex strings without decoding each leaf.
+        Token checksums are computed once per distinct token, and amounts are
+        converted from hex to decimal with numpy. Any other encoding falls back
+        to decode_payment.
+        """
+        hex_leaves = pc.utf8_lower(pc.replace_substring_regex(leaves, "^0x", ""))
+
+        def word(i):
+            return pc.utf8_slice_codeunits(hex_leaves, i * 64, (i + 1) * 64)
+
+        is_token = pc.equal(word(4), f"{1:064x}")
+        # The transfer data follows the 7 head words, and is 2 words long
+        standard = pc.and_(
+            pc.and_(
+                pc.equal(word(6), f"{7 * 32:064x}"),
+                pc.equal(word(7), f"{2 * 32:064x}"),
+            ),
+            pc.equal(pc.utf8_length(word(9)), 64),
+        )
+        standard_token = pc.and_(is_token, standard)
+        token_hex = pc.utf8_slice_codeunits(hex_leaves, 8 * 64 + 24, 9 * 64)
+        distinct = pc.unique(pc.filter(token_hex, standard_token))
+        checksums = pa.array(
+            [to_checksum_address(token) for token in distinct.to_pylist()],
+            pa.string(),
+        )
+        tokens = pc.if_else(
+            standard_token,
+            pc.take(checksums, pc.index_in(token_hex, value_set=distinct)),
+            "",
+        )
+        amounts = pc.if_else(
+            standard_token,
+            hex_to_decimal(pc.if_else(standard_token, word(9), "0" * 64)),
+            "None",
+        )
+        other = np.flatnonzero(
+            pc.and_(is_token, pc.invert(standard)).to_numpy(zero_copy_only=False)
+        )
+        if len(other) == 0:
+            return tokens, amounts
+        tokens = tokens.to_pylist()
+        amounts = amounts.to_pylist()
+        for i in other:
+            token, amount = self.decode_payment({"leaf": leaves[i].as_py()})
+            tokens[i] = to_checksum_address(token) if token else ""
+            amounts[i] = str(amount)
+        return pa.array(tokens, pa.string()), pa.array(amounts, pa.string())
+
+    def insert_proofs(self, db: Session, rows):
+        """
+        Insert proof rows in chunks, skipping any whose leaf is already indexed,
+        and add the inserted proofs to the payees' summaries.
+        Returns the number of proofs inserted.
+        """
+        unique_rows = {}
+        for row in rows:
+            unique_rows.setdefault(row["leaf"], row)
+        rows = list(unique_rows.values())
+        table = models.Proof.__table__
+        inserted = []
+        if db.get_bind().dialect.name == "postgresql":
+            # Let the unique index on leaf drop the duplicates, and return the
+            # leaves that were inserted. A multi-row VALUES with 12 columns stays
+            # under postgres' limit of 65535 bound parameters
+            for chunk in chunks(rows, INSERT_CHUNK_SIZE):
+                leaves = {
+                    leaf
+                    for (leaf,) in db.execute(
+                        postgresql.insert(table)
+                        .values(chunk)
+                        .on_conflict_do_nothing(index_elements=["leaf"])
+                        .returning(table.c.leaf)
+                    )
+                }
+                inserted.extend(row for row in chunk if row["leaf"] in leaves)
+        else:
+            existing = set()
+            for chunk in chunks([row["leaf"] for row in rows], LEAF_QUERY_SIZE):
+                existing.update(
+                    leaf
+                    for (leaf,) in db.query(models.Proof.leaf).filter(
+                        models.Proof.leaf.in_(chunk)
+                    )
+                )
+            inserted = [row for row in rows if row["leaf"] not in existing]
+            for chunk in chunks(inserted, INSERT_CHUNK_SIZE):
+                db.execute(insert(table), chunk)
+        add_to_summaries(db, inserted)
+        return len(inserted)
+
+    def read_payment_batches(self, path):
+        return pq.ParquetFile(path).iter_batches(batch_size=READ_BATCH_SIZE)
 
     def decode_payment(self, payment):
         _, _, _, _, token_type, _, transfer_data = eth_abi.decode_abi(
@@ -136,67 +665,29 @@ class Indexer:
         else:
             return (None, None)
 
-    def get_last_indexed_root_block_number(self, db: Session, reward_program_id: str):
-        o = (
-            db.query(models.Root)
-            .filter(models.Root.rewardProgramId == reward_program_id)
-            .order_by(models.Root.blockNumber.desc())
-            .first()
+    def get_merkle_roots(self, reward_program_id: str, block_number: int):
+        return list(
+            self.subgraph.paginate(
+                "merkleRootSubmissions",
+                ROOT_FIELDS,
+                where={"rewardProgram": reward_program_id},
+                cursor="blockNumber",
+                after=block_number,
+            )
         )
-        return o.blockNumber if o is not None else 0
 
-    def get_merkle_roots(self, reward_program_id: str, block_number: int):
-        query = """
-        {
-            merkleRootSubmissions(
-                where: {
-                    rewardProgram: "%s",
-                    blockNumber_gt: %d
+    def get_submitted_roots(self, reward_program_id, payment_cycles):
+        """The submitted roots of some payment cycles of a reward program"""
+        return list(
+            self.subgraph.paginate(
+                "merkleRootSubmissions",
+                ROOT_FIELDS,
+                where={
+                    "rewardProgram": reward_program_id,
+                    "paymentCycle_in": [str(cycle) for cycle in payment_cycles],
                 },
-                orderBy: blockNumber,
-                orderDirection: asc
-            ){
-                id
-                blockNumber
-                rootHash
-                paymentCycle
-                rewardProgram {
-                    id
-                }
-                timestamp
-            }
-        }
-        """ % (
-            reward_program_id,
-            block_number,
+            )
         )
-        return self.query_subgraph(query)["merkleRootSubmissions"]
 
     def get_reward_programs(self):
-        query = """
-        {
-            rewardPrograms(
-                orderBy: id, orderDirection: desc)
-            {
-                id
-            }
-        }
-        """
-        return self.query_subgraph(query)["rewardPrograms"]
-
-    def query_subgraph(self, query):
-        try:
-            r = requests.post(
-                self.subgraph_url,
-                json={"query": query},
-            )
-            if r.ok:
-                json_data = r.json()
-                return json_data["data"]
-            else:
-                raise (r.raise_for_status())
-        except requests.exceptions.ConnectionError:
-            logging.warn("Connection error during query subgraph")
-        except Exception as e:
-            logging.warn("Error when querying subgraph")
-            raise (e)
+        return list(self.subgraph.paginate("rewardPrograms"))
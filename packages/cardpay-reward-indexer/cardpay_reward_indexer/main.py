@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 
 from . import models
 from .config import config, get_settings
+from .events import DirectoryNotifications, EventIndexer, SQSNotifications
 from .indexer import Indexer
 
 LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
@@ -48,12 +49,50 @@ def run_task(indexer, storage_location):
         logging.error(e)
 
 
+def run_events(indexer):
+    """
+    Index results as they're written, reconciling with the subgraph every
+    RECONCILE_INTERVAL seconds
+    """
+    if settings.INDEXER_QUEUE_URL is not None:
+        notifications = SQSNotifications(
+            settings.INDEXER_QUEUE_URL,
+            visibility_timeout=settings.INDEXER_QUEUE_VISIBILITY_TIMEOUT,
+        )
+    elif settings.REWARDS_BUCKET.startswith("s3://"):
+        raise ValueError("Set INDEXER_QUEUE_URL to index an s3 bucket's results")
+    else:
+        notifications = DirectoryNotifications(settings.REWARDS_BUCKET)
+    event_indexer = EventIndexer(
+        indexer,
+        notifications,
+        settings.REWARDS_BUCKET,
+        reconcile_interval=settings.RECONCILE_INTERVAL,
+    )
+    last_reported = time.monotonic()
+    while True:
+        try:
+            with Session(engine) as db:
+                event_indexer.run_once(db, timeout=10)
+        except Exception as e:
+            logging.error(e)
+            time.sleep(1)
+        if time.monotonic() - last_reported >= 60:
+            last_reported = time.monotonic()
+            logging.info(f"Index lag: {event_indexer.lag_stats()}")
+
+
 def run_all():
     # create session and add objects
     indexer = Indexer(
         settings.SUBGRAPH_URL,
         config[settings.ENVIRONMENT]["archived_reward_programs"],
+        workers=settings.INDEXER_WORKERS,
+        batch_seconds=settings.INDEXER_BATCH_SECONDS,
     )
+    if settings.INDEXER_MODE == "events":
+        run_events(indexer)
+        return
 
     frequency = 5  # 5 seconds
     schedule.every(frequency).seconds.do(run_task, indexer, settings.REWARDS_BUCKET)
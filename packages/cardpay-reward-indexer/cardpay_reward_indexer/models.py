@@ -1,9 +1,100 @@
-from sqlalchemy import Column, DateTime, Integer, PickleType, String, UniqueConstraint
-from sqlalchemy.ext.mutable import MutableList
+import json
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    Text,
+    TypeDecorator,
+    UniqueConstraint,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import UserDefinedType
 
 from .database import Base
 
 
+def as_hex(value):
+    if isinstance(value, str):
+        return value if value.startswith("0x") else "0x" + value
+    return "0x" + bytes(value).hex()
+
+
+class HexArray(TypeDecorator):
+    """
+    A list of hex strings, stored as bytea[] on postgres and as JSON text elsewhere.
+    Read back as 0x prefixed hex strings. Bytes are bound as they are on postgres,
+    and strings are taken to be JSON text already elsewhere.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.ARRAY(postgresql.BYTEA))
+        return dialect.type_descriptor(Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == "postgresql":
+            return [
+                v if isinstance(v, bytes) else bytes.fromhex(as_hex(v)[2:])
+                for v in value
+            ]
+        if isinstance(value, str):
+            # Already JSON text, as the indexer renders it
+            return value
+        return json.dumps([as_hex(v) for v in value])
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return json.loads(value)
+        return [as_hex(v) for v in value]
+
+
+class _JSONB(UserDefinedType):
+    """jsonb that binds JSON text as is, rather than dumping a python object"""
+
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "JSONB"
+
+
+class JSONText(TypeDecorator):
+    """
+    JSON, stored as jsonb on postgres and as text elsewhere.
+
+    Strings are taken to be JSON text already, and written without being parsed,
+    so explanationData can go straight from results.parquet to the database.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(_JSONB())
+        return dialect.type_descriptor(Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        # psycopg2 already parses jsonb
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+
 class Proof(Base):
     __tablename__ = "proofs"
     id = Column(Integer, primary_key=True, index=True)
@@ -11,14 +102,25 @@ class Proof(Base):
     paymentCycle = Column(Integer)
     tokenAddress = Column(String)
     payee = Column(String)
-    proofArray = Column(MutableList.as_mutable(PickleType), default=[])
+    proofArray = Column(HexArray, default=[])
     rewardProgramId = Column(String)
     amount = Column(String)
     leaf = Column(String, unique=True)
     validFrom = Column(Integer)
     validTo = Column(Integer)
     explanationId = Column(String, nullable=True)
-    explanationData = Column(PickleType, default={})
+    explanationData = Column(JSONText, default={})
+    __table_args__ = (
+        # Matches the filters of /merkle-proofs/{payee}
+        Index(
+            "ix_proofs_payee_rewardProgramId_tokenAddress",
+            "payee",
+            "rewardProgramId",
+            "tokenAddress",
+        ),
+        # Pages of proofs are in id order
+        Index("ix_proofs_payee_id", "payee", "id"),
+    )
 
 
 class Root(Base):
@@ -34,3 +136,70 @@ class Root(Base):
             "rewardProgramId", "paymentCycle", name="rewardProgramId_paymentCycle"
         ),
     )
+
+
+class ProofSummary(Base):
+    """
+    The total amount and number of proofs of each payee, reward program, token
+    and validity window, kept up to date by the indexer as it inserts proofs
+    """
+
+    __tablename__ = "proof_summaries"
+    id = Column(Integer, primary_key=True, index=True)
+    payee = Column(String)
+    rewardProgramId = Column(String)
+    tokenAddress = Column(String)
+    validFrom = Column(Integer)
+    validTo = Column(Integer)
+    # In wei, as a string like Proof.amount
+    amount = Column(String)
+    proofs = Column(Integer)
+    __table_args__ = (
+        # Summaries are looked up by payee
+        UniqueConstraint(
+            "payee",
+            "rewardProgramId",
+            "tokenAddress",
+            "validFrom",
+            "validTo",
+            name="proof_summaries_key",
+        ),
+    )
+
+
+class IndexingCursor(Base):
+    """The block up to which the roots of each reward program have been discovered"""
+
+    __tablename__ = "indexing_cursors"
+    rewardProgramId = Column(String, primary_key=True)
+    blockNumber = Column(Integer)
+
+
+ROOT_PENDING = "pending"
+ROOT_DONE = "done"
+ROOT_MISSING_FILE = "missing_file"
+
+
+class RootStatus(Base):
+    """
+    Every submitted root the indexer has discovered, and whether its proofs
+    are pending, done, or waiting for a results file that didn't exist yet,
+    to be looked for again at retryAt
+    """
+
+    __tablename__ = "root_statuses"
+    id = Column(Integer, primary_key=True, index=True)
+    rewardProgramId = Column(String)
+    paymentCycle = Column(Integer)
+    rootHash = Column(String)
+    blockNumber = Column(Integer)
+    # A unix timestamp, as the subgraph has it
+    timestamp = Column(Integer)
+    status = Column(String, default=ROOT_PENDING)
+    attempts = Column(Integer, default=0)
+    retryAt = Column(DateTime, nullable=True)
+    __table_args__ = (
+        UniqueConstraint("rewardProgramId", "paymentCycle", name="root_statuses_key"),
+        # Roots to index are looked up by program and status
+        Index("ix_root_statuses_rewardProgramId_status", "rewardProgramId", "status"),
+    )
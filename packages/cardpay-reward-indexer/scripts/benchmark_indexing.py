@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import eth_abi
+import pyarrow as pa
+import pyarrow.parquet as pq
+import sqlalchemy.orm
+from cardpay_reward_indexer import models
+from cardpay_reward_indexer.indexer import Indexer
+from sqlalchemy import create_engine
+
+REWARD_PROGRAM_ID = "0x5E4E148baae93424B969a0Ea67FF54c315248BbA"
+TOKEN = "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f"
+PAYMENT_CYCLE = 26777325
+
+
+def make_payments(rows, seed=0):
+    """A synthetic results.parquet table for one payment cycle"""
+    rng = random.Random(seed)
+    payments = []
+    for _ in range(rows):
+        payee = "0x" + rng.getrandbits(160).to_bytes(20, "big").hex()
+        amount = rng.getrandbits(64)
+        leaf = eth_abi.encode_abi(
+            ["address", "uint256", "uint256", "uint256", "uint256", "address", "bytes"],
+            [
+                REWARD_PROGRAM_ID,
+                PAYMENT_CYCLE,
+                PAYMENT_CYCLE,
+                PAYMENT_CYCLE + 100_000,
+                1,
+                payee,
+                eth_abi.encode_abi(["address", "uint256"], [TOKEN, amount]),
+            ],
+        ).hex()
+        payments.append(
+            {
+                "rewardProgramID": REWARD_PROGRAM_ID,
+                "paymentCycle": PAYMENT_CYCLE,
+                "validFrom": PAYMENT_CYCLE,
+                "validTo": PAYMENT_CYCLE + 100_000,
+                "tokenType": 1,
+                "payee": payee,
+                "root": "0x" + "00" * 32,
+                "leaf": leaf,
+                "proof": [rng.getrandbits(256).to_bytes(32, "big").hex()] * 18,
+                "explanationId": "flat_payment",
+                "explanationData": json.dumps({"amount": str(amount), "token": TOKEN}),
+            }
+        )
+    return pa.Table.from_pylist(payments)
+
+
+def benchmark_indexing(db_string, rows):
+    engine = create_engine(db_string)
+    models.Base.metadata.create_all(bind=engine)
+    root = {
+        "blockNumber": PAYMENT_CYCLE + 5,
+        "paymentCycle": PAYMENT_CYCLE,
+        "rewardProgram": {"id": REWARD_PROGRAM_ID},
+        "timestamp": "1653901895",
+        "rootHash": "0x" + "00" * 32,
+    }
+    db = sqlalchemy.orm.Session(engine)
+    with db.begin():
+        if db.query(models.Proof).count() > 0:
+            raise Exception("Benchmark against an empty database")
+    results = os.path.join(tempfile.mkdtemp(), "results.parquet")
+    pq.write_table(make_payments(rows), results)
+    indexer = Indexer(None, [])
+    try:
+        for run in ["new", "existing"]:
+            db = sqlalchemy.orm.Session(engine)
+            start = time.perf_counter()
+            with db.begin():
+                indexer.add_root_and_proofs(
+                    db, root, indexer.read_payment_batches(results)
+                )
+            elapsed = time.perf_counter() - start
+            print(
+                f"{rows} {run} proofs in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s)"
+            )
+    finally:
+        with db.begin():
+            db.query(models.Proof).delete()
+            db.query(models.ProofSummary).delete()
+            db.query(models.Root).delete()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time indexing a synthetic payment cycle into an empty database"
+    )
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+    benchmark_indexing(
+        db_string=os.getenv("DB_STRING", "sqlite:///./benchmark.db"),
+        rows=args.rows,
+    )
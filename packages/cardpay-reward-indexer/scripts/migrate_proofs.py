@@ -0,0 +1,167 @@
+import argparse
+import os
+
+from cardpay_reward_indexer import models
+from cardpay_reward_indexer.indexer import SUMMARY_KEY_COLUMNS, add_to_summaries
+from sqlalchemy import (
+    Column,
+    Integer,
+    LargeBinary,
+    MetaData,
+    PickleType,
+    String,
+    Table,
+    create_engine,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+)
+
+LEGACY_TABLE = "proofs_pickle"
+
+legacy_proofs = Table(
+    LEGACY_TABLE,
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("rootHash", String),
+    Column("paymentCycle", Integer),
+    Column("tokenAddress", String),
+    Column("payee", String),
+    Column("proofArray", PickleType),
+    Column("rewardProgramId", String),
+    Column("amount", String),
+    Column("leaf", String),
+    Column("validFrom", Integer),
+    Column("validTo", Integer),
+    Column("explanationId", String),
+    Column("explanationData", PickleType),
+)
+
+
+def has_pickled_proofs(engine):
+    inspector = inspect(engine)
+    if not inspector.has_table("proofs"):
+        return False
+    for column in inspector.get_columns("proofs"):
+        if column["name"] == "proofArray":
+            return isinstance(column["type"], LargeBinary) or (
+                str(column["type"]) == "BLOB"
+            )
+    return False
+
+
+def migrate_proofs(engine, batch_size=10_000, keep_old=False):
+    """
+    Move proofs from the old table, with pickled proofArray and explanationData
+    columns, to the current schema, keeping their ids. If the table is already
+    migrated, just create any missing indexes.
+    """
+    if not has_pickled_proofs(engine):
+        # create_all doesn't add new indexes to existing tables
+        for index in models.Proof.__table__.indexes:
+            index.create(engine, checkfirst=True)
+        print("The proofs table is already up to date")
+        build_summaries(engine, batch_size)
+        return 0
+    migrated = 0
+    with engine.begin() as connection:
+        # A plain copy, so the new table can reuse the names of the indexes,
+        # constraints and id sequence
+        connection.execute(text(f"CREATE TABLE {LEGACY_TABLE} AS SELECT * FROM proofs"))
+        connection.execute(text("DROP TABLE proofs"))
+        models.Proof.__table__.create(connection)
+
+        last_id = -1
+        while True:
+            rows = [
+                dict(row._mapping)
+                for row in connection.execute(
+                    select(legacy_proofs)
+                    .where(legacy_proofs.c.id > last_id)
+                    .order_by(legacy_proofs.c.id)
+                    .limit(batch_size)
+                )
+            ]
+            if not rows:
+                break
+            for row in rows:
+                row["proofArray"] = list(row["proofArray"] or [])
+                row["explanationData"] = dict(row["explanationData"] or {})
+            connection.execute(insert(models.Proof.__table__), rows)
+            last_id = rows[-1]["id"]
+            migrated += len(rows)
+            print(f"Migrated {migrated} proofs")
+
+        if engine.dialect.name == "postgresql":
+            # Carry on numbering new proofs after the copied ids
+            connection.execute(
+                select(
+                    func.setval(
+                        func.pg_get_serial_sequence("proofs", "id"),
+                        func.coalesce(func.max(models.Proof.id), 0) + 1,
+                        False,
+                    )
+                )
+            )
+        if not keep_old:
+            legacy_proofs.drop(connection)
+    build_summaries(engine, batch_size)
+    return migrated
+
+
+def build_summaries(engine, batch_size=10_000):
+    """
+    Summarise the proofs of a database that was indexed before the indexer kept
+    proof summaries. Does nothing if there are summaries already.
+    """
+    summaries = models.ProofSummary.__table__
+    summaries.create(engine, checkfirst=True)
+    proofs = models.Proof.__table__
+    summarised = 0
+    with engine.begin() as connection:
+        if connection.execute(select(func.count()).select_from(summaries)).scalar():
+            return 0
+        last_id = -1
+        while True:
+            rows = [
+                dict(row._mapping)
+                for row in connection.execute(
+                    select(
+                        proofs.c.id,
+                        proofs.c.amount,
+                        *[proofs.c[column] for column in SUMMARY_KEY_COLUMNS],
+                    )
+                    .where(proofs.c.id > last_id)
+                    .order_by(proofs.c.id)
+                    .limit(batch_size)
+                )
+            ]
+            if not rows:
+                break
+            add_to_summaries(connection, rows)
+            last_id = rows[-1]["id"]
+            summarised += len(rows)
+            print(f"Summarised {summarised} proofs")
+    return summarised
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate proofs with pickled columns to the current schema"
+    )
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument(
+        "--keep-old",
+        action="store_true",
+        help=f"Keep the old table as {LEGACY_TABLE} after migrating",
+    )
+    args = parser.parse_args()
+    migrate_proofs(
+        create_engine(
+            os.getenv("DB_STRING", "postgresql://postgres@localhost:5432/postgres")
+        ),
+        batch_size=args.batch_size,
+        keep_old=args.keep_old,
+    )
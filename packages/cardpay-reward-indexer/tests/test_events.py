@@ -0,0 +1,284 @@
+import json
+import time
+from datetime import datetime, timezone
+
+import pytest
+from cardpay_reward_indexer.database import Base
+from cardpay_reward_indexer.events import (
+    DirectoryNotifications,
+    EventIndexer,
+    Notification,
+    QueueNotifications,
+    SQSNotifications,
+    parse_results_key,
+)
+from cardpay_reward_indexer.indexer import Indexer
+from cardpay_reward_indexer.models import Proof, Root
+from python_subgraph_client.testing import MockSubgraph
+
+from .config import engine, override_get_db, settings
+from .mocks import (
+    extra_one_merkle_roots,
+    merkle_roots,
+    other_merkle_roots,
+    reward_programs,
+)
+
+program = "0x5E4E148baae93424B969a0Ea67FF54c315248BbA"
+
+
+@pytest.fixture()
+def mock_db():
+    Base.metadata.create_all(bind=engine)
+    db = next(override_get_db())
+    yield db
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture()
+def subgraph():
+    with MockSubgraph(
+        {
+            "rewardPrograms": reward_programs,
+            "merkleRootSubmissions": merkle_roots + other_merkle_roots,
+        }
+    ) as subgraph:
+        yield subgraph
+
+
+def indexed_cycles(db):
+    with db.begin():
+        return sorted(cycle for (cycle,) in db.query(Root.paymentCycle))
+
+
+def test_parse_results_key():
+    assert parse_results_key(
+        f"rewardProgramID={program}/paymentCycle=26777325/results.parquet"
+    ) == (program, 26777325)
+    assert parse_results_key(
+        f"tests/resources/rewardProgramID={program}/paymentCycle=1/results.parquet"
+    ) == (program, 1)
+    assert parse_results_key(f"rewardProgramID={program}/paymentCycle=1/x") is None
+
+
+def test_index_only_notified_payment_cycles(subgraph, mock_db):
+    event_indexer = EventIndexer(
+        Indexer(subgraph.url, []), QueueNotifications(), settings.REWARDS_BUCKET
+    )
+    event_indexer.add([Notification(program, 26777601, time.time() - 5)])
+    event_indexer.index_pending(mock_db)
+    assert indexed_cycles(mock_db) == [26777601]
+    with mock_db.begin():
+        assert {cycle for (cycle,) in mock_db.query(Proof.paymentCycle)} == {26777601}
+    assert event_indexer.pending == {}
+    assert "rewardPrograms" not in "".join(subgraph.queries)
+    stats = event_indexer.lag_stats()
+    assert stats["indexed"] == 1
+    assert stats["max_lag"] >= 5
+
+
+def test_notified_payment_cycle_waits_for_its_root(subgraph, mock_db):
+    notifications = QueueNotifications()
+    event_indexer = EventIndexer(
+        Indexer(subgraph.url, []),
+        notifications,
+        settings.REWARDS_BUCKET,
+        pending_interval=0,
+    )
+    # Skip the first reconciliation sweep
+    event_indexer.last_reconciled = time.monotonic()
+    root = extra_one_merkle_roots[0]
+    notifications.queue.put(Notification(program, int(root["paymentCycle"])))
+    event_indexer.run_once(mock_db, timeout=0)
+    assert indexed_cycles(mock_db) == []
+    assert list(event_indexer.pending) == [(program, int(root["paymentCycle"]))]
+
+    subgraph.entities["merkleRootSubmissions"].append(root)
+    event_indexer.run_once(mock_db, timeout=0)
+    assert indexed_cycles(mock_db) == [int(root["paymentCycle"])]
+    assert event_indexer.pending == {}
+
+
+def test_reconcile_indexes_roots_behind_the_cursor(subgraph, mock_db):
+    # The subgraph hasn't caught up with the first root yet
+    late_root = subgraph.entities["merkleRootSubmissions"].pop(0)
+    indexer = Indexer(subgraph.url, [])
+    indexer.run(mock_db, settings.REWARDS_BUCKET)
+    assert len(indexed_cycles(mock_db)) == 3
+    subgraph.entities["merkleRootSubmissions"].append(late_root)
+    # Polling only looks for roots after the cursor
+    indexer.run(mock_db, settings.REWARDS_BUCKET)
+    assert len(indexed_cycles(mock_db)) == 3
+    event_indexer = EventIndexer(indexer, QueueNotifications(), settings.REWARDS_BUCKET)
+    event_indexer.run_once(mock_db, timeout=0)
+    assert len(indexed_cycles(mock_db)) == 4
+
+
+def test_directory_notifications(tmp_path):
+    def write(cycle):
+        path = tmp_path / f"rewardProgramID={program}/paymentCycle={cycle}"
+        path.mkdir(parents=True)
+        (path / "results.parquet").write_bytes(b"")
+
+    write(1)
+    notifications = DirectoryNotifications(str(tmp_path))
+    assert notifications.receive(0) == []
+    write(2)
+    assert [
+        (n.reward_program_id, n.payment_cycle) for n in notifications.receive(0)
+    ] == [(program, 2)]
+    assert notifications.receive(0) == []
+
+
+class FakeSQS:
+    def __init__(self, messages):
+        self.messages = messages
+        self.deleted = []
+        self.visibility_timeouts = []
+
+    def receive_message(self, **kwargs):
+        self.visibility_timeouts.append(kwargs.get("VisibilityTimeout"))
+        messages, self.messages = self.messages, []
+        return {"Messages": messages}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.deleted.append(ReceiptHandle)
+
+
+def s3_event(*keys, event_time="2022-06-01T00:00:00.000Z"):
+    return {
+        "Records": [
+            {
+                "eventName": "ObjectCreated:Put",
+                "eventTime": event_time,
+                "s3": {"object": {"key": key}},
+            }
+            for key in keys
+        ]
+    }
+
+
+def results_key(payment_cycle):
+    return f"rewardProgramID%3D{program}/paymentCycle%3D{payment_cycle}/results.parquet"
+
+
+def test_sqs_notifications():
+    event = s3_event(results_key(7), "other/file.txt")
+    sqs = FakeSQS(
+        [
+            {"MessageId": "1", "Body": json.dumps(event), "ReceiptHandle": "direct"},
+            {
+                "MessageId": "2",
+                "Body": json.dumps({"Message": json.dumps(event)}),
+                "ReceiptHandle": "through sns",
+            },
+            {
+                "MessageId": "3",
+                "Body": json.dumps(s3_event("other/file.txt")),
+                "ReceiptHandle": "no results",
+            },
+        ]
+    )
+    sqs_notifications = SQSNotifications("queue", client=sqs, visibility_timeout=60)
+    notifications = sqs_notifications.receive(1)
+    assert [(n.reward_program_id, n.payment_cycle) for n in notifications] == [
+        (program, 7),
+        (program, 7),
+    ]
+    assert notifications[0].created_at == 1654041600
+    assert sqs.visibility_timeouts == [60]
+    # Messages are only deleted once their notifications are acknowledged
+    assert sqs.deleted == ["no results"]
+    for notification in notifications:
+        sqs_notifications.acknowledge(notification)
+    assert sqs.deleted == ["no results", "direct", "through sns"]
+
+
+def test_sqs_message_is_deleted_once_all_its_cycles_are_acknowledged():
+    sqs = FakeSQS(
+        [
+            {
+                "MessageId": "1",
+                "Body": json.dumps(s3_event(results_key(7), results_key(8))),
+                "ReceiptHandle": "first",
+            }
+        ]
+    )
+    sqs_notifications = SQSNotifications("queue", client=sqs)
+    first, second = sqs_notifications.receive(1)
+    sqs_notifications.acknowledge(first)
+    assert sqs.deleted == []
+    sqs_notifications.acknowledge(second)
+    assert sqs.deleted == ["first"]
+
+
+def test_sqs_messages_are_deleted_once_indexed(subgraph, mock_db):
+    late_root = extra_one_merkle_roots[0]
+    late_cycle = int(late_root["paymentCycle"])
+    now = datetime.now(timezone.utc).isoformat()
+    sqs = FakeSQS(
+        [
+            {
+                "MessageId": "1",
+                "Body": json.dumps(s3_event(results_key(26777601), event_time=now)),
+                "ReceiptHandle": "indexed",
+            },
+            {
+                "MessageId": "2",
+                "Body": json.dumps(s3_event(results_key(late_cycle), event_time=now)),
+                "ReceiptHandle": "pending",
+            },
+        ]
+    )
+    event_indexer = EventIndexer(
+        Indexer(subgraph.url, []),
+        SQSNotifications("queue", client=sqs),
+        settings.REWARDS_BUCKET,
+        pending_interval=0,
+    )
+    # Skip the first reconciliation sweep
+    event_indexer.last_reconciled = time.monotonic()
+    event_indexer.run_once(mock_db, timeout=0)
+    assert indexed_cycles(mock_db) == [26777601]
+    assert sqs.deleted == ["indexed"]
+
+    # The pending message is received again after its visibility timeout
+    sqs.messages.append(
+        {
+            "MessageId": "2",
+            "Body": json.dumps(s3_event(results_key(late_cycle), event_time=now)),
+            "ReceiptHandle": "pending again",
+        }
+    )
+    event_indexer.run_once(mock_db, timeout=0)
+    assert list(event_indexer.pending) == [(program, late_cycle)]
+    assert sqs.deleted == ["indexed"]
+
+    subgraph.entities["merkleRootSubmissions"].append(late_root)
+    event_indexer.run_once(mock_db, timeout=0)
+    assert indexed_cycles(mock_db) == [26777601, late_cycle]
+    assert event_indexer.pending == {}
+    # Deleted with the receipt handle of its latest delivery
+    assert sqs.deleted == ["indexed", "pending again"]
+
+
+def test_sqs_messages_are_deleted_when_no_root_is_submitted(subgraph, mock_db):
+    sqs = FakeSQS(
+        [
+            {
+                "MessageId": "1",
+                "Body": json.dumps(s3_event(results_key(1))),
+                "ReceiptHandle": "never submitted",
+            }
+        ]
+    )
+    event_indexer = EventIndexer(
+        Indexer(subgraph.url, []),
+        SQSNotifications("queue", client=sqs),
+        settings.REWARDS_BUCKET,
+        pending_timeout=0,
+    )
+    event_indexer.add(event_indexer.notifications.receive(0))
+    event_indexer.index_pending(mock_db)
+    assert event_indexer.pending == {}
+    assert sqs.deleted == ["never submitted"]
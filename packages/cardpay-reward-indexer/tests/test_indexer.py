@@ -1,14 +1,38 @@
 #
 
+import json
+import random
+import shutil
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import eth_abi
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
+from cardpay_reward_indexer import indexer as indexer_module
 from cardpay_reward_indexer.database import Base
-from cardpay_reward_indexer.indexer import Indexer
-from cardpay_reward_indexer.models import Proof, Root
+from cardpay_reward_indexer.indexer import Indexer, hex_to_decimal, proof_array
+from cardpay_reward_indexer.models import (
+    ROOT_DONE,
+    ROOT_MISSING_FILE,
+    IndexingCursor,
+    Proof,
+    ProofSummary,
+    Root,
+    RootStatus,
+)
+from eth_utils import to_checksum_address
+from python_subgraph_client.testing import MockSubgraph
 
 from .config import engine, override_get_db, settings
 from .mocks import (
     extra_one_merkle_roots_for_program,
+    extra_one_merkle_roots_old_file,
     extra_one_merkle_roots_without_s3,
+    merkle_roots,
+    other_merkle_roots,
     reward_programs,
     roots_for_program,
 )
@@ -112,3 +136,422 @@ def test_indexer_run_twice_should_not_add_new_rows(indexer, mock_db, monkeypatch
         proofs = mock_db.query(Proof).all()
     assert len(roots) == 4
     assert len(proofs) == 41
+
+
+def test_index_from_subgraph(mock_db):
+    with MockSubgraph(
+        {
+            "rewardPrograms": reward_programs,
+            "merkleRootSubmissions": merkle_roots + other_merkle_roots,
+        }
+    ) as subgraph:
+        subgraph.fail(502)
+        indexer = Indexer(subgraph.url, [])
+        indexer.run(mock_db, settings.REWARDS_BUCKET)
+        with mock_db.begin():
+            assert mock_db.query(Root).count() == 4
+            assert mock_db.query(Proof).count() == 41
+        queries = len(subgraph.queries)
+        indexer.run(mock_db, settings.REWARDS_BUCKET)
+        assert "blockNumber_gt: 26778059" in "".join(subgraph.queries[queries:])
+    assert indexer.subgraph.latency()["merkleRootSubmissions"]["queries"] == 2 * len(
+        reward_programs
+    )
+
+
+def read_payments(reward_program_id, payment_cycle):
+    return pq.read_table(
+        f"{settings.REWARDS_BUCKET}/rewardProgramID={reward_program_id}"
+        f"/paymentCycle={payment_cycle}/results.parquet"
+    )
+
+
+def test_add_root_and_proofs_skips_duplicate_and_existing_leaves(mock_db):
+    indexer = Indexer(None, [])
+    root = merkle_roots[0]
+    payments = read_payments(root["rewardProgram"]["id"], root["paymentCycle"])
+    with mock_db.begin():
+        indexer.add_root_and_proofs(
+            mock_db,
+            root,
+            pa.concat_tables([payments[:3], payments[:2]]).to_batches(),
+        )
+    with mock_db.begin():
+        assert mock_db.query(Proof).count() == 3
+    with mock_db.begin():
+        indexer.add_root_and_proofs(mock_db, root, payments.to_batches(max_chunksize=7))
+    with mock_db.begin():
+        leaves = [leaf for (leaf,) in mock_db.query(Proof.leaf)]
+        assert mock_db.query(Root).count() == 1
+    assert sorted(leaves) == sorted(payments.column("leaf").to_pylist())
+
+
+def test_insert_proofs_queries_existing_leaves_in_chunks(mock_db, monkeypatch):
+    monkeypatch.setattr(indexer_module, "LEAF_QUERY_SIZE", 2)
+    monkeypatch.setattr(indexer_module, "INSERT_CHUNK_SIZE", 3)
+    indexer = Indexer(None, [])
+    root = merkle_roots[0]
+    payments = read_payments(root["rewardProgram"]["id"], root["paymentCycle"])
+    with mock_db.begin():
+        indexer.add_root_and_proofs(
+            mock_db, root, payments.take(list(range(0, len(payments), 2))).to_batches()
+        )
+    with mock_db.begin():
+        indexer.add_root_and_proofs(mock_db, root, payments.to_batches())
+    with mock_db.begin():
+        assert mock_db.query(Proof).count() == len(payments)
+        proof = mock_db.query(Proof).filter_by(leaf=payments["leaf"][1].as_py()).one()
+    assert proof.proofArray == ["0x" + p for p in payments["proof"][1].as_py()]
+    assert proof.payee == payments["payee"][1].as_py()
+
+
+def summaries_of_proofs(db):
+    totals = {}
+    for proof in db.query(Proof).filter(Proof.tokenAddress != ""):
+        key = (
+            proof.payee,
+            proof.rewardProgramId,
+            proof.tokenAddress,
+            proof.validFrom,
+            proof.validTo,
+        )
+        amount, proofs = totals.get(key, (0, 0))
+        totals[key] = (amount + int(proof.amount), proofs + 1)
+    return {key: (str(amount), proofs) for key, (amount, proofs) in totals.items()}
+
+
+def summaries(db):
+    return {
+        (s.payee, s.rewardProgramId, s.tokenAddress, s.validFrom, s.validTo): (
+            s.amount,
+            s.proofs,
+        )
+        for s in db.query(ProofSummary)
+    }
+
+
+@pytest.mark.parametrize("indexer", [[]], indirect=["indexer"])
+def test_summaries_add_up_indexed_proofs(indexer, mock_db, monkeypatch):
+    monkeypatch.setattr(indexer_module, "LEAF_QUERY_SIZE", 2)
+    indexer.run(mock_db, settings.REWARDS_BUCKET)
+    with mock_db.begin():
+        expected = summaries_of_proofs(mock_db)
+        assert len(expected) > 0
+        assert summaries(mock_db) == expected
+
+    # Proofs that are already indexed aren't counted again,
+    # and new proofs are added to the existing summaries
+    root = merkle_roots[0]
+    payments = read_payments(root["rewardProgram"]["id"], root["paymentCycle"])
+    types = ["address", "uint256", "uint256", "uint256", "uint256", "address", "bytes"]
+    program, _, valid_from, valid_to, _, payee, transfer_data = eth_abi.decode_abi(
+        types, bytes.fromhex(payments["leaf"][0].as_py())
+    )
+    token, amount = eth_abi.decode_abi(["address", "uint256"], transfer_data)
+    new_leaf = eth_abi.encode_abi(
+        types,
+        [
+            program,
+            int(root["paymentCycle"]) + 1,
+            valid_from,
+            valid_to,
+            1,
+            payee,
+            eth_abi.encode_abi(["address", "uint256"], [token, 7]),
+        ],
+    ).hex()
+    new_payment = payments.slice(0, 1).set_column(
+        payments.schema.get_field_index("leaf"), "leaf", pa.array([new_leaf])
+    )
+    with mock_db.begin():
+        indexer.add_root_and_proofs(
+            mock_db, root, pa.concat_tables([payments, new_payment]).to_batches()
+        )
+    with mock_db.begin():
+        assert summaries(mock_db) == summaries_of_proofs(mock_db)
+    key = (
+        to_checksum_address(payee),
+        root["rewardProgram"]["id"],
+        to_checksum_address(token),
+        valid_from,
+        valid_to,
+    )
+    assert summaries(mock_db)[key] == (
+        str(int(expected[key][0]) + 7),
+        expected[key][1] + 1,
+    )
+
+
+def test_proof_rows_match_row_by_row_decoding():
+    indexer = Indexer(None, [])
+    for path in Path(settings.REWARDS_BUCKET).glob("*/*/results.parquet"):
+        table = pq.read_table(path)
+        rows = [
+            row for batch in table.to_batches() for row in indexer.proof_rows(batch)
+        ]
+        assert len(rows) == len(table)
+        for payment, row in zip(table.to_pylist(), rows):
+            token, amount = indexer.decode_payment(payment)
+            assert row["tokenAddress"] == to_checksum_address(token)
+            assert row["amount"] == str(amount)
+            assert row["explanationData"] == dict(payment["explanationData"])
+            assert json.loads(row["proofArray"]) == [
+                "0x" + proof for proof in payment["proof"]
+            ]
+
+
+def test_proof_arrays_are_rendered_for_the_dialect():
+    proofs = pa.array(
+        [["ab" * 32, "0x" + "cd" * 32], [], ["ef" * 32]], pa.list_(pa.string())
+    ).slice(1)
+    assert proof_array(proofs, "sqlite").to_pylist() == [
+        "[]",
+        json.dumps(["0x" + "ef" * 32], separators=(",", ":")),
+    ]
+    assert proof_array(proofs, "postgresql").to_pylist() == [
+        [],
+        [bytes.fromhex("ef" * 32)],
+    ]
+    both = pa.array([["ab" * 32, "0x" + "cd" * 32]], pa.list_(pa.string()))
+    assert json.loads(proof_array(both, "sqlite")[0].as_py()) == [
+        "0x" + "ab" * 32,
+        "0x" + "cd" * 32,
+    ]
+    assert proof_array(both, "postgresql")[0].as_py() == [
+        bytes.fromhex("ab" * 32),
+        bytes.fromhex("cd" * 32),
+    ]
+
+
+def test_decode_leaves_falls_back_for_other_encodings():
+    indexer = Indexer(None, [])
+    types = ["address", "uint256", "uint256", "uint256", "uint256", "address", "bytes"]
+    payee = "0x159ADe032073d930E85f95AbBAB9995110c43C71"
+    token = "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f"
+    transfer_data = eth_abi.encode_abi(["address", "uint256"], [token, 2**200])
+    leaves = [
+        eth_abi.encode_abi(types, [payee, 1, 2, 3, 1, payee, transfer_data]).hex(),
+        "0x" + eth_abi.encode_abi(types, [payee, 1, 2, 3, 0, payee, b""]).hex(),
+        # transfer data with trailing bytes, so it isn't at the usual offsets
+        eth_abi.encode_abi(
+            types, [payee, 1, 2, 3, 1, payee, transfer_data + b"\x00" * 32]
+        ).hex(),
+    ]
+    tokens, amounts = indexer.decode_leaves(pa.array(leaves))
+    assert tokens.to_pylist() == [token, "", token]
+    assert amounts.to_pylist() == [str(2**200), "None", str(2**200)]
+
+
+def test_hex_to_decimal():
+    values = [0, 1, 10**9, 2**64, 2**200, 2**256 - 1] + [
+        random.getrandbits(bits) for bits in range(1, 257)
+    ]
+    # Sliced, so the array doesn't start at the start of its buffers
+    words = pa.array(["x"] + [f"{value:064x}" for value in values]).slice(1)
+    assert hex_to_decimal(words).to_pylist() == [str(value) for value in values]
+
+
+def test_json_explanation_data_is_stored_as_is(mock_db):
+    indexer = Indexer(None, [])
+    root = merkle_roots[0]
+    payments = read_payments(root["rewardProgram"]["id"], root["paymentCycle"])
+    explanation_data = [
+        json.dumps({"amount": str(n), "rollover": [n, n + 1]})
+        for n in range(len(payments) - 1)
+    ] + [None]
+    payments = payments.set_column(
+        payments.schema.get_field_index("explanationData"),
+        "explanationData",
+        pa.array(explanation_data),
+    )
+    with mock_db.begin():
+        indexer.add_root_and_proofs(mock_db, root, payments.to_batches())
+    with mock_db.begin():
+        stored = {
+            proof.leaf: (proof.explanationData, proof.proofArray)
+            for proof in mock_db.query(Proof)
+        }
+    for leaf, data, proof in zip(
+        payments["leaf"].to_pylist(), explanation_data, payments["proof"].to_pylist()
+    ):
+        assert stored[leaf] == (
+            json.loads(data) if data else {},
+            ["0x" + p for p in proof],
+        )
+
+
+@pytest.mark.parametrize("indexer", [[]], indirect=["indexer"])
+def test_slow_downloads_do_not_hold_up_other_programs(indexer, mock_db, monkeypatch):
+    slow_program = "0x5E4E148baae93424B969a0Ea67FF54c315248BbA"
+    other_written = threading.Event()
+    written = []
+    fetch_results = Indexer.fetch_results
+    write_roots = Indexer.write_roots
+
+    def slow_fetch_results(self, storage_location, reward_program_id, root):
+        if reward_program_id == slow_program:
+            assert other_written.wait(timeout=10)
+        return fetch_results(self, storage_location, reward_program_id, root)
+
+    def record_write_roots(self, db, reward_program_id, roots):
+        write_roots(self, db, reward_program_id, roots)
+        if roots:
+            written.append(reward_program_id)
+            other_written.set()
+
+    monkeypatch.setattr(Indexer, "fetch_results", slow_fetch_results)
+    monkeypatch.setattr(Indexer, "write_roots", record_write_roots)
+    indexer.run(mock_db, settings.REWARDS_BUCKET)
+    # The slow program's roots may be written over several batches
+    assert list(dict.fromkeys(written)) == [
+        "0x2F57D4cf81c87A92dd5f0686fEc6e02887662d07",
+        slow_program,
+    ]
+    with mock_db.begin():
+        assert mock_db.query(Root).count() == 4
+        assert mock_db.query(Proof).count() == 41
+
+
+@pytest.mark.parametrize("indexer", [[]], indirect=["indexer"])
+def test_failing_program_does_not_stop_others(indexer, mock_db, monkeypatch):
+    def get_merkle_roots(_, reward_program_id, block_number):
+        if reward_program_id == "0x2F57D4cf81c87A92dd5f0686fEc6e02887662d07":
+            raise Exception("subgraph error")
+        return roots_for_program(reward_program_id, block_number)
+
+    monkeypatch.setattr(Indexer, "get_merkle_roots", get_merkle_roots)
+    indexer.run(mock_db, settings.REWARDS_BUCKET)
+    with mock_db.begin():
+        assert mock_db.query(Root).count() == 3
+        assert mock_db.query(Proof).count() == 41
+
+
+def root_statuses(db):
+    with db.begin():
+        return {
+            status.paymentCycle: (status.status, status.attempts, status.retryAt)
+            for status in db.query(RootStatus)
+        }
+
+
+@pytest.mark.parametrize("indexer", [[]], indirect=["indexer"])
+def test_missing_results_file_is_retried_with_backoff(
+    indexer, mock_db, monkeypatch, tmp_path
+):
+    shutil.copytree(settings.REWARDS_BUCKET, tmp_path, dirs_exist_ok=True)
+    monkeypatch.setattr(
+        Indexer,
+        "get_merkle_roots",
+        lambda _, reward_program_id, block_number: [
+            root
+            for root in roots_for_program(reward_program_id, block_number)
+            + extra_one_merkle_roots_without_s3(reward_program_id, block_number)
+            if int(root["blockNumber"]) > block_number
+        ],
+    )
+    indexer.run(mock_db, str(tmp_path))
+    status, attempts, retry_at = root_statuses(mock_db)[27000000]
+    assert (status, attempts) == (ROOT_MISSING_FILE, 1)
+    assert retry_at > datetime.utcnow() + timedelta(seconds=50)
+    with mock_db.begin():
+        assert mock_db.query(Root).count() == 4
+
+    # The file isn't looked for again until the backoff has passed
+    fetched = []
+    fetch_results = Indexer.fetch_results
+
+    def record_fetch_results(self, storage_location, reward_program_id, root):
+        fetched.append(int(root["paymentCycle"]))
+        return fetch_results(self, storage_location, reward_program_id, root)
+
+    monkeypatch.setattr(Indexer, "fetch_results", record_fetch_results)
+    indexer.run(mock_db, str(tmp_path))
+    assert fetched == []
+
+    with mock_db.begin():
+        mock_db.query(RootStatus).filter_by(paymentCycle=27000000).update(
+            {"retryAt": datetime.utcnow()}
+        )
+    indexer.run(mock_db, str(tmp_path))
+    assert fetched == [27000000]
+    status, attempts, retry_at = root_statuses(mock_db)[27000000]
+    assert (status, attempts) == (ROOT_MISSING_FILE, 2)
+    assert retry_at > datetime.utcnow() + timedelta(seconds=110)
+
+    # The results are written late
+    program_path = (
+        tmp_path / "rewardProgramID=0x5E4E148baae93424B969a0Ea67FF54c315248BbA"
+    )
+    (program_path / "paymentCycle=27000000").mkdir()
+    shutil.copy(
+        program_path / "paymentCycle=26779200/results.parquet",
+        program_path / "paymentCycle=27000000/results.parquet",
+    )
+    with mock_db.begin():
+        mock_db.query(RootStatus).filter_by(paymentCycle=27000000).update(
+            {"retryAt": datetime.utcnow()}
+        )
+    indexer.run(mock_db, str(tmp_path))
+    assert root_statuses(mock_db)[27000000] == (ROOT_DONE, 3, None)
+    with mock_db.begin():
+        assert mock_db.query(Root).count() == 5
+
+
+@pytest.mark.parametrize("indexer", [[]], indirect=["indexer"])
+def test_backlog_is_indexed_in_one_run(indexer, mock_db, monkeypatch):
+    program = "0x5E4E148baae93424B969a0Ea67FF54c315248BbA"
+    # More roots than could be indexed in one run before, the first 3 with results
+    roots = merkle_roots + [
+        {
+            **extra_one_merkle_roots_old_file[0],
+            "blockNumber": str(27000000 + n),
+            "paymentCycle": str(27000000 + n),
+        }
+        for n in range(150)
+    ]
+    monkeypatch.setattr(
+        Indexer,
+        "get_merkle_roots",
+        lambda _, reward_program_id, block_number: [
+            root
+            for root in (roots if reward_program_id == program else [])
+            if int(root["blockNumber"]) > block_number
+        ],
+    )
+    indexer.run(mock_db, settings.REWARDS_BUCKET)
+    statuses = root_statuses(mock_db)
+    assert len(statuses) == 153
+    assert sum(status == ROOT_DONE for status, _, _ in statuses.values()) == 3
+    with mock_db.begin():
+        assert mock_db.query(Root).count() == 3
+        assert mock_db.get(IndexingCursor, program).blockNumber == 27000149
+
+
+@pytest.mark.parametrize("indexer", [[]], indirect=["indexer"])
+def test_roots_indexed_before_statuses_are_done(indexer, mock_db):
+    for root in merkle_roots:
+        with mock_db.begin():
+            indexer.add_root_and_proofs(mock_db, root, [])
+    indexer.run(mock_db, settings.REWARDS_BUCKET)
+    assert root_statuses(mock_db) == {
+        int(root["paymentCycle"]): (ROOT_DONE, 0 if root in merkle_roots else 1, None)
+        for root in merkle_roots + other_merkle_roots
+    }
+    with mock_db.begin():
+        # The proofs of the roots that were already indexed aren't written again
+        assert mock_db.query(Proof).count() == 0
+
+
+def test_batch_size_follows_time_budget():
+    indexer = Indexer(None, [], batch_seconds=5)
+    assert indexer.batch_size == 1
+    # Grows at most twofold at a time
+    indexer.adjust_batch_size(1, 0.01)
+    assert indexer.batch_size == 2
+    indexer.adjust_batch_size(2, 0.01)
+    assert indexer.batch_size == 4
+    # Shrinks to what fits in the budget
+    indexer.adjust_batch_size(4, 10)
+    assert indexer.batch_size == 2
+    indexer.adjust_batch_size(2, 60)
+    assert indexer.batch_size == 1
@@ -0,0 +1,122 @@
+import pytest
+from cardpay_reward_indexer.models import Proof, ProofSummary
+from scripts.migrate_proofs import has_pickled_proofs, migrate_proofs
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    PickleType,
+    String,
+    Table,
+    create_engine,
+    inspect,
+)
+from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy.orm import Session
+
+legacy_metadata = MetaData()
+legacy_proofs = Table(
+    "proofs",
+    legacy_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("rootHash", String),
+    Column("paymentCycle", Integer),
+    Column("tokenAddress", String),
+    Column("payee", String),
+    Column("proofArray", MutableList.as_mutable(PickleType), default=[]),
+    Column("rewardProgramId", String),
+    Column("amount", String),
+    Column("leaf", String, unique=True),
+    Column("validFrom", Integer),
+    Column("validTo", Integer),
+    Column("explanationId", String, nullable=True),
+    Column("explanationData", PickleType, default={}),
+)
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+
+
+@pytest.mark.parametrize("keep_old", [True, False])
+def test_migrate_pickled_proofs(engine, keep_old):
+    legacy_metadata.create_all(engine)
+    rows = [
+        {
+            "id": n * 10,
+            "payee": f"0x{n}",
+            "proofArray": [f"{n:064x}", "ff" * 32] if n else [],
+            "leaf": f"{n:0128x}",
+            "explanationData": {"amount": str(n)} if n % 2 else {},
+        }
+        for n in range(5)
+    ]
+    with engine.begin() as connection:
+        connection.execute(legacy_proofs.insert(), rows)
+    assert has_pickled_proofs(engine)
+
+    assert migrate_proofs(engine, batch_size=2, keep_old=keep_old) == 5
+    assert not has_pickled_proofs(engine)
+    assert inspect(engine).has_table("proofs_pickle") == keep_old
+    with Session(engine) as db:
+        proofs = db.query(Proof).order_by(Proof.id).all()
+        assert [
+            (p.id, p.payee, p.proofArray, p.leaf, p.explanationData) for p in proofs
+        ] == [
+            (
+                row["id"],
+                row["payee"],
+                ["0x" + proof for proof in row["proofArray"]],
+                row["leaf"],
+                row["explanationData"],
+            )
+            for row in rows
+        ]
+        db.add(Proof(payee="0x5", leaf="new", proofArray=[]))
+        db.commit()
+        assert db.query(Proof).filter_by(leaf="new").one().id == 41
+    assert migrate_proofs(engine) == 0
+
+
+def test_migrate_creates_missing_indexes(engine):
+    Proof.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_proofs_payee_id")
+    assert migrate_proofs(engine) == 0
+    assert "ix_proofs_payee_id" in [
+        index["name"] for index in inspect(engine).get_indexes("proofs")
+    ]
+
+
+def test_migrate_builds_missing_summaries(engine):
+    Proof.__table__.create(engine)
+    with Session(engine) as db:
+        db.add_all(
+            [
+                Proof(
+                    payee=f"0x{n % 2}",
+                    rewardProgramId="0xprogram",
+                    tokenAddress="0xtoken" if n < 5 else "",
+                    amount=str(10**20 + n) if n < 5 else "None",
+                    validFrom=1,
+                    validTo=2,
+                    leaf=f"{n:064x}",
+                )
+                for n in range(6)
+            ]
+        )
+        db.commit()
+    assert migrate_proofs(engine, batch_size=2) == 0
+    with Session(engine) as db:
+        assert sorted(
+            (s.payee, s.tokenAddress, s.amount, s.proofs)
+            for s in db.query(ProofSummary)
+        ) == [
+            ("0x0", "0xtoken", str(3 * 10**20 + 6), 3),
+            ("0x1", "0xtoken", str(2 * 10**20 + 4), 2),
+        ]
+    # Existing summaries are kept up to date by the indexer
+    migrate_proofs(engine)
+    with Session(engine) as db:
+        assert db.query(ProofSummary).count() == 2
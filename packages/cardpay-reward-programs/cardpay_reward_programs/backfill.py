@@ -0,0 +1,269 @@
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List
+
+import pyarrow as pa
+import typer
+from cloudpathlib import AnyPath
+
+from .multipart import DEFAULT_CONCURRENCY, DEFAULT_PART_SIZE
+from .payment_tree import PaymentTree
+from .rule import Rule
+from .rules import *  # noqa: F403 F401
+from .utils import configure_default_storage, write_parquet_batches
+
+
+def get_rule_class(rule_name):
+    for subclass in Rule.__subclasses__():
+        if subclass.__name__ == rule_name:
+            return subclass
+    raise ValueError(f"Unknown rule {rule_name}")
+
+
+def write_results(
+    rule,
+    payments,
+    parameters,
+    location,
+    max_batch_bytes=None,
+    part_size=DEFAULT_PART_SIZE,
+    concurrency=DEFAULT_CONCURRENCY,
+):
+    """Write a cycle's payments to results.parquet, and the rule's state if it keeps any"""
+    tree = PaymentTree(payments, parameters)
+    write_parquet_batches(
+        location,
+        tree.schema(),
+        tree.record_batches(max_batch_bytes=max_batch_bytes),
+        part_size=part_size,
+        concurrency=concurrency,
+    )
+    rule.save_state(location / "state.parquet")
+
+
+def run_payment_cycles(
+    rule, parameters, payment_cycles, output_location, previous_output=None, **options
+):
+    """Run and write a sequence of payment cycles of a program.
+
+    Rollover programs add the unclaimed rewards of each cycle to the next, so the
+    cycles must be consecutive, with previous_output the results of the cycle before
+    the first (if there was one).
+
+    Args:
+        rule (Rule): The rule to run
+        parameters (dict): The program's parameters, with its reward_program_id in run
+        payment_cycles (Iterable[int]): The payment cycles to run
+        output_location (Path): Where to write paymentCycle=<cycle>/results.parquet
+        previous_output (str, optional): The results.parquet of the previous cycle
+        options: Passed to write_results
+
+    Yields:
+        Tuple[int, int]: Each payment cycle once written, and its number of payments
+    """
+    run_parameters = parameters["run"]
+    for payment_cycle, payments in rule.run_cycles(
+        payment_cycles, run_parameters["reward_program_id"]
+    ):
+        cycle_parameters = {
+            **run_parameters,
+            "payment_cycle": payment_cycle,
+            "previous_output": previous_output,
+        }
+        if previous_output is None:
+            # There's nothing to roll over into the first cycle of a program
+            cycle_parameters["rewards_subgraph_location"] = None
+        payments = rule.add_rollover(
+            payments,
+            payment_cycle,
+            previous_output,
+            cycle_parameters.get("rewards_subgraph_location"),
+        )
+        location = output_location / f"paymentCycle={payment_cycle}"
+        write_results(
+            rule, payments, {**parameters, "run": cycle_parameters}, location, **options
+        )
+        previous_output = str(location / "results.parquet")
+        yield payment_cycle, len(payments)
+
+
+def get_payment_cycles(
+    core_parameters, first_payment_cycle=None, last_payment_cycle=None
+):
+    """All the payment cycles of a program, as the scheduler runs them"""
+    return [
+        payment_cycle
+        for payment_cycle in range(
+            core_parameters["start_block"],
+            core_parameters["end_block"],
+            core_parameters["payment_cycle_length"],
+        )
+        if (first_payment_cycle is None or payment_cycle >= first_payment_cycle)
+        and (last_payment_cycle is None or payment_cycle <= last_payment_cycle)
+    ]
+
+
+def plan_tasks(programs, workers):
+    """Split the payment cycles of each program into tasks for the workers.
+
+    Rollover programs chain each cycle to the one before, so all their cycles are one
+    task. Other programs' cycles are independent and are split into a contiguous run of
+    cycles per worker, so each worker registers its datasets once and rules that keep
+    state carry it from cycle to cycle.
+
+    Args:
+        programs (List[Tuple[dict, List[int]]]): Each program's parameters and cycles
+        workers (int): The number of worker processes
+
+    Returns:
+        List[Tuple[dict, List[int]]]: The parameters and cycles of each task,
+                                      longest first
+    """
+    tasks = []
+    for parameters, payment_cycles in programs:
+        if not payment_cycles:
+            continue
+        if parameters["core"].get("rollover"):
+            tasks.append((parameters, payment_cycles))
+        else:
+            size = math.ceil(len(payment_cycles) / workers)
+            tasks.extend(
+                (parameters, payment_cycles[start : start + size])
+                for start in range(0, len(payment_cycles), size)
+            )
+    return sorted(tasks, key=lambda task: len(task[1]), reverse=True)
+
+
+def init_worker(threads):
+    configure_default_storage()
+    pa.set_cpu_count(threads)
+
+
+def run_task(
+    rule_name, parameters, payment_cycles, output_location, threads, options, resume
+):
+    """Run a task's cycles in a worker, returning how long each took.
+    If resume is set, continue from the results of the cycle before the first."""
+    rule = get_rule_class(rule_name)(parameters["core"], parameters["user_defined"])
+    # Each worker has its own connection, limited to its share of the cores
+    rule.connection.execute(f"SET threads TO {threads}")
+    program_location = AnyPath(output_location) / (
+        f"rewardProgramID={parameters['run']['reward_program_id']}"
+    )
+    previous_location = program_location / (
+        f"paymentCycle={payment_cycles[0] - rule.payment_cycle_length}"
+    )
+    previous_output = None
+    if resume and (previous_location / "results.parquet").exists():
+        previous_output = str(previous_location / "results.parquet")
+    if resume and (previous_location / "state.parquet").exists():
+        rule.load_state(previous_location / "state.parquet")
+    timings = []
+    start = time.perf_counter()
+    for payment_cycle, payment_count in run_payment_cycles(
+        rule,
+        parameters,
+        payment_cycles,
+        program_location,
+        previous_output=previous_output,
+        **options,
+    ):
+        finished = time.perf_counter()
+        timings.append((payment_cycle, payment_count, finished - start))
+        start = finished
+    return timings
+
+
+def backfill(
+    parameters_files: List[str] = typer.Argument(
+        ..., help="Parameters files of the reward programs, as passed to main"
+    ),
+    output_location: str = typer.Option(
+        "./output",
+        help="Where to write rewardProgramID=<id>/paymentCycle=<cycle>/results.parquet",
+    ),
+    rule_name: str = typer.Option(os.getenv("RULE"), "--rule", help="Rule name"),
+    first_payment_cycle: int = typer.Option(None, help="Skip earlier cycles"),
+    last_payment_cycle: int = typer.Option(None, help="Skip later cycles"),
+    workers: int = typer.Option(
+        os.cpu_count(), help="Number of worker processes running cycles at once"
+    ),
+    threads_per_worker: int = typer.Option(
+        None, help="DuckDB and arrow threads for each worker, by default an even share"
+    ),
+    max_batch_mb: int = typer.Option(int(os.getenv("MAX_BATCH_MB", 64))),
+    upload_part_mb: int = typer.Option(int(os.getenv("UPLOAD_PART_MB", 64))),
+    upload_concurrency: int = typer.Option(int(os.getenv("UPLOAD_CONCURRENCY", 4))),
+):
+    """
+    Run all the payment cycles of one or more reward programs locally, spreading
+    independent cycles over a pool of worker processes
+    """
+    get_rule_class(rule_name)
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    options = {
+        "max_batch_bytes": max_batch_mb * 1024 * 1024,
+        "part_size": upload_part_mb * 1024 * 1024,
+        "concurrency": upload_concurrency,
+    }
+    programs = []
+    for parameters_file in parameters_files:
+        with open(AnyPath(parameters_file), "r") as stream:
+            parameters = json.load(stream)
+        payment_cycles = get_payment_cycles(
+            parameters["core"], first_payment_cycle, last_payment_cycle
+        )
+        programs.append((parameters, payment_cycles))
+    tasks = plan_tasks(programs, workers)
+    first_cycles = {
+        parameters["run"]["reward_program_id"]: payment_cycles[0]
+        for parameters, payment_cycles in programs
+        if payment_cycles
+    }
+
+    print(f"{'program':>42} {'cycle':>10} {'payments':>9} {'time (s)':>9}")
+    start = time.perf_counter()
+    cycle_time = 0
+    # DuckDB and the S3 clients aren't safe to fork, so start fresh processes
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(threads,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_task,
+                rule_name,
+                parameters,
+                payment_cycles,
+                output_location,
+                threads,
+                options,
+                # Only continue from earlier results if they aren't being written
+                # by another task
+                payment_cycles[0]
+                == first_cycles[parameters["run"]["reward_program_id"]],
+            ): parameters["run"]["reward_program_id"]
+            for parameters, payment_cycles in tasks
+        }
+        for future in as_completed(futures):
+            for payment_cycle, payment_count, elapsed in future.result():
+                cycle_time += elapsed
+                print(
+                    f"{futures[future]:>42} {payment_cycle:>10} "
+                    f"{payment_count:>9} {elapsed:>9.2f}"
+                )
+    total_time = time.perf_counter() - start
+    print(
+        f"Ran {sum(len(cycles) for _, cycles in tasks)} cycles in {total_time:.2f}s "
+        f"({cycle_time:.2f}s of cycle time over {workers} workers)"
+    )
+
+
+if __name__ == "__main__":
+    typer.run(backfill)
@@ -3,22 +3,17 @@ import os
 
 import sentry_sdk
 import typer
-from boto3.session import Session
 from cardpay_reward_programs.rule import Rule
-from cloudpathlib import AnyPath, S3Client
+from cloudpathlib import AnyPath
 from dotenv import load_dotenv
 
-from .payment_tree import PaymentTree
+from .backfill import run_payment_cycles, write_results
 from .rules import *  # noqa: F403 F401
-from .utils import write_parquet_file
+from .utils import configure_default_storage
 
 load_dotenv()
 
-cached_client = S3Client(
-    local_cache_dir=".cache",
-    boto3_session=Session(),
-)
-cached_client.set_as_default_client()
+configure_default_storage()
 
 SENTRY_DSN = os.environ.get("SENTRY_DSN")
 if SENTRY_DSN is not None:
@@ -44,6 +39,33 @@ def run_task(
         default="./output", help="The directory to write the results to"
     ),
     rule_name: str = typer.Argument(default=os.getenv("RULE"), help="Rule name"),
+    max_batch_mb: int = typer.Option(
+        default=int(os.getenv("MAX_BATCH_MB", 64)),
+        help="Approximate size of each batch of results built and written at once",
+    ),
+    upload_part_mb: int = typer.Option(
+        default=int(os.getenv("UPLOAD_PART_MB", 64)),
+        help="Size of each part when streaming results to S3 (at least 5)",
+    ),
+    upload_concurrency: int = typer.Option(
+        default=int(os.getenv("UPLOAD_CONCURRENCY", 4)),
+        help="Number of parts uploaded to S3 at once",
+    ),
+    previous_state: str = typer.Option(
+        default=os.getenv("PREVIOUS_STATE"),
+        help="The state.parquet written by the run for the previous payment cycle, "
+        "which rules that support it continue from instead of reading all history",
+    ),
+    save_state: bool = typer.Option(
+        default=os.getenv("SAVE_STATE", "false").lower() == "true",
+        help="Write state.parquet next to results.parquet, for the next payment cycle "
+        "to continue from. Always done when --previous-state is given",
+    ),
+    last_payment_cycle: int = typer.Option(
+        default=None,
+        help="Run every payment cycle from the one in the parameters file up to this "
+        "one, writing each to paymentCycle=<cycle>/ in the output location",
+    ),
 ):
     """
     Run a reward program as defined in the parameters file
@@ -57,10 +79,35 @@ def run_task(
                 parameters["core"],
                 parameters["user_defined"],
             )
-    payment_list = rule.get_payments(**parameters["run"]).to_dict("records")
-    tree = PaymentTree(payment_list, parameters)
-    table = tree.as_arrow()
-    write_parquet_file(AnyPath(output_location), table)
+    if previous_state is not None:
+        rule.load_state(previous_state)
+    # Computing the state is another query over the cycle, so only keep it if the
+    # next cycle is going to continue from it
+    rule.keep_state = save_state or previous_state is not None
+    options = {
+        "max_batch_bytes": max_batch_mb * 1024 * 1024,
+        "part_size": upload_part_mb * 1024 * 1024,
+        "concurrency": upload_concurrency,
+    }
+    if last_payment_cycle is None:
+        payments = rule.get_payments(**parameters["run"])
+        write_results(rule, payments, parameters, AnyPath(output_location), **options)
+        return
+
+    payment_cycles = range(
+        parameters["run"]["payment_cycle"],
+        last_payment_cycle + 1,
+        rule.payment_cycle_length,
+    )
+    for _ in run_payment_cycles(
+        rule,
+        parameters,
+        payment_cycles,
+        AnyPath(output_location),
+        previous_output=parameters["run"].get("previous_output"),
+        **options,
+    ):
+        pass
 
 
 if __name__ == "__main__":
@@ -0,0 +1,210 @@
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+import pyarrow as pa
+import sha3
+
+HASH_SIZE = 32
+
+# Lookup table used to hex encode whole arrays of bytes at once
+_HEX_TABLE = np.array([f"{i:02x}" for i in range(256)], dtype="S2")
+# And its inverse, mapping each ascii hex digit to its value (invalid digits to 255)
+_NIBBLE_TABLE = np.full(256, 255, dtype=np.uint8)
+for _value, _digit in enumerate(b"0123456789abcdef"):
+    _NIBBLE_TABLE[_digit] = _value
+for _value, _digit in enumerate(b"ABCDEF", start=10):
+    _NIBBLE_TABLE[_digit] = _value
+
+
+def keccak_rows(rows: np.ndarray) -> np.ndarray:
+    """Hash every row of a 2D uint8 array, returning an (n, 32) uint8 array"""
+    rows = np.ascontiguousarray(rows, dtype=np.uint8)
+    n, width = rows.shape
+    flat = memoryview(rows.reshape(-1))
+    digests = b"".join(
+        [
+            sha3.keccak_256(flat[start : start + width]).digest()
+            for start in range(0, n * width, width)
+        ]
+    )
+    return np.frombuffer(digests, dtype=np.uint8).reshape(n, HASH_SIZE)
+
+
+def keccak_leaves(leaves: Union[Sequence[bytes], np.ndarray]) -> np.ndarray:
+    """Hash a list of encoded leaves (or a 2D uint8 array of fixed width leaves)"""
+    if isinstance(leaves, np.ndarray):
+        return keccak_rows(leaves)
+    digests = b"".join([sha3.keccak_256(leaf).digest() for leaf in leaves])
+    return np.frombuffer(digests, dtype=np.uint8).reshape(len(leaves), HASH_SIZE)
+
+
+def hex_rows(rows: np.ndarray) -> np.ndarray:
+    """Hex encode every row of a 2D uint8 array, returning an (n, 2 * width) uint8 array"""
+    n, width = rows.shape
+    return _HEX_TABLE[rows].view(np.uint8).reshape(n, 2 * width)
+
+
+def hex_string_array(rows: np.ndarray) -> pa.StringArray:
+    """Hex encode every row of a 2D uint8 array into an arrow string array (without 0x prefix)"""
+    n, width = rows.shape
+    offsets = np.arange(n + 1, dtype=np.int32) * (2 * width)
+    return pa.Array.from_buffers(
+        pa.string(),
+        n,
+        [None, pa.py_buffer(offsets), pa.py_buffer(hex_rows(rows))],
+    )
+
+
+def unhex_rows(hex_strings, width: int) -> np.ndarray:
+    """
+    Decode an arrow array of hex strings, each encoding width bytes with or without
+    a 0x prefix, into an (n, width) uint8 array. The inverse of hex_string_array.
+    """
+    if isinstance(hex_strings, pa.ChunkedArray):
+        hex_strings = hex_strings.combine_chunks()
+    hex_strings = hex_strings.cast(pa.string())
+    n = len(hex_strings)
+    if n == 0:
+        return np.zeros((0, width), dtype=np.uint8)
+    if hex_strings.null_count:
+        raise ValueError("Cannot decode null hex strings")
+    _, offsets_buffer, data_buffer = hex_strings.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int32)[
+        hex_strings.offset : hex_strings.offset + n + 1
+    ]
+    lengths = np.diff(offsets)
+    if not ((lengths == 2 * width) | (lengths == 2 * width + 2)).all():
+        raise ValueError(f"Hex strings do not all encode {width} bytes")
+    data = np.frombuffer(data_buffer, dtype=np.uint8)
+    if (lengths == 2 * width).all():
+        chars = data[offsets[0] : offsets[-1]].reshape(n, 2 * width)
+    else:
+        prefixed = offsets[:-1][lengths == 2 * width + 2]
+        if not (
+            (data[prefixed] == ord("0"))
+            & ((data[prefixed + 1] == ord("x")) | (data[prefixed + 1] == ord("X")))
+        ).all():
+            raise ValueError(
+                f"Hex strings of {2 * width + 2} characters must start with 0x"
+            )
+        # Skip the 0x prefixes by gathering just the digits of each row
+        starts = offsets[:-1] + lengths - 2 * width
+        chars = data[starts[:, None] + np.arange(2 * width)]
+    nibbles = _NIBBLE_TABLE[chars]
+    if (nibbles == 255).any():
+        raise ValueError("Invalid hex digit")
+    return (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+
+
+def _as_sortable(rows: np.ndarray) -> np.ndarray:
+    # Fixed width byte strings compare (and sort) like memcmp
+    return np.ascontiguousarray(rows).view(f"S{HASH_SIZE}").ravel()
+
+
+class MerkleTree:
+    """
+    Merkle tree compatible with the cardstack fork of merklelib and openzeppelin's MerkleProof.
+
+    Leaves are hashed with keccak256 and sorted, each parent is the hash of its sorted children
+    and an odd node at the end of a level is promoted unchanged.
+
+    Every level is kept in memory as a contiguous (n, 32) array so that the whole tree is
+    built with one hashing pass per level and all proofs can be gathered in a single sweep
+    rather than walking the tree once per leaf.
+    """
+
+    def __init__(self, leaves: Union[Sequence[bytes], np.ndarray]):
+        leaf_hashes = keccak_leaves(leaves)
+        order = np.argsort(_as_sortable(leaf_hashes), kind="stable")
+        # Position of each leaf (in the order given) within the sorted bottom level
+        self.positions = np.empty(len(order), dtype=np.int64)
+        self.positions[order] = np.arange(len(order), dtype=np.int64)
+        self.levels: List[np.ndarray] = [leaf_hashes[order]]
+        while len(self.levels[-1]) > 1:
+            self.levels.append(self._parent_level(self.levels[-1]))
+
+    @staticmethod
+    def _parent_level(level: np.ndarray) -> np.ndarray:
+        pairs = len(level) // 2
+        left = level[0 : 2 * pairs : 2]
+        right = level[1 : 2 * pairs : 2]
+        swap = (_as_sortable(right) < _as_sortable(left))[:, None]
+        pair_buffer = np.hstack(
+            [np.where(swap, right, left), np.where(swap, left, right)]
+        )
+        parents = keccak_rows(pair_buffer)
+        if len(level) % 2:
+            parents = np.vstack([parents, level[-1:]])
+        return parents
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def has_duplicates(self) -> bool:
+        # Leaves are sorted so any duplicates are next to each other
+        leaves = self.levels[0]
+        return bool((leaves[1:] == leaves[:-1]).all(axis=1).any())
+
+    @property
+    def depth(self):
+        return len(self.levels) - 1
+
+    @property
+    def root(self) -> Optional[bytes]:
+        if len(self) == 0:
+            return None
+        return self.levels[-1][0].tobytes()
+
+    @property
+    def hex_root(self) -> Optional[str]:
+        root = self.root
+        return root.hex() if root is not None else None
+
+    def _siblings(self, start: int, stop: int):
+        """
+        For the leaves in [start, stop) get, per level, the index of their sibling node
+        and whether that sibling exists (promoted nodes have no sibling at that level)
+        """
+        positions = self.positions[start:stop]
+        for depth, level in enumerate(self.levels[:-1]):
+            sibling = (positions >> depth) ^ 1
+            yield level, sibling, sibling < len(level)
+
+    def proof_lengths(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        stop = len(self) if stop is None else stop
+        lengths = np.zeros(stop - start, dtype=np.int32)
+        for _, _, exists in self._siblings(start, stop):
+            lengths += exists
+        return lengths
+
+    def hex_proofs(self, start: int = 0, stop: Optional[int] = None) -> pa.ListArray:
+        """
+        Proofs for the leaves in [start, stop), in the order the leaves were given,
+        as a list<string> arrow array of hex encoded nodes (without 0x prefix).
+        """
+        stop = len(self) if stop is None else stop
+        lengths = self.proof_lengths(start, stop)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.empty((int(offsets[-1]), HASH_SIZE), dtype=np.uint8)
+        # Next free slot of each leaf's proof, advanced one level at a time
+        cursor = offsets[:-1].copy()
+        for level, sibling, exists in self._siblings(start, stop):
+            values[cursor[exists]] = level[sibling[exists]]
+            cursor += exists
+        return pa.ListArray.from_arrays(
+            pa.array(offsets, type=pa.int32()), hex_string_array(values)
+        )
+
+    def get_hex_proof(self, index: int) -> List[str]:
+        return self.hex_proofs(index, index + 1)[0].as_py()
+
+
+def verify_proof(leaf: bytes, proof: Sequence[str], hex_root: str) -> bool:
+    "Verify a proof as openzeppelin's MerkleProof.verify would"
+    node = sha3.keccak_256(leaf).digest()
+    for hex_node in proof:
+        sibling = bytes.fromhex(hex_node)
+        node = sha3.keccak_256(min(node, sibling) + max(node, sibling)).digest()
+    return node.hex() == hex_root.lower().replace("0x", "")
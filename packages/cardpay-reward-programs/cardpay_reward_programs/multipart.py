@@ -0,0 +1,189 @@
+import io
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# S3 rejects multipart uploads with parts (other than the last) smaller than this
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 64 * 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+
+
+class S3MultipartBackend:
+    """Uploads parts to an S3 object using the multipart upload API"""
+
+    min_part_size = S3_MIN_PART_SIZE
+
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+
+    @classmethod
+    def for_path(cls, s3_path):
+        return cls(s3_path.client.client, s3_path.bucket, s3_path.key)
+
+    def create(self):
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+        return response["UploadId"]
+
+    def upload_part(self, upload_id, part_number, data):
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return response["ETag"]
+
+    def complete(self, upload_id, etags):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": part_number, "ETag": etag}
+                    for part_number, etag in enumerate(etags, start=1)
+                ]
+            },
+        )
+
+    def abort(self, upload_id):
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=upload_id
+        )
+
+
+class LocalMultipartBackend:
+    """
+    Stand-in for S3 that stages parts in a directory next to the target file and only
+    assembles the file once the upload completes, so it behaves like S3 (nothing is
+    visible at the target until completion) without needing AWS.
+    """
+
+    min_part_size = 0
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def _staging_dir(self, upload_id):
+        return self.path.parent / f".{self.path.name}.{upload_id}.parts"
+
+    def create(self):
+        upload_id = uuid.uuid4().hex
+        self._staging_dir(upload_id).mkdir(parents=True)
+        return upload_id
+
+    def upload_part(self, upload_id, part_number, data):
+        part = self._staging_dir(upload_id) / str(part_number)
+        part.write_bytes(data)
+        return part.name
+
+    def complete(self, upload_id, etags):
+        staging_dir = self._staging_dir(upload_id)
+        with open(self.path, "wb") as target:
+            for etag in etags:
+                with open(staging_dir / etag, "rb") as part:
+                    shutil.copyfileobj(part, target)
+        shutil.rmtree(staging_dir)
+
+    def abort(self, upload_id):
+        shutil.rmtree(self._staging_dir(upload_id), ignore_errors=True)
+
+
+class MultipartUploadFile(io.RawIOBase):
+    """
+    Write-only file object that uploads its contents in parts as they are written.
+
+    Writes are buffered until a full part is available, which is then uploaded in the
+    background while writing continues. At most `concurrency` parts are in flight at once,
+    so memory is bounded by roughly (concurrency + 1) * part_size. Closing the file uploads
+    the final part and completes the upload; leaving a `with` block with an exception
+    aborts it instead so no partial object is left behind.
+    """
+
+    def __init__(
+        self, backend, part_size=DEFAULT_PART_SIZE, concurrency=DEFAULT_CONCURRENCY
+    ):
+        if part_size < 1:
+            raise ValueError(f"Part size must be at least 1 byte, got {part_size}")
+        if part_size < backend.min_part_size:
+            raise ValueError(
+                f"Part size must be at least {backend.min_part_size} bytes, got {part_size}"
+            )
+        if concurrency < 1:
+            raise ValueError(f"Concurrency must be at least 1, got {concurrency}")
+        super().__init__()
+        self.backend = backend
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.upload_id = backend.create()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._buffer = bytearray()
+        self._parts = []
+        self._position = 0
+        self._aborted = False
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        data = memoryview(data).cast("B")
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[: self.part_size])
+            del self._buffer[: self.part_size]
+            self._upload(part)
+        return len(data)
+
+    def _upload(self, part):
+        # Wait for the oldest part before starting another, to bound memory use
+        in_flight = [future for future in self._parts if not future.done()]
+        if len(in_flight) >= self.concurrency:
+            in_flight[0].result()
+        part_number = len(self._parts) + 1
+        self._parts.append(
+            self._executor.submit(
+                self.backend.upload_part, self.upload_id, part_number, part
+            )
+        )
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if not self._aborted:
+                try:
+                    # S3 requires at least one part, even for an empty object
+                    if self._buffer or not self._parts:
+                        self._upload(bytes(self._buffer))
+                        self._buffer = bytearray()
+                    etags = [part.result() for part in self._parts]
+                    self.backend.complete(self.upload_id, etags)
+                except Exception:
+                    self.abort()
+                    raise
+        finally:
+            self._executor.shutdown(wait=True)
+            super().close()
+
+    def abort(self):
+        if self._aborted:
+            return
+        self._aborted = True
+        self._executor.shutdown(wait=True)
+        self.backend.abort(self.upload_id)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        self.close()
@@ -0,0 +1,259 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_SIZE = 20 * 1024**3
+
+_default_cache = None
+
+
+class PartitionCache:
+    """
+    On-disk cache of immutable files (subgraph partitions, previous results), shared
+    between runs and processes.
+
+    Files are stored under the sha256 of their contents, with an sqlite index mapping
+    each remote location to the digest of what was downloaded from it. The digest is
+    checked the first time a file is used in each process and a file that has been
+    truncated or corrupted is downloaded again. Once the cache grows past max_size the
+    least recently used files are evicted, except for pinned files, which are in use
+    by this or another process.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        # Reentrant, as pins may be released by a finalizer while it's held
+        self._lock = threading.RLock()
+        self._verified = set()
+        self._index = sqlite3.connect(
+            self.cache_dir / "index.sqlite", timeout=60, check_same_thread=False
+        )
+        with self._index:
+            self._index.execute(
+                """create table if not exists entries (
+                    location text primary key,
+                    digest text not null,
+                    size integer not null,
+                    last_access real not null
+                )"""
+            )
+            self._index.execute(
+                "create index if not exists entries_last_access on entries (last_access)"
+            )
+            self._index.execute(
+                """create table if not exists pins (
+                    token text not null,
+                    location text not null,
+                    pid integer not null
+                )"""
+            )
+
+    def set_as_default(self):
+        global _default_cache
+        _default_cache = self
+
+    def _object_path(self, digest):
+        return self.objects_dir / digest[:2] / digest
+
+    def _lookup(self, location):
+        with self._lock:
+            return self._index.execute(
+                "select digest, size from entries where location = ?", (location,)
+            ).fetchone()
+
+    def _is_intact(self, digest, size):
+        path = self._object_path(digest)
+        try:
+            if path.stat().st_size != size:
+                return False
+        except FileNotFoundError:
+            return False
+        if digest not in self._verified:
+            if file_digest(path) != digest:
+                return False
+            self._verified.add(digest)
+        return True
+
+    def get(self, location, open_remote):
+        """Get the local path of a cached copy of location, downloading it if needed
+
+        Args:
+            location (str): The remote location, used as the cache key
+            open_remote (Callable[[], BinaryIO]): Opens the remote file for reading
+
+        Returns:
+            str: The path to the local copy
+        """
+        entry = self._lookup(location)
+        if entry is not None and self._is_intact(*entry):
+            self._touch(location)
+            return str(self._object_path(entry[0]))
+        digest, size = self._download(open_remote)
+        with self._lock, self._index:
+            self._index.execute(
+                "insert or replace into entries values (?, ?, ?, ?)",
+                (location, digest, size, time.time()),
+            )
+        self.evict(keep=location)
+        return str(self._object_path(digest))
+
+    def get_many(self, items, max_workers=8):
+        """
+        Get local paths for many (location, open_remote) pairs, downloading in parallel.
+        The files are pinned while they are fetched, so fetching one never evicts another.
+        """
+        with self.pin([location for location, _ in items]):
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(lambda item: self.get(*item), items))
+
+    def pin(self, locations):
+        """
+        Keep the files at locations from being evicted, by any process sharing the
+        cache, until the returned Pin is released or this process exits
+        """
+        token = uuid.uuid4().hex
+        with self._lock, self._index:
+            self._index.executemany(
+                "insert into pins values (?, ?, ?)",
+                [(token, location, os.getpid()) for location in locations],
+            )
+        return Pin(self, token)
+
+    def _unpin(self, token):
+        with self._lock, self._index:
+            self._index.execute("delete from pins where token = ?", (token,))
+
+    def _pinned(self):
+        """The pinned locations, dropping the pins of processes that have exited"""
+        pids = [pid for (pid,) in self._index.execute("select distinct pid from pins")]
+        for pid in pids:
+            if not _is_running(pid):
+                self._index.execute("delete from pins where pid = ?", (pid,))
+        return {
+            location for (location,) in self._index.execute("select location from pins")
+        }
+
+    def _touch(self, location):
+        with self._lock, self._index:
+            self._index.execute(
+                "update entries set last_access = ? where location = ?",
+                (time.time(), location),
+            )
+
+    def _download(self, open_remote):
+        sha256 = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as local:
+            try:
+                with open_remote() as remote:
+                    while chunk := remote.read(CHUNK_SIZE):
+                        sha256.update(chunk)
+                        local.write(chunk)
+                        size += len(chunk)
+            except BaseException:
+                os.unlink(local.name)
+                raise
+        digest = sha256.hexdigest()
+        path = self._object_path(digest)
+        path.parent.mkdir(exist_ok=True)
+        # Atomic, so readers (in any process) only ever see complete files
+        os.replace(local.name, path)
+        self._verified.add(digest)
+        return digest, size
+
+    def size(self):
+        with self._lock:
+            return self._index.execute(
+                "select coalesce(sum(size), 0) from (select distinct digest, size from entries)"
+            ).fetchone()[0]
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used files until the cache fits in max_size,
+        never removing the file at location keep (which has just been requested)
+        or pinned files
+        """
+        with self._lock, self._index:
+            pinned = self._pinned()
+            entries = self._index.execute(
+                "select location, digest, size from entries order by last_access"
+            ).fetchall()
+            references = {}
+            for _, digest, size in entries:
+                references[digest] = references.get(digest, 0) + 1
+            total = self._index.execute(
+                "select coalesce(sum(size), 0) from (select distinct digest, size from entries)"
+            ).fetchone()[0]
+            for location, digest, size in entries:
+                if total <= self.max_size:
+                    break
+                if location == keep or location in pinned:
+                    continue
+                self._index.execute(
+                    "delete from entries where location = ?", (location,)
+                )
+                references[digest] -= 1
+                if references[digest] == 0:
+                    self._object_path(digest).unlink(missing_ok=True)
+                    self._verified.discard(digest)
+                    total -= size
+
+    def clear(self):
+        with self._lock, self._index:
+            self._index.execute("delete from entries")
+            shutil.rmtree(self.objects_dir)
+            self.objects_dir.mkdir()
+            self._verified.clear()
+
+
+class Pin:
+    """Pinned files of a PartitionCache, released by release() or on leaving a with block"""
+
+    def __init__(self, cache, token):
+        self.cache = cache
+        self.token = token
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.cache._unpin(self.token)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as stream:
+        while chunk := stream.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_default_cache():
+    return _default_cache
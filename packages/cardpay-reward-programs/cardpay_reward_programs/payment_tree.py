@@ -1,14 +1,30 @@
 import json
-from collections import defaultdict
-from typing import Any, List, Mapping, TypedDict, Union
+from typing import Any, List, Mapping, Sequence, TypedDict, Union
 
+import numpy as np
+import pandas as pd
 import pyarrow as pa
 import pydash as py_
 import sha3
 from eth_abi import decode_abi, encode_abi
 from eth_typing import ChecksumAddress
-from eth_utils import add_0x_prefix
-from merklelib import MerkleTree, beautify
+from eth_utils import add_0x_prefix, is_address
+from merklelib import MerkleTree as PrintableMerkleTree
+from merklelib import beautify
+
+from .merkle import (
+    HASH_SIZE,
+    MerkleTree,
+    hex_rows,
+    hex_string_array,
+    verify_proof,
+)
+
+WORD_SIZE = 32
+# An encoded payment is 7 head words, then the length and the two words of transferData
+PAYMENT_LEAF_SIZE = 10 * WORD_SIZE
+TRANSFER_DATA_OFFSET = 7 * WORD_SIZE
+TRANSFER_DATA_SIZE = 2 * WORD_SIZE
 
 
 class Payment(TypedDict):
@@ -78,33 +94,206 @@ def decode_payment(encoded_payment: Union[bytes, str]) -> Payment:
     )
 
 
+def _column(payments, field):
+    if isinstance(payments, pd.DataFrame):
+        return payments[field].to_numpy()
+    return [payment[field] for payment in payments]
+
+
+def _encode_addresses(addresses) -> np.ndarray:
+    for address in set(addresses):
+        if not is_address(address):
+            raise ValueError(f"{address} is not a valid address")
+    raw = bytes.fromhex("".join(address[2:] for address in addresses))
+    return np.frombuffer(raw, dtype=np.uint8).reshape(len(addresses), 20)
+
+
+def _encode_uints(values) -> np.ndarray:
+    if not isinstance(values, np.ndarray):
+        # np.asarray would turn a mix of small and large ints into (lossy) floats
+        values = np.array(values, dtype=object)
+        try:
+            values = values.astype(np.int64)
+        except (OverflowError, TypeError, ValueError):
+            pass
+    words = np.zeros((len(values), WORD_SIZE), dtype=np.uint8)
+    if values.dtype.kind in "iu":
+        if (values < 0).any():
+            raise ValueError("Cannot encode negative values as uint256")
+        words[:, -8:] = values.astype(">u8").view(np.uint8).reshape(-1, 8)
+    else:
+        # Big integers (or floats) that don't fit a native dtype
+        raw = b"".join(int(value).to_bytes(WORD_SIZE, "big") for value in values)
+        words[:] = np.frombuffer(raw, dtype=np.uint8).reshape(-1, WORD_SIZE)
+    return words
+
+
+def amount_limbs(amounts) -> np.ndarray:
+    """
+    Split uint256 amounts into eight 32 bit limbs (most significant first) held as int64,
+    so that amounts can be summed exactly with numpy, e.g. with np.add.reduceat
+    """
+    return _encode_uints(amounts).view(">u4").astype(np.int64)
+
+
+def amounts_from_limbs(limbs: np.ndarray) -> np.ndarray:
+    """
+    Combine (possibly summed) limbs from amount_limbs back into amounts, as int64
+    if they all fit or python ints otherwise
+    """
+    limbs = limbs.copy()
+    for i in range(limbs.shape[1] - 1, 0, -1):
+        limbs[:, i - 1] += limbs[:, i] >> 32
+        limbs[:, i] &= 0xFFFFFFFF
+    if (limbs[:, 0] >> 32).any():
+        raise ValueError("Amount does not fit in a uint256")
+    return _decode_uints(limbs.astype(">u4").view(np.uint8).reshape(-1, WORD_SIZE))
+
+
+def encode_payments(payments: Union[pd.DataFrame, Sequence[Payment]]) -> np.ndarray:
+    """
+    Batch version of encode_payment, writing every leaf into one preallocated buffer.
+
+    Accepts a payment DataFrame (as returned by Rule.get_payments) or a list of payments,
+    and returns an (n, 320) uint8 array with one encoded leaf per row.
+    """
+    n = len(payments)
+    leaves = np.zeros((n, PAYMENT_LEAF_SIZE // WORD_SIZE, WORD_SIZE), dtype=np.uint8)
+    if n == 0:
+        return leaves.reshape(0, PAYMENT_LEAF_SIZE)
+    leaves[:, 0, 12:] = _encode_addresses(_column(payments, "rewardProgramID"))
+    leaves[:, 1] = _encode_uints(_column(payments, "paymentCycle"))
+    leaves[:, 2] = _encode_uints(_column(payments, "validFrom"))
+    leaves[:, 3] = _encode_uints(_column(payments, "validTo"))
+    leaves[:, 4, -1] = 1  # tokenType
+    leaves[:, 5, 12:] = _encode_addresses(_column(payments, "payee"))
+    leaves[:, 6, -1] = TRANSFER_DATA_OFFSET
+    leaves[:, 7, -1] = TRANSFER_DATA_SIZE
+    leaves[:, 8, 12:] = _encode_addresses(_column(payments, "token"))
+    leaves[:, 9] = _encode_uints(_column(payments, "amount"))
+    return leaves.reshape(n, PAYMENT_LEAF_SIZE)
+
+
+def _leaf_rows(encoded_payments) -> np.ndarray:
+    if isinstance(encoded_payments, np.ndarray):
+        return encoded_payments
+    if isinstance(encoded_payments, (pa.Array, pa.ChunkedArray)):
+        encoded_payments = encoded_payments.to_pylist()
+    encoded_payments = list(encoded_payments)
+    if len(encoded_payments) > 0 and isinstance(encoded_payments[0], str):
+        raw = bytes.fromhex(
+            "".join(
+                leaf[2:] if leaf.startswith("0x") else leaf for leaf in encoded_payments
+            )
+        )
+    else:
+        raw = b"".join(encoded_payments)
+    if len(raw) != len(encoded_payments) * PAYMENT_LEAF_SIZE:
+        raise ValueError("Leaves are not all encoded payments")
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, PAYMENT_LEAF_SIZE)
+
+
+def _decode_addresses(words: np.ndarray) -> List[str]:
+    return [
+        "0x" + address.decode()
+        for address in hex_rows(words[:, 12:]).view("S40").ravel()
+    ]
+
+
+def _decode_uints(words: np.ndarray):
+    # Values below 2**63 fit an int64, anything larger needs python ints
+    if not words[:, :-8].any() and not (words[:, -8] & 0x80).any():
+        return words[:, -8:].copy().view(">u8").ravel().astype(np.int64)
+    return np.array(
+        [int.from_bytes(word.tobytes(), "big") for word in words], dtype=object
+    )
+
+
+PAYMENT_COLUMNS = {
+    "rewardProgramID": lambda words: _decode_addresses(words[:, 0]),
+    "paymentCycle": lambda words: _decode_uints(words[:, 1]),
+    "validFrom": lambda words: _decode_uints(words[:, 2]),
+    "validTo": lambda words: _decode_uints(words[:, 3]),
+    "tokenType": lambda words: _decode_uints(words[:, 4]),
+    "payee": lambda words: _decode_addresses(words[:, 5]),
+    "token": lambda words: _decode_addresses(words[:, 8]),
+    "amount": lambda words: pd.Series(
+        [int.from_bytes(word.tobytes(), "big") for word in words[:, 9]],
+        dtype=object,
+    ),
+}
+
+
+def decode_payments(encoded_payments, columns=None) -> pd.DataFrame:
+    """
+    Batch version of decode_payment for many leaves at once.
+
+    Accepts a list of leaves (bytes or hex strings), an arrow binary/string array
+    or an (n, 320) uint8 array as returned by encode_payments.
+    Only the given columns are decoded if columns is set.
+    Amounts are always python ints, so large values are exact.
+    """
+    rows = _leaf_rows(encoded_payments)
+    words = rows.reshape(len(rows), PAYMENT_LEAF_SIZE // WORD_SIZE, WORD_SIZE)
+    if (_decode_uints(words[:, 6]) != TRANSFER_DATA_OFFSET).any() or (
+        _decode_uints(words[:, 7]) != TRANSFER_DATA_SIZE
+    ).any():
+        raise ValueError("Leaves are not all encoded payments")
+    return pd.DataFrame(
+        {
+            column: PAYMENT_COLUMNS[column](words)
+            for column in (columns or PAYMENT_COLUMNS)
+        }
+    )
+
+
+# Rows written per record batch (and so per parquet row group) when no limit is given
+DEFAULT_BATCH_SIZE = 100_000
+# Rows sampled to estimate the size of the explanationData column
+EXPLANATION_SAMPLE_SIZE = 100
+
+
+def _column_slice(payments, field, start, stop):
+    if isinstance(payments, pd.DataFrame):
+        return payments[field].iloc[start:stop].to_numpy()
+    return [payment[field] for payment in payments[start:stop]]
+
+
 class PaymentTree:
-    def __init__(self, payment_list: List[Payment], parameters={}) -> None:
+    def __init__(
+        self, payment_list: Union[List[Payment], pd.DataFrame], parameters={}
+    ) -> None:
         self.payment_nodes = payment_list
         self.parameters = parameters
-        self.data = list(map(encode_payment, self.payment_nodes))
-
-        self.tree = MerkleTree(self.data, hashfunc)
-        if len(self.data) != len(set(self.data)):
+        self.leaves = encode_payments(self.payment_nodes)
+        self.tree = MerkleTree(self.leaves)
+        if self.tree.has_duplicates:
             raise Exception(
                 "There are duplicate leafs. Check if you are rewarding the same address twice."
             )
+        self._leaf_index = None
+
+    @property
+    def data(self):
+        return [leaf.tobytes() for leaf in self.leaves]
 
     def get_hex_root(self):
-        return add_0x_prefix(self.tree.merkle_root)
+        return add_0x_prefix(self.tree.hex_root)
 
     def get_hex_proof(self, leaf):
-        return self.tree.get_proof(leaf).hex_nodes
+        if self._leaf_index is None:
+            self._leaf_index = {leaf: i for i, leaf in enumerate(self.data)}
+        return self.tree.get_hex_proof(self._leaf_index[leaf])
 
     def print_tree_map(self):
-        return beautify(self.tree)
+        return beautify(PrintableMerkleTree(self.data, hashfunc))
 
     def verify_inclusion(self, leaf):
-        return self.tree.verify_leaf_inclusion(leaf, self.tree.get_proof(leaf))
+        return verify_proof(leaf, self.get_hex_proof(leaf), self.get_hex_root())
 
-    def as_arrow(self):
+    def schema(self):
         # Auto-detection of schemas risks invalid columns, so define manually
-        schema = pa.schema(
+        return pa.schema(
             [
                 pa.field("rewardProgramID", pa.string()),
                 pa.field("paymentCycle", pa.int32()),
@@ -122,32 +311,82 @@ class PaymentTree:
                 "parameters": json.dumps(self.parameters, default=lambda o: o.__dict__)
             },
         )
-        # Arrow tables are constructed by column
-        # so we need to flip the data
 
+    def estimated_row_size(self):
+        """Rough size in bytes of one output row, used to bound the size of each batch"""
+        if len(self.leaves) == 0:
+            return 1
+        # Leaf and proof nodes are hex strings, every string also has a 4 byte offset
+        # and the proof list has its own offset
+        size = 2 * self.leaves.shape[1] + 4
+        size += self.tree.depth * (2 * HASH_SIZE + 4) + 4
+        # root, payee, rewardProgramID and explanationId strings, plus four int32 columns
+        size += 66 + 2 * 42 + 4 * 4 + 4 * 4
+        explanation_id = py_.get(self.parameters, "metadata.explanation_id") or ""
+        # explanationData varies by row so take the largest of a sample
+        explanation_data = _column_slice(
+            self.payment_nodes, "explanationData", 0, EXPLANATION_SAMPLE_SIZE
+        )
+        return (
+            size
+            + len(explanation_id)
+            + max(len(json.dumps(data)) + 4 for data in explanation_data)
+        )
+
+    def batch_size_for_memory(self, max_batch_bytes):
+        return max(1, max_batch_bytes // self.estimated_row_size())
+
+    def record_batches(self, batch_size=None, max_batch_bytes=None):
+        """
+        Generate the output as record batches of at most batch_size rows, or of roughly
+        max_batch_bytes each, building the proofs for each batch only as it is needed.
+        Only one batch of output is held in memory at once.
+        """
+        if batch_size is None:
+            batch_size = (
+                self.batch_size_for_memory(max_batch_bytes)
+                if max_batch_bytes is not None
+                else DEFAULT_BATCH_SIZE
+            )
+        schema = self.schema()
         explanation_id = py_.get(self.parameters, "metadata.explanation_id")
-        columns = defaultdict(list)
-        if len(self.data) > 0:
-            root = self.get_hex_root()
-            extract_fields = [
-                "rewardProgramID",
-                "paymentCycle",
-                "validFrom",
-                "validTo",
-                "payee",
-            ]
-            for payment, leaf in zip(self.payment_nodes, self.data):
-                for field in extract_fields:
-                    columns[field].append(payment[field])
-                columns["tokenType"].append(1)
-                columns["root"].append(root)
-                columns["leaf"].append(leaf.hex())
-                columns["proof"].append(self.get_hex_proof(leaf))
-                columns["explanationId"].append(explanation_id)
-                columns["explanationData"].append(
-                    json.dumps(payment["explanationData"])
+        root = self.get_hex_root() if len(self.leaves) > 0 else None
+        for start in range(0, len(self.leaves), batch_size):
+            stop = min(start + batch_size, len(self.leaves))
+            n = stop - start
+            columns = {
+                field: pa.array(
+                    _column_slice(self.payment_nodes, field, start, stop),
+                    type=schema.field(field).type,
                 )
-        return pa.table(data=columns, schema=schema)
+                for field in [
+                    "rewardProgramID",
+                    "paymentCycle",
+                    "validFrom",
+                    "validTo",
+                    "payee",
+                ]
+            }
+            columns["tokenType"] = pa.array(np.ones(n, dtype=np.int32))
+            columns["root"] = pa.array([root] * n, type=pa.string())
+            columns["leaf"] = hex_string_array(self.leaves[start:stop])
+            columns["proof"] = self.tree.hex_proofs(start, stop)
+            columns["explanationId"] = pa.array([explanation_id] * n, type=pa.string())
+            columns["explanationData"] = pa.array(
+                [
+                    json.dumps(explanation_data)
+                    for explanation_data in _column_slice(
+                        self.payment_nodes, "explanationData", start, stop
+                    )
+                ],
+                type=pa.string(),
+            )
+            yield pa.RecordBatch.from_arrays(
+                [columns[field.name] for field in schema], schema=schema
+            )
+
+    def as_arrow(self):
+        return pa.Table.from_batches(list(self.record_batches()), schema=self.schema())
 
 
 def hashfunc(value_in_bytes):
@@ -1,9 +1,16 @@
 from abc import ABC, abstractmethod
 
 import duckdb
+import numpy as np
 import pandas as pd
-import pydash as py_
-from cardpay_reward_programs.utils import format_amount, get_unclaimed_rewards
+import pyarrow.parquet as pq
+from cardpay_reward_programs.payment_tree import amount_limbs, amounts_from_limbs
+from cardpay_reward_programs.utils import (
+    format_amount,
+    get_local_file,
+    get_unclaimed_rewards,
+)
+from cloudpathlib import AnyPath
 
 
 class Rule(ABC):
@@ -17,6 +24,16 @@ class Rule(ABC):
         user_defined_parameters,
     ):
         self.connection = duckdb.connect(":memory:")
+        # Rules that can continue from the end of the previous cycle keep what they
+        # need in state, an arrow table describing the chain at block state_block
+        self.state = None
+        self.state_block = None
+        # Whether run computes the state at the end of each cycle, which costs another
+        # query, so it is only set when the state will be used: by run_cycles, or
+        # by callers that save it
+        self.keep_state = False
+        # Set while running several cycles whose datasets were registered up front
+        self.tables_registered = False
         self.set_core_parameters(**core_parameters)
         self.set_user_defined_parameters(**user_defined_parameters)
 
@@ -80,6 +97,21 @@ class Rule(ABC):
             DataFrame: A dataframe of rewardee & reward amount
         """
         current_cycle_payments_df = self.run(payment_cycle, reward_program_id)
+        return self.add_rollover(
+            current_cycle_payments_df,
+            payment_cycle,
+            previous_output,
+            rewards_subgraph_location,
+        )
+
+    def add_rollover(
+        self,
+        current_cycle_payments_df,
+        payment_cycle,
+        previous_output=None,
+        rewards_subgraph_location=None,
+    ):
+        """Add the unclaimed payments of the previous cycle to this cycle's, for rollover programs"""
         # If rollover isn't set, or this is the first and there's no previous output, return the current cycle
         if not self.rollover:
             return current_cycle_payments_df
@@ -91,41 +123,138 @@ class Rule(ABC):
                     lambda row: {**row, **{"rollover_amount": "0"}}
                 )
                 return current_cycle_payments_df
-            payment_list = current_cycle_payments_df.to_dict("records")
             unclaimed_payments = get_unclaimed_rewards(
                 previous_output_location=previous_output,
                 claims_data_root=rewards_subgraph_location,
                 block=payment_cycle,
             )
-            # Update the cycle and validity range of the unclaimed payments
-            for payment in unclaimed_payments:
-                payment["paymentCycle"] = payment_cycle
-                payment["validFrom"] = payment_cycle
-                payment["validTo"] = payment_cycle + self.duration
-            # Group payments of the same token and user together
-            combined_payments = py_.group_by(
-                payment_list + unclaimed_payments,
-                lambda x: (
-                    x["rewardProgramID"].lower(),
-                    x["payee"].lower(),
-                    x["token"].lower(),
-                ),
+            return self.merge_rollover(
+                current_cycle_payments_df, unclaimed_payments, payment_cycle
             )
-            # Sum the amounts of the grouped payments
-            new_payment_list = []
-            for _, payments in combined_payments.items():
-                # payments[0] and payments[1] will have the same general data, just differing amounts
-                # that need summing
-                payments = py_.sort_by(payments, "paymentCycle")
-                rollover_amount = sum(p["amount"] for p in payments[1:])
-                new_payment = payments[0].copy()
-                new_payment["amount"] = sum([p["amount"] for p in payments])
-                new_payment["explanationData"] = self.get_explanation_data(new_payment)
-                new_payment["explanationData"]["rollover_amount"] = format_amount(
-                    rollover_amount
-                )
-                new_payment_list.append(new_payment)
-            return pd.DataFrame(new_payment_list)
+
+    def register_tables_for_cycles(self, payment_cycles):
+        """Register the datasets needed to run all of payment_cycles (in order)
+
+        Returns:
+            bool: Whether the rule registered its datasets, otherwise run registers
+                  them for each cycle
+        """
+        return False
+
+    def run_cycles(self, payment_cycles, reward_program_id: str):
+        """Calculate the payments for several payment cycles, opening the datasets
+        they need once rather than for every cycle.
+
+        Args:
+            payment_cycles (Iterable[int]): The payment cycles to run
+            reward_program_id (str): The reward program id
+
+        Yields:
+            Tuple[int, DataFrame]: Each payment cycle, in order, and its payments
+        """
+        payment_cycles = sorted(payment_cycles)
+        self.tables_registered = self.register_tables_for_cycles(payment_cycles)
+        # Each cycle continues from the state of the one before
+        keep_state, self.keep_state = self.keep_state, True
+        try:
+            for payment_cycle in payment_cycles:
+                yield payment_cycle, self.run(payment_cycle, reward_program_id)
+        finally:
+            self.tables_registered = False
+            self.keep_state = keep_state
+
+    def merge_rollover(self, current_cycle_payments, unclaimed_payments, payment_cycle):
+        """Combine this cycle's payments with the unclaimed payments carried over into it.
+
+        Payments for the same program, payee and token (compared case insensitively) are
+        summed into one payment, which keeps the details of the earliest cycle's payment
+        and records the carried over amount in its explanation data.
+        Amounts are summed as uint256 limbs so large amounts stay exact.
+
+        Args:
+            current_cycle_payments (DataFrame): The payments calculated for this cycle
+            unclaimed_payments (DataFrame): The unclaimed payments from the previous cycle
+            payment_cycle (int): The payment cycle being calculated
+
+        Returns:
+            DataFrame: The combined payments
+        """
+        # Update the cycle and validity range of the unclaimed payments
+        unclaimed_payments = unclaimed_payments.assign(
+            paymentCycle=payment_cycle,
+            validFrom=payment_cycle,
+            validTo=payment_cycle + self.duration,
+        )
+        columns = [
+            column
+            for column in current_cycle_payments.columns
+            if column != "explanationData"
+        ]
+        payments = pd.concat(
+            [
+                current_cycle_payments[columns],
+                unclaimed_payments.reindex(columns=columns),
+            ],
+            ignore_index=True,
+        )
+        if len(payments) == 0:
+            return current_cycle_payments
+        # Group payments of the same token and user together, keeping groups in the
+        # order they first appear and each group's payments in cycle order
+        group = (
+            payments.groupby(
+                [
+                    payments["rewardProgramID"].str.lower(),
+                    payments["payee"].str.lower(),
+                    payments["token"].str.lower(),
+                ],
+                sort=False,
+            )
+            .ngroup()
+            .to_numpy()
+        )
+        order = np.lexsort((payments["paymentCycle"].to_numpy(), group))
+        group = group[order]
+        payments = payments.iloc[order].reset_index(drop=True)
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        # The first payment of each group has the general data, the others just have
+        # amounts that need summing
+        limbs = amount_limbs(payments["amount"].to_numpy())
+        totals = np.add.reduceat(limbs, starts, axis=0)
+        merged = payments.iloc[starts].reset_index(drop=True)
+        merged["amount"] = amounts_from_limbs(totals)
+        rollover_amounts = amounts_from_limbs(totals - limbs[starts])
+        # Plain lists of python values are much faster to build rows from than to_dict
+        rows = zip(*(merged[column].tolist() for column in columns))
+        merged["explanationData"] = [
+            {
+                **self.get_explanation_data(dict(zip(columns, row))),
+                "rollover_amount": format_amount(rollover_amount),
+            }
+            for row, rollover_amount in zip(rows, rollover_amounts.tolist())
+        ]
+        return merged
+
+    def load_state(self, location):
+        """Load the state saved at the end of the previous payment cycle"""
+        table = pq.read_table(get_local_file(AnyPath(location)))
+        self.state = table.replace_schema_metadata()
+        self.state_block = int(table.schema.metadata[b"state_block"])
+
+    def save_state(self, location):
+        """Save the state at the end of the last payment cycle run, if the rule keeps any
+
+        Returns:
+            bool: Whether any state was saved
+        """
+        if self.state is None:
+            return False
+        table = self.state.replace_schema_metadata(
+            {"state_block": str(self.state_block)}
+        )
+        with AnyPath(location).open("wb") as stream:
+            pq.write_table(table, stream)
+        return True
 
     @staticmethod
     def get_summary(payment_list):
@@ -42,9 +42,16 @@ class RetroAirdrop(Rule):
         prepaid_card_payment = get_table_dataset(
             self.subgraph_config_locations["prepaid_card_payment"],
             "prepaid_card_payment",
+            min_block=self.start_snapshot_block + 1,
+            max_block=self.end_snapshot_block,
         )
         self.connection.register("prepaid_card_payment", prepaid_card_payment)
 
+    def register_tables_for_cycles(self, payment_cycles):
+        # The snapshot doesn't depend on the payment cycle
+        self.register_tables()
+        return True
+
     def sql(self):
         return """
         select
@@ -95,7 +102,8 @@ class RetroAirdrop(Rule):
         )
 
     def run(self, payment_cycle: int, reward_program_id: str):
-        self.register_tables()
+        if not self.tables_registered:
+            self.register_tables()
         vars = [self.start_snapshot_block, self.end_snapshot_block]
 
         base_df = self.connection.execute(self.sql(), vars, None).fetch_df()
@@ -1,3 +1,4 @@
+import pandas as pd
 from cardpay_reward_programs.rule import Rule
 from cardpay_reward_programs.utils import format_amount, get_table_dataset
 
@@ -31,40 +32,123 @@ class SafeOwnership(Rule):
         self.safe_type = safe_type
         self.max_rewards = max_rewards
 
-    def register_tables(self):
+    def register_tables(self, payment_cycle, first_payment_cycle=None):
+        # Several cycles up to payment_cycle can be run from the same tables
+        if first_payment_cycle is None:
+            first_payment_cycle = payment_cycle
         safe_owner = get_table_dataset(
-            self.subgraph_config_locations["safe_owner"], "safe_owner"
+            self.subgraph_config_locations["safe_owner"],
+            "safe_owner",
+            min_block=min(
+                self.start_analysis_block,
+                first_payment_cycle - self.payment_cycle_length,
+            )
+            + 1,
+            max_block=payment_cycle,
         )
         self.connection.register("safe_owner", safe_owner)
 
     def sql(self):
         return """
-        with total_safes as (select
+        -- Count each owner's safes since the start of the analysis and in this cycle
+        -- in a single pass over the ownership history
+        with safe_counts as (select
                 owner as payee,
-                count(distinct safe) as total_safe_count
+                count(distinct case when _block_number > $1::integer then safe end) as total_safe_count,
+                count(distinct case when _block_number > ($2 - $3) then safe end) as new_safe_count
                 from safe_owner
-                where _block_number > $1::integer and _block_number <= $2::integer
+                where _block_number > least($1::integer, $2 - $3) and _block_number <= $2::integer
                 and type = $4::text
                 group by owner
-                ),
+            )
+        select payee,
+        -- Reward is the least out of remaining allowed rewards and the total number of new safes
+        least($5 - total_safe_count + new_safe_count, new_safe_count) as payable_safes
+        from safe_counts
+        where payable_safes > 0
+        """
+
+    def register_tables_for_cycles(self, payment_cycles):
+        self.register_tables(payment_cycles[-1], payment_cycles[0])
+        return True
+
+    def cycles_sql(self):
+        return """
+        -- The safes of the type created in the range of cycles, each cycle being a
+        -- window of $3 blocks ending at (and including) its payment cycle
+        with created_safes as (select
+                owner,
+                safe,
+                _block_number
+                from safe_owner
+                where _block_number > least($1::integer, (select min(payment_cycle) from payment_cycles) - $3)
+                and _block_number <= (select max(payment_cycle) from payment_cycles)
+                and type = $2::text
+            ),
             new_safes as (select
+                payment_cycle,
                 owner as payee,
                 count(distinct safe) as new_safe_count
-                from safe_owner
-                where _block_number > ($2 - $3) and _block_number <= $2::integer
-                and type = $4::text
-                group by owner
+                from payment_cycles
+                join created_safes
+                on _block_number > payment_cycle - $3 and _block_number <= payment_cycle
+                group by payment_cycle, owner
+            ),
+            -- When each owner first had each safe since the start of the analysis, so
+            -- the total for every cycle comes from one pass
+            first_created as (select
+                owner,
+                safe,
+                min(_block_number) as first_block_number
+                from created_safes
+                where _block_number > $1::integer
+                group by owner, safe
+            ),
+            safe_counts as (select
+                new_safes.payment_cycle,
+                new_safes.payee,
+                count(first_created.safe) as total_safe_count,
+                any_value(new_safe_count) as new_safe_count
+                from new_safes
+                left join first_created
+                on first_created.owner = new_safes.payee
+                and first_block_number <= new_safes.payment_cycle
+                group by new_safes.payment_cycle, new_safes.payee
             )
-        select new_safes.payee as payee,
+        select payment_cycle, payee,
         -- Reward is the least out of remaining allowed rewards and the total number of new safes
-        least($5 - total_safe_count + new_safe_count, new_safe_count) as payable_safes
-        from new_safes
-        left join total_safes on total_safes.payee = new_safes.payee
+        least($4 - total_safe_count + new_safe_count, new_safe_count) as payable_safes
+        from safe_counts
         where payable_safes > 0
         """
 
+    def run_cycles(self, payment_cycles, reward_program_id: str):
+        """Calculate the payments for several payment cycles with a single query"""
+        payment_cycles = sorted(payment_cycles)
+        if not payment_cycles:
+            return
+        self.register_tables_for_cycles(payment_cycles)
+        self.connection.register(
+            "payment_cycles", pd.DataFrame({"payment_cycle": payment_cycles})
+        )
+        vars = [
+            self.start_analysis_block,
+            self.safe_type,
+            self.payment_cycle_length,
+            self.max_rewards,
+        ]
+        df = self.connection.execute(self.cycles_sql(), vars).fetch_df()
+        cycles = dict(list(df.groupby("payment_cycle")))
+        for payment_cycle in payment_cycles:
+            cycle_df = cycles.get(payment_cycle, df.iloc[:0])
+            yield payment_cycle, self.to_payments(
+                cycle_df.drop(columns=["payment_cycle"]).reset_index(drop=True),
+                payment_cycle,
+                reward_program_id,
+            )
+
     def run(self, payment_cycle: int, reward_program_id: str):
-        self.register_tables()
+        self.register_tables(payment_cycle)
         vars = [
             self.start_analysis_block,
             payment_cycle,
@@ -73,6 +157,9 @@ class SafeOwnership(Rule):
             self.max_rewards,
         ]
         df = self.connection.execute(self.sql(), vars).fetch_df()
+        return self.to_payments(df, payment_cycle, reward_program_id)
+
+    def to_payments(self, df, payment_cycle, reward_program_id):
         df["rewardProgramID"] = reward_program_id
         df["paymentCycle"] = payment_cycle
         df["validFrom"] = payment_cycle
@@ -18,76 +18,141 @@ class Staking(Rule):
         self.token = token
         self.interest_rate_monthly = interest_rate_monthly
 
-    def register_tables(self):
+    def register_tables(self, end_block, start_block=None):
+        # Balances and owners are accumulated from the start of history, so only
+        # blocks after the cycle can be skipped, unless we continue from the state
+        # at start_block
         safe_owner = get_table_dataset(
-            self.subgraph_config_locations["safe_owner"], "safe_owner"
+            self.subgraph_config_locations["safe_owner"],
+            "safe_owner",
+            min_block=start_block,
+            max_block=end_block - 1,
         )
         self.connection.register("safe_owner", safe_owner)
         token_holder = get_table_dataset(
-            self.subgraph_config_locations["token_holder"], "token_holder"
+            self.subgraph_config_locations["token_holder"],
+            "token_holder",
+            min_block=start_block,
+            max_block=end_block - 1,
         )
         self.connection.register("token_holder", token_holder)
 
-    def sql(self):
-        return """
+    def register_tables_for_cycles(self, payment_cycles):
+        # Consecutive cycles each continue from the state left by the one before, so
+        # only the first may need history from before the range
+        start_block = payment_cycles[0] - self.payment_cycle_length
+        consecutive = all(
+            b - a == self.payment_cycle_length
+            for a, b in zip(payment_cycles, payment_cycles[1:])
+        )
+        if consecutive and self.state is not None and self.state_block == start_block:
+            self.register_tables(payment_cycles[-1], start_block)
+        else:
+            self.register_tables(payment_cycles[-1])
+        return True
+
+    def history_sql(self, start_block=None):
+        """
+        The ownership and balance history the rule works from.
+        Continuing from the state at start_block this is just the events of the cycle,
+        preceded by each safe's last owner and balance before the cycle.
+        """
+        if start_block is None:
+            return """
+            safe_owner_history AS (
+                SELECT safe, owner, type, _block_number FROM safe_owner
+            ),
+            token_holder_history AS (
+                SELECT safe, token, balance_downscale_e9_uint64::int64 AS balance_int64, _block_number
+                FROM token_holder
+            ),
+            """
+        return f"""
+            safe_owner_history AS (
+                SELECT safe, owner, type, _block_number::int64 AS _block_number FROM safe_owner
+                WHERE _block_number::integer >= {int(start_block)}
+                UNION ALL
+                SELECT safe, owner, 'depot' AS type, owner_block AS _block_number FROM staking_state
+                WHERE owner IS NOT NULL
+            ),
+            token_holder_history AS (
+                SELECT safe, token, balance_downscale_e9_uint64::int64 AS balance_int64, _block_number::int64 AS _block_number
+                FROM token_holder
+                WHERE _block_number::integer >= {int(start_block)}
+                UNION ALL
+                SELECT safe, token, balance_int64, balance_block AS _block_number FROM staking_state
+                WHERE balance_int64 IS NOT NULL
+            ),
+            """
+
+    def sql(self, start_block=None):
+        return f"""
+            WITH {self.history_sql(start_block)}
             -- Select only the safes we are rewarding, and their owner at the end of the cycle
-            with filtered_safes AS (
+            last_owners AS (
+                SELECT safe, owner, type
+                FROM safe_owner_history
+                WHERE _block_number::integer < $2::integer
+                QUALIFY _block_number = max(_block_number) OVER (PARTITION BY safe)
+            ),
+            filtered_safes AS (
                 SELECT safe, max(owner) as owner
-                FROM safe_owner a
-                WHERE _block_number = (
-                    SELECT MAX(_block_number)
-                    FROM safe_owner b
-                    WHERE a.safe = b.safe
-                    AND _block_number::integer < $2::integer
-                )
-                AND type = 'depot'
+                FROM last_owners
+                WHERE type = 'depot'
                 GROUP BY safe
             ),
             -- Get the balance history of the safes we are interested in, filtered to the token,
             -- joining to get the owner
             filtered_balances AS (
-                SELECT tht.safe, sot.owner, tht.balance_downscale_e9_uint64::int64 AS balance_int64, tht._block_number
-                FROM token_holder AS tht
-                LEFT JOIN filtered_safes AS sot ON (tht.safe = sot.safe)
+                SELECT tht.safe, sot.owner, tht.balance_int64, tht._block_number
+                FROM token_holder_history AS tht
+                JOIN filtered_safes AS sot ON (tht.safe = sot.safe)
                 WHERE token = $3::text
-                AND sot.safe IS NOT NULL
+                AND _block_number::integer < $2::integer
             ),
-            -- Get the deposits & withdrawals by comparing balances to the previous balance
-            balance_changes AS (
+            -- Each safe's last balance before the cycle, which is treated as a deposit at its start
+            original_balances AS (
                 SELECT
                     safe,
                     owner,
-                    -- Get the change by subtracting the balance before
-                    balance_int64 - LAG(balance_int64, 1 ,0) OVER (PARTITION BY safe ORDER BY _block_number asc) AS change,
-                    $5::float+1 AS interest_rate,
-                    -- This is the proportion of the 'month' remaining
-                    ($2::integer - _block_number::integer) / $4::float AS compounding_periods,
+                    arg_max(balance_int64, _block_number) AS balance_int64,
+                    max(_block_number) AS _block_number
                 FROM filtered_balances
-                WHERE _block_number::integer < $2::integer
+                WHERE _block_number::integer < $1::integer
+                GROUP BY safe, owner
+            ),
+            -- Get the deposits & withdrawals by comparing balances to the previous balance,
+            -- only sorting the balances in the cycle rather than all history
+            balance_changes AS (
+                SELECT
+                    owner,
+                    _block_number,
+                    -- Get the change by subtracting the balance before
+                    balance_int64 - LAG(balance_int64, 1, 0) OVER (PARTITION BY safe ORDER BY _block_number asc) AS change
+                FROM (
+                    SELECT safe, owner, balance_int64, _block_number FROM original_balances
+                    UNION ALL
+                    SELECT safe, owner, balance_int64, _block_number FROM filtered_balances
+                    WHERE _block_number::integer >= $1::integer
+                )
                 QUALIFY _block_number::integer >= $1::integer
-                ),
-            original_balances AS (
+            ),
+            all_data AS (
                 SELECT
-                    safe,
                     owner,
-                    -- There is only one value here after the group but logically it is the "last" balance
-                    -- it is called "change" to match the balance_changes CTE so we can union them together
-                    LAST(balance_int64) AS change,
+                    balance_int64 AS change,
                     $5::float+1 AS interest_rate,
-                    1 AS compounding_periods,
-                FROM filtered_balances a
-                WHERE _block_number::integer < $1::integer
-                AND _block_number = (
-                    SELECT MAX(_block_number)
-                    FROM filtered_balances b
-                    WHERE a.safe = b.safe
-                    AND _block_number::integer < $1::integer
-                )
-                GROUP BY safe, owner
-                ),
-
-            -- Combine the balances at the start of the period and
-            all_data AS (SELECT * FROM original_balances UNION ALL SELECT * FROM balance_changes)
+                    1 AS compounding_periods
+                FROM original_balances
+                UNION ALL
+                SELECT
+                    owner,
+                    change,
+                    $5::float+1 AS interest_rate,
+                    -- This is the proportion of the 'month' remaining
+                    ($2::integer - _block_number::integer) / $4::float AS compounding_periods
+                FROM balance_changes
+            )
 
             -- Aggregate the changes, each is treated as a compounding interest calculation
             -- rate^(periods) gives you the total after growth, so we need to take 1 away to get just the growth
@@ -98,12 +163,54 @@ class Staking(Rule):
             GROUP BY payee
         """
 
+    def state_sql(self, start_block=None):
+        return f"""
+            WITH {self.history_sql(start_block)}
+            -- Each safe's owner at the end of the cycle, if it is a depot
+            last_owners AS (
+                SELECT
+                    safe,
+                    max(CASE WHEN type = 'depot' THEN owner END) AS owner,
+                    max(_block_number)::int64 AS owner_block
+                FROM safe_owner_history
+                WHERE _block_number::integer < $1::integer
+                GROUP BY safe, _block_number
+                QUALIFY _block_number = max(_block_number) OVER (PARTITION BY safe)
+            ),
+            -- Each safe's balance of the token at the end of the cycle
+            last_balances AS (
+                SELECT safe, token, balance_int64, _block_number::int64 AS balance_block
+                FROM token_holder_history
+                WHERE token = $2::text
+                AND _block_number::integer < $1::integer
+                QUALIFY row_number() OVER (PARTITION BY safe ORDER BY _block_number DESC, balance_int64 DESC) = 1
+            )
+            SELECT
+                coalesce(last_owners.safe, last_balances.safe) AS safe,
+                owner,
+                owner_block,
+                token,
+                balance_int64,
+                balance_block
+            FROM last_owners
+            FULL OUTER JOIN last_balances ON (last_owners.safe = last_balances.safe)
+            -- Safes that aren't depots only matter again once they have a new owner
+            WHERE owner IS NOT NULL OR balance_int64 IS NOT NULL
+        """
+
     def run(self, payment_cycle: int, reward_program_id: str):
-        self.register_tables()
         start_block, end_block = (
             payment_cycle - self.payment_cycle_length,
             payment_cycle,
         )
+        # Only the events in the cycle are needed if we have the state at its start
+        if self.state is not None and self.state_block == start_block:
+            state_block = start_block
+            self.connection.register("staking_state", self.state)
+        else:
+            state_block = None
+        if not self.tables_registered:
+            self.register_tables(end_block, state_block)
         vars = [
             start_block,  # $1 -> int
             end_block,  # $2 -> int
@@ -112,7 +219,15 @@ class Staking(Rule):
             self.interest_rate_monthly,  # $5 -> float
         ]
 
-        df = self.connection.execute(self.sql(), vars).fetch_df()
+        df = self.connection.execute(self.sql(state_block), vars).fetch_df()
+        if self.keep_state:
+            state = self.connection.execute(
+                self.state_sql(state_block), vars[1:3]
+            ).arrow()
+            self.state, self.state_block = state, end_block
+        else:
+            # The state no longer describes the end of the last cycle run
+            self.state, self.state_block = None, None
         df["rewardProgramID"] = reward_program_id
         df["paymentCycle"] = payment_cycle
         df["validFrom"] = payment_cycle
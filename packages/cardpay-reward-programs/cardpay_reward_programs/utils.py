@@ -1,21 +1,52 @@
-import binascii
+import os
 import tempfile
+import weakref
+from functools import partial
 from pathlib import PosixPath
 
 import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.dataset as ds
 import pyarrow.parquet as pq
 import yaml
+from boto3.session import Session
 from cachetools import TTLCache, cached
-from cloudpathlib import AnyPath, CloudPath
+from cloudpathlib import AnyPath, CloudPath, S3Client, S3Path
 from pyarrow import fs
 
-from .payment_tree import decode_payment
+from .merkle import unhex_rows
+from .multipart import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_PART_SIZE,
+    MultipartUploadFile,
+    S3MultipartBackend,
+)
+from .partition_cache import PartitionCache, get_default_cache
+from .payment_tree import PAYMENT_COLUMNS, PAYMENT_LEAF_SIZE, decode_payments
+
+
+def configure_default_storage():
+    """
+    Read S3 through a local cache, and keep subgraph partitions and previous results
+    (which are immutable) between runs
+    """
+    S3Client(local_cache_dir=".cache", boto3_session=Session()).set_as_default_client()
+    PartitionCache(
+        os.environ.get("PARTITION_CACHE_DIR", ".cache/partitions"),
+        max_size=int(float(os.environ.get("PARTITION_CACHE_MAX_GB", 20)) * 1024**3),
+    ).set_as_default()
 
 
 def get_local_file(file_location):
     if isinstance(file_location, PosixPath):
         return file_location.as_posix()
+    elif isinstance(file_location, CloudPath) and get_default_cache() is not None:
+        return get_default_cache().get(
+            str(file_location), partial(open_remote_stream, file_location)
+        )
     elif isinstance(file_location, CloudPath):
         if file_location._local.exists():
             # Our files are immutable so if the local cache exists
@@ -28,13 +59,109 @@ def get_local_file(file_location):
         raise Exception("Unsupported path type")
 
 
+def open_remote_stream(file_location):
+    """
+    Open a cloud file for reading. S3 objects are streamed rather than going through
+    cloudpathlib's local cache, so the partition cache holds the only local copy.
+    """
+    if isinstance(file_location, S3Path):
+        return file_location.client.client.get_object(
+            Bucket=file_location.bucket, Key=file_location.key
+        )["Body"]
+    return file_location.open("rb")
+
+
 @cached(TTLCache(maxsize=1000, ttl=60))
 def get_latest_details(config_location):
     with open(config_location / "latest.yaml", "r") as stream:
         return yaml.safe_load(stream)
 
 
-def get_table_dataset(config_location, table):
+@cached(TTLCache(maxsize=1000, ttl=60))
+def get_extraction_config(config_location):
+    config_file = config_location / "config.yaml"
+    if not config_file.exists():
+        return {}
+    with open(config_file, "r") as stream:
+        return yaml.safe_load(stream)
+
+
+def get_block_column(config_location, table, schema):
+    """
+    The column holding the block number each table is partitioned on, which is the
+    uint64 column the partition column is mapped to if it has been mapped
+    """
+    table_config = (
+        get_extraction_config(config_location).get("tables", {}).get(table, {})
+    )
+    partition_column = table_config.get("partition_column", "_block_number")
+    mappings = table_config.get("column_mappings", {}).get(partition_column, {})
+    for column in [*mappings, partition_column]:
+        if column in schema.names:
+            return column
+    return None
+
+
+def _partition_range(path):
+    # Partitions are written as .../start_partition=<block>/end_partition=<block>/...
+    bounds = {}
+    for part in path.split("/"):
+        key, _, value = part.partition("=")
+        if key in ("start_partition", "end_partition"):
+            bounds[key] = int(value)
+    if len(bounds) != 2:
+        return None
+    return bounds["start_partition"], bounds["end_partition"]
+
+
+def prune_dataset(dataset, block_column, min_block=None, max_block=None):
+    """
+    Limit a parquet dataset to the files and row groups that can contain blocks in
+    [min_block, max_block], using the block range of each partition and then the
+    row group statistics of block_column.
+    Rows are not filtered, so queries still need their own block conditions.
+    """
+    block_filter = None
+    if block_column is not None:
+        for condition in [
+            ds.field(block_column) >= min_block if min_block is not None else None,
+            ds.field(block_column) <= max_block if max_block is not None else None,
+        ]:
+            if condition is not None:
+                block_filter = (
+                    condition if block_filter is None else block_filter & condition
+                )
+    fragments = []
+    for fragment in dataset.get_fragments():
+        partition_range = _partition_range(fragment.path)
+        if partition_range is not None:
+            start_partition, end_partition = partition_range
+            if (max_block is not None and start_partition > max_block) or (
+                min_block is not None and end_partition <= min_block
+            ):
+                continue
+        if block_filter is not None:
+            fragment = fragment.subset(filter=block_filter)
+            if not fragment.row_groups:
+                continue
+        fragments.append(fragment)
+    return ds.FileSystemDataset(
+        fragments, dataset.schema, dataset.format, dataset.filesystem
+    )
+
+
+def get_table_dataset(config_location, table, min_block=None, max_block=None):
+    """Get the dataset of a table from a subgraph extraction
+
+    Args:
+        config_location (str): The root of the subgraph extraction, containing latest.yaml
+        table (str): The table name
+        min_block (int, optional): If set, skip partitions and row groups that only hold earlier blocks
+        max_block (int, optional): If set, skip partitions and row groups that only hold later blocks
+
+    Returns:
+        Dataset: A pyarrow dataset of the table, limited to the given (inclusive) block range
+    """
     config_location = AnyPath(config_location)
     latest = get_latest_details(config_location)
     table_metadata = config_location.joinpath(
@@ -44,7 +171,79 @@ def get_table_dataset(config_location, table):
         "_metadata",
     )
     filesystem, path = fs.FileSystem.from_uri(str(table_metadata))
-    return ds.parquet_dataset(path, filesystem=filesystem)
+    dataset = ds.parquet_dataset(path, filesystem=filesystem)
+    if min_block is not None or max_block is not None:
+        block_column = get_block_column(config_location, table, dataset.schema)
+        dataset = prune_dataset(dataset, block_column, min_block, max_block)
+    if get_default_cache() is not None and "latest_block" in latest:
+        dataset = cache_dataset(get_default_cache(), dataset, latest["latest_block"])
+    return dataset
+
+
+def cache_dataset(cache, dataset, latest_block):
+    """
+    Read the complete partitions of a dataset through the partition cache.
+    Partitions that may still be written to (or don't say which blocks they hold)
+    are read from their original location.
+
+    The cached partitions are pinned until the returned dataset is garbage collected,
+    so they can't be evicted while it's being read.
+    """
+    cached, uncached = [], []
+    for fragment in dataset.get_fragments():
+        partition_range = _partition_range(fragment.path)
+        if partition_range is not None and partition_range[1] <= latest_block:
+            cached.append(fragment)
+        else:
+            uncached.append(fragment)
+    if not cached:
+        return dataset
+    items = [
+        (
+            f"{dataset.filesystem.type_name}://{fragment.path}",
+            partial(dataset.filesystem.open_input_stream, fragment.path),
+        )
+        for fragment in cached
+    ]
+    pin = cache.pin([location for location, _ in items])
+    try:
+        local_paths = cache.get_many(items)
+    except BaseException:
+        pin.release()
+        raise
+    local_filesystem = fs.LocalFileSystem()
+    local_dataset = ds.FileSystemDataset(
+        [
+            dataset.format.make_fragment(
+                local_path,
+                local_filesystem,
+                row_groups=[row_group.id for row_group in fragment.row_groups],
+            )
+            for fragment, local_path in zip(cached, local_paths)
+        ],
+        dataset.schema,
+        dataset.format,
+        local_filesystem,
+    )
+    if uncached:
+        local_dataset = ds.dataset(
+            [
+                local_dataset,
+                ds.FileSystemDataset(
+                    uncached, dataset.schema, dataset.format, dataset.filesystem
+                ),
+            ]
+        )
+    weakref.finalize(local_dataset, pin.release)
+    return local_dataset
+
+
+def prewarm_partition_cache(config_location, table, min_block=None, max_block=None):
+    """Download the complete partitions of a table holding the given blocks into the cache"""
+    if get_default_cache() is None:
+        raise Exception("No partition cache has been set up")
+    dataset = get_table_dataset(config_location, table, min_block, max_block)
+    return sum(1 for _ in dataset.get_fragments())
 
 
 def get_parameters(parameters):
@@ -64,16 +263,43 @@ def get_payment_cycle(start_block, end_block, payment_cycle_length):
 
 
 def write_parquet_file(file_location, table):
-    # Pyarrow can't take a file object so we have to write to a temp file
-    # and upload directly
-    if isinstance(file_location, CloudPath):
+    write_parquet_batches(file_location, table.schema, table.to_batches())
+
+
+def write_parquet_batches(
+    file_location,
+    schema,
+    batches,
+    part_size=DEFAULT_PART_SIZE,
+    concurrency=DEFAULT_CONCURRENCY,
+):
+    """
+    Write record batches to results.parquet in file_location one at a time, so only
+    the batch currently being written needs to be held in memory.
+
+    S3 targets are streamed straight into a multipart upload with parts of part_size
+    bytes, up to concurrency of which are uploaded at once.
+    """
+    if isinstance(file_location, S3Path):
+        backend = S3MultipartBackend.for_path(file_location / "results.parquet")
+        with MultipartUploadFile(backend, part_size, concurrency) as sink:
+            _write_batches(sink, schema, batches)
+    elif isinstance(file_location, CloudPath):
+        # Pyarrow can't take a file object so we have to write to a temp file
+        # and upload directly
         with tempfile.TemporaryDirectory() as temp_dir:
             pq_file_location = AnyPath(temp_dir) / "results.parquet"
-            pq.write_table(table, pq_file_location)
+            _write_batches(pq_file_location, schema, batches)
             file_location.joinpath("results.parquet").upload_from(pq_file_location)
     else:
         file_location.mkdir(parents=True, exist_ok=True)
-        pq.write_table(table, file_location / "results.parquet")
+        _write_batches(file_location / "results.parquet", schema, batches)
+
+
+def _write_batches(sink, schema, batches):
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
 
 
 def get_unclaimed_rewards(previous_output_location, claims_data_root, block):
@@ -85,42 +311,76 @@ def get_unclaimed_rewards(previous_output_location, claims_data_root, block):
         block (int): The block number to be treated as "now", for the purposes of calculating the unclaimed rewards
 
     Returns:
-        List[Payment]: A list of Payments, one for each unclamied reward
+        DataFrame: A dataframe of Payments, one for each unclaimed reward
     """
     con = duckdb.connect(":memory:")
-    # Create a table that contains all claims, this is lazy and will not pull all data
-    con.register(
-        "rewardee_claims", get_table_dataset(claims_data_root, "rewardee_claim")
-    )
     # Load the previous output, filtering on only rewards that have expired
     rewards = con.execute(
-        f"select * from '{get_local_file(AnyPath(previous_output_location))}' where validTo <= ?",
+        f"""select rewardProgramID, paymentCycle, validFrom, validTo, tokenType, payee, leaf
+        from '{get_local_file(AnyPath(previous_output_location))}' where validTo <= ?""",
         [block],
-    ).df()
+    ).arrow()
+    if rewards.num_rows == 0:
+        return pd.DataFrame(columns=list(PAYMENT_COLUMNS))
+    # The exported data from the subgraph has binary leaves, so compare against the
+    # raw bytes of the previous output's hex leaves
+    leaves = unhex_rows(rewards["leaf"], PAYMENT_LEAF_SIZE)
+    binary_leaves = pa.Array.from_buffers(
+        pa.binary(),
+        len(leaves),
+        [
+            None,
+            pa.py_buffer(
+                np.arange(len(leaves) + 1, dtype=np.int32) * PAYMENT_LEAF_SIZE
+            ),
+            pa.py_buffer(leaves),
+        ],
+    )
+    con.register(
+        "rewards",
+        rewards.drop(["leaf"])
+        .append_column("leaf", binary_leaves)
+        .append_column("position", pa.array(np.arange(len(leaves)))),
+    )
     # We only need to look at claims made that happened after the first one became eligible to claim
     # e.g. if the first claim became eligible to claim at block 100 (validFrom=100), we only need to
     # look at claims made after block 100, and only up to the "current" block
-    if rewards.empty:
-        return []
-    first_claimable_reward_block = int(rewards["validFrom"].min())
-    claimed_df = con.execute(
-        "select leaf from rewardee_claims where _block_number >= ? and _block_number <= ?",
+    first_claimable_reward_block = pc.min(rewards["validFrom"]).as_py()
+    # Create a table that contains the claims in that range, this is lazy and will not pull all data
+    con.register(
+        "rewardee_claims",
+        get_table_dataset(
+            claims_data_root,
+            "rewardee_claim",
+            min_block=first_claimable_reward_block,
+            max_block=block,
+        ),
+    )
+    # The unclaimed rewards are ones where the leaf is not in the list of all claimed leaves
+    unclaimed_rewards = con.execute(
+        """
+        with claimed as (
+            select leaf from rewardee_claims
+            where _block_number >= ? and _block_number <= ?
+        )
+        select rewardProgramID, paymentCycle, validFrom, validTo, tokenType, payee, position
+        from rewards
+        left join claimed on claimed.leaf = rewards.leaf
+        where claimed.leaf is null
+        order by position
+        """,
         [first_claimable_reward_block, block],
     ).df()
-    # The exported data from the subgraph is a different binary structure so we need to convert it
-    claimed_df["leaf"] = claimed_df["leaf"].map(
-        lambda leaf: binascii.hexlify(leaf).decode()
+    # Everything but the token and amount is already a column of the previous output
+    transfers = decode_payments(
+        leaves[unclaimed_rewards.pop("position").to_numpy()],
+        columns=["token", "amount"],
     )
-    # The unclaimed rewards are ones where the leaf is not in the list of all claimed leaves
-    unclaimed_rewards = rewards[~rewards["leaf"].isin(claimed_df["leaf"])]
-
-    # Convert these to payments
-    unclaimed_payments = []
-    for claim in unclaimed_rewards.to_dict(orient="records"):
-        unclaimed_payments.append(decode_payment(claim["leaf"]))
-
-    return unclaimed_payments
+    return pd.concat([unclaimed_rewards, transfers], axis=1)[list(PAYMENT_COLUMNS)]
 
 
 def format_amount(possibly_scientific_amount):
+    # Formatting as a float would lose precision on large integers
+    if isinstance(possibly_scientific_amount, (int, np.integer)):
+        return str(int(possibly_scientific_amount))
     return "{:.0f}".format(possibly_scientific_amount)
@@ -0,0 +1,65 @@
+import time
+from typing import List
+
+import numpy as np
+import typer
+from cardpay_reward_programs.merkle import MerkleTree
+from cardpay_reward_programs.payment_tree import hashfunc
+from merklelib import MerkleTree as ReferenceMerkleTree
+
+# Size in bytes of an abi encoded payment leaf
+LEAF_SIZE = 320
+
+
+def random_leaves(n, seed=0):
+    rng = np.random.default_rng(seed)
+    buffer = rng.bytes(n * LEAF_SIZE)
+    return [buffer[i : i + LEAF_SIZE] for i in range(0, n * LEAF_SIZE, LEAF_SIZE)]
+
+
+def time_native(leaves):
+    start = time.perf_counter()
+    tree = MerkleTree(leaves)
+    built = time.perf_counter()
+    tree.hex_proofs()
+    done = time.perf_counter()
+    return tree.hex_root, built - start, done - built
+
+
+def time_merklelib(leaves):
+    start = time.perf_counter()
+    tree = ReferenceMerkleTree(leaves, hashfunc)
+    built = time.perf_counter()
+    for leaf in leaves:
+        tree.get_proof(leaf).hex_nodes
+    done = time.perf_counter()
+    return tree.merkle_root, built - start, done - built
+
+
+def benchmark_merkle_tree(
+    sizes: List[int] = typer.Option(
+        [10_000, 100_000, 1_000_000], help="Number of leaves to benchmark"
+    ),
+    compare: bool = typer.Option(
+        True, help="Also time merklelib (slow for the largest sizes)"
+    ),
+):
+    """
+    Time building a tree and generating every proof, as PaymentTree.as_arrow does
+    """
+    # Warm up lazily initialised numpy/arrow machinery so it isn't counted
+    time_native(random_leaves(10))
+    print(f"{'leaves':>10} {'impl':>10} {'build (s)':>10} {'proofs (s)':>11}")
+    for n in sizes:
+        leaves = random_leaves(n)
+        root, build, proofs = time_native(leaves)
+        print(f"{n:>10} {'native':>10} {build:>10.2f} {proofs:>11.2f}")
+        if compare:
+            reference_root, build, proofs = time_merklelib(leaves)
+            print(f"{n:>10} {'merklelib':>10} {build:>10.2f} {proofs:>11.2f}")
+            if root != reference_root:
+                raise Exception(f"Root mismatch for {n} leaves")
+
+
+if __name__ == "__main__":
+    typer.run(benchmark_merkle_tree)
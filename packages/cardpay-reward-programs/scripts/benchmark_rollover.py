@@ -0,0 +1,132 @@
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pydash as py_
+import typer
+from cardpay_reward_programs.rules import FlatPayment
+from cardpay_reward_programs.utils import format_amount
+
+PROGRAM = "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72"
+TOKEN = "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f"
+
+
+def random_payees(rng, n):
+    raw = rng.bytes(n * 20)
+    return ["0x" + raw[i : i + 20].hex() for i in range(0, n * 20, 20)]
+
+
+def make_rule():
+    return FlatPayment(
+        {
+            "start_block": 0,
+            "end_block": 1000,
+            "payment_cycle_length": 100,
+            "duration": 100,
+            "subgraph_config_locations": {},
+            "rollover": True,
+        },
+        {"reward_per_user": 1000, "token": TOKEN, "accounts": []},
+    )
+
+
+def make_payments(rule, current, unclaimed, seed=0):
+    """Current cycle payments, plus unclaimed payments half of which overlap them"""
+    rng = np.random.default_rng(seed)
+    payees = random_payees(rng, current + unclaimed)
+    current_payments = pd.DataFrame(
+        {
+            "rewardProgramID": PROGRAM,
+            "payee": payees[:current],
+            "paymentCycle": 200,
+            "validFrom": 200,
+            "validTo": 300,
+            "token": TOKEN,
+            "amount": rng.integers(1, 10**18, current),
+        }
+    )
+    current_payments["explanationData"] = [
+        rule.get_explanation_data(payment)
+        for payment in current_payments.to_dict("records")
+    ]
+    overlap = min(current, unclaimed // 2)
+    unclaimed_payments = pd.DataFrame(
+        {
+            "rewardProgramID": PROGRAM.lower(),
+            "paymentCycle": 100,
+            "validFrom": 100,
+            "validTo": 200,
+            "tokenType": 1,
+            "payee": payees[:overlap] + payees[current : current + unclaimed - overlap],
+            "token": TOKEN.lower(),
+            "amount": pd.Series(
+                [int(a) * 10**6 for a in rng.integers(1, 10**18, unclaimed)],
+                dtype=object,
+            ),
+        }
+    )
+    return current_payments, unclaimed_payments
+
+
+def merge_rollover_dicts(rule, current_payments, unclaimed_payments, payment_cycle):
+    """The previous implementation of Rule.get_payments' rollover merge"""
+    payment_list = current_payments.to_dict("records")
+    unclaimed = unclaimed_payments.to_dict("records")
+    for payment in unclaimed:
+        payment["paymentCycle"] = payment_cycle
+        payment["validFrom"] = payment_cycle
+        payment["validTo"] = payment_cycle + rule.duration
+    combined_payments = py_.group_by(
+        payment_list + unclaimed,
+        lambda x: (
+            x["rewardProgramID"].lower(),
+            x["payee"].lower(),
+            x["token"].lower(),
+        ),
+    )
+    new_payment_list = []
+    for _, payments in combined_payments.items():
+        payments = py_.sort_by(payments, "paymentCycle")
+        rollover_amount = sum(p["amount"] for p in payments[1:])
+        new_payment = payments[0].copy()
+        new_payment["amount"] = sum([p["amount"] for p in payments])
+        new_payment["explanationData"] = rule.get_explanation_data(new_payment)
+        new_payment["explanationData"]["rollover_amount"] = format_amount(
+            rollover_amount
+        )
+        new_payment_list.append(new_payment)
+    return pd.DataFrame(new_payment_list)
+
+
+def benchmark_rollover(
+    sizes: List[int] = typer.Option(
+        [100_000, 1_000_000],
+        help="Number of unclaimed payments carried over (the cycle has as many again)",
+    ),
+    compare: bool = typer.Option(True, help="Also time the previous implementation"),
+):
+    """
+    Time merging a cycle's payments with the unclaimed payments rolled over into it
+    """
+    rule = make_rule()
+    print(f"{'unclaimed':>10} {'impl':>8} {'merge (s)':>10}")
+    for n in sizes:
+        current_payments, unclaimed_payments = make_payments(rule, n, n)
+        start = time.perf_counter()
+        merged = rule.merge_rollover(current_payments, unclaimed_payments, 200)
+        print(f"{n:>10} {'columnar':>8} {time.perf_counter() - start:>10.2f}")
+        if compare:
+            start = time.perf_counter()
+            expected = merge_rollover_dicts(
+                rule, current_payments, unclaimed_payments, 200
+            )
+            print(f"{n:>10} {'dicts':>8} {time.perf_counter() - start:>10.2f}")
+            if merged["amount"].tolist() != expected["amount"].tolist() or list(
+                merged["explanationData"]
+            ) != list(expected["explanationData"]):
+                raise Exception(f"Merged payments differ for {n} payments")
+
+
+if __name__ == "__main__":
+    typer.run(benchmark_rollover)
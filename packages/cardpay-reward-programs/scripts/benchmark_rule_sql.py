@@ -0,0 +1,123 @@
+import time
+from typing import List
+
+import numpy as np
+import pyarrow as pa
+import typer
+from cardpay_reward_programs.rules import SafeOwnership, Staking
+from tests.rules import legacy_sql
+
+TOKEN = "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f"
+CYCLE_LENGTH = 2**15
+
+
+def addresses(rng, prefix, n, count):
+    return pa.array([f"0x{prefix}{i:038x}" for i in rng.integers(0, n, count)])
+
+
+def make_history(blocks, safes, events, seed=0):
+    """Synthetic safe_owner and token_holder tables covering blocks of history"""
+    rng = np.random.default_rng(seed)
+    safe_owner = pa.table(
+        {
+            "safe": addresses(rng, "5a", safes, safes * 2),
+            "owner": addresses(rng, "0e", safes // 4, safes * 2),
+            "type": np.where(rng.random(safes * 2) < 0.7, "depot", "prepaid"),
+            "_block_number": rng.integers(0, blocks, safes * 2).astype(np.uint64),
+        }
+    )
+    token_holder = pa.table(
+        {
+            "safe": addresses(rng, "5a", safes, events),
+            "token": np.where(rng.random(events) < 0.8, TOKEN, "0x0"),
+            "balance_downscale_e9_uint64": rng.integers(0, 10**9, events).astype(
+                np.uint64
+            ),
+            "_block_number": rng.integers(0, blocks, events).astype(np.uint64),
+        }
+    )
+    return safe_owner, token_holder
+
+
+def make_rules(safe_owner, token_holder):
+    core = {
+        "start_block": 0,
+        "end_block": 2**32,
+        "payment_cycle_length": CYCLE_LENGTH,
+        "duration": CYCLE_LENGTH,
+        "subgraph_config_locations": {},
+    }
+
+    class BenchmarkStaking(Staking):
+        def register_tables(self, end_block, start_block=None):
+            self.connection.register("safe_owner", safe_owner)
+            self.connection.register("token_holder", token_holder)
+
+    class BenchmarkSafeOwnership(SafeOwnership):
+        def register_tables(self, payment_cycle, first_payment_cycle=None):
+            self.connection.register("safe_owner", safe_owner)
+
+    staking = BenchmarkStaking(core, {"token": TOKEN, "interest_rate_monthly": 0.01})
+    safe_ownership = BenchmarkSafeOwnership(
+        core,
+        {
+            "reward_per_safe": 1,
+            "token": TOKEN,
+            "start_analysis_block": 0,
+            "safe_type": "depot",
+            "max_rewards": 3,
+        },
+    )
+    return staking, safe_ownership
+
+
+def time_query(rule, sql, vars):
+    start = time.perf_counter()
+    result = rule.connection.execute(sql, vars).fetch_df()
+    return result, time.perf_counter() - start
+
+
+def benchmark_rule_sql(
+    blocks: List[int] = typer.Option(
+        [2**22, 2**24], help="Blocks of history to generate"
+    ),
+    safes: int = typer.Option(100_000, help="Number of safes"),
+    events_per_block: float = typer.Option(
+        0.25, help="Balance changes per block of history"
+    ),
+):
+    """
+    Time the Staking and SafeOwnership queries for the last cycle of a long synthetic
+    history, against the queries they replaced
+    """
+    print(f"{'blocks':>10} {'rule':>14} {'legacy (s)':>11} {'current (s)':>12}")
+    for n in blocks:
+        safe_owner, token_holder = make_history(n, safes, int(n * events_per_block))
+        staking, safe_ownership = make_rules(safe_owner, token_holder)
+        staking.register_tables(n)
+        safe_ownership.register_tables(n)
+        staking_vars = [n - CYCLE_LENGTH, n, TOKEN, CYCLE_LENGTH, 0.01]
+        safe_ownership_vars = [0, n, CYCLE_LENGTH, "depot", 3]
+        for name, rule, legacy, vars in [
+            ("Staking", staking, legacy_sql.staking_sql(staking), staking_vars),
+            (
+                "SafeOwnership",
+                safe_ownership,
+                legacy_sql.SAFE_OWNERSHIP_SQL,
+                safe_ownership_vars,
+            ),
+        ]:
+            expected, legacy_time = time_query(rule, legacy, vars)
+            result, current_time = time_query(rule, rule.sql(), vars)
+            print(f"{n:>10} {name:>14} {legacy_time:>11.2f} {current_time:>12.2f}")
+            columns = list(result.columns)
+            expected = expected.sort_values("payee").reset_index(drop=True)
+            result = result.sort_values("payee").reset_index(drop=True)
+            if not np.allclose(
+                expected[columns[1]], result[columns[1]]
+            ) or not expected["payee"].equals(result["payee"]):
+                raise Exception(f"{name} results differ for {n} blocks")
+
+
+if __name__ == "__main__":
+    typer.run(benchmark_rule_sql)
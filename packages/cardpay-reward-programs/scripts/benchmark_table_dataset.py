@@ -0,0 +1,139 @@
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+import yaml
+from cardpay_reward_programs.utils import get_table_dataset
+
+DEPLOYMENT = "QmBenchmark"
+TABLE = "safe_owner"
+
+
+def write_extraction(root, blocks, partition_size, rows_per_partition, seed=0):
+    """Write a synthetic subgraph extraction laid out like the subgraph extractor's"""
+    rng = np.random.default_rng(seed)
+    table_root = root / "data" / f"subgraph={DEPLOYMENT}" / f"table={TABLE}"
+    metadata = []
+    for start in range(0, blocks, partition_size):
+        relative = (
+            f"partition_size={partition_size}/start_partition={start}"
+            f"/end_partition={start + partition_size}/data.parquet"
+        )
+        table = pa.table(
+            {
+                "safe": [
+                    f"0x{i:040x}" for i in rng.integers(0, 2**32, rows_per_partition)
+                ],
+                "owner": [
+                    f"0x{i:040x}" for i in rng.integers(0, 2**16, rows_per_partition)
+                ],
+                "type": np.where(
+                    rng.random(rows_per_partition) < 0.5, "depot", "prepaid"
+                ),
+                "_block_number": np.sort(
+                    rng.integers(start, start + partition_size, rows_per_partition)
+                ).astype(np.uint64),
+            }
+        )
+        (table_root / relative).parent.mkdir(parents=True)
+        pq.write_table(
+            table,
+            table_root / relative,
+            row_group_size=rows_per_partition // 4,
+            metadata_collector=metadata,
+        )
+        metadata[-1].set_file_path(relative)
+    pq.write_metadata(
+        table.schema, table_root / "_metadata", metadata_collector=metadata
+    )
+    (root / "latest.yaml").write_text(
+        yaml.safe_dump({"subgraph_deployment": DEPLOYMENT})
+    )
+
+
+def bytes_read():
+    # Bytes read by this process, including from the page cache (linux only)
+    with open("/proc/self/io") as stream:
+        return int(dict(line.split(": ") for line in stream)["rchar"])
+
+
+# Query shapes used by the rules: SafeOwnership counts safes created in a range of
+# blocks, Staking finds the latest owner of each safe before the end of a cycle
+QUERIES = {
+    "range": f"""
+        select owner, count(distinct safe) from {TABLE}
+        where _block_number::integer >= $1::integer and _block_number::integer <= $2::integer
+        and type = 'depot'
+        group by owner order by owner
+    """,
+    "latest": f"""
+        select safe, max(owner) as owner
+        from {TABLE} a
+        where _block_number = (
+            select max(_block_number)
+            from {TABLE} b
+            where a.safe = b.safe
+            and _block_number::integer >= $1::integer
+            and _block_number::integer <= $2::integer
+        )
+        and type = 'depot'
+        group by safe order by safe
+    """,
+}
+
+
+def run_query(dataset, query, min_block, max_block):
+    con = duckdb.connect(":memory:")
+    con.register(TABLE, dataset)
+    before, start = bytes_read(), time.perf_counter()
+    result = con.execute(QUERIES[query], [min_block, max_block]).fetchall()
+    return result, bytes_read() - before, time.perf_counter() - start
+
+
+def benchmark_table_dataset(
+    blocks: int = typer.Option(2**22, help="Blocks of history to generate"),
+    partition_size: int = typer.Option(2**16, help="Blocks per partition file"),
+    rows_per_partition: int = typer.Option(20_000),
+    cycle_length: int = typer.Option(2**17, help="Blocks in the range queried"),
+):
+    """
+    Compare bytes read by the rules' block range queries over a whole table against
+    the same queries over the dataset pruned to the blocks they need.
+    The range query reads the last cycle, the latest owner query reads all history
+    up to a cycle half way through (as when backfilling).
+    """
+    with tempfile.TemporaryDirectory() as path:
+        root = Path(path)
+        write_extraction(root, blocks, partition_size, rows_per_partition)
+        ranges = {
+            "range": (blocks - cycle_length, blocks - 1),
+            "latest": (None, blocks // 2),
+        }
+        print(
+            f"{'query':>7} {'dataset':>8} {'files':>6} {'read (MB)':>10} {'time (s)':>9}"
+        )
+        for query, (min_block, max_block) in ranges.items():
+            results = []
+            for name, dataset in [
+                ("full", get_table_dataset(root, TABLE)),
+                ("pruned", get_table_dataset(root, TABLE, min_block, max_block)),
+            ]:
+                result, read, elapsed = run_query(
+                    dataset, query, min_block or 0, max_block
+                )
+                results.append(result)
+                print(
+                    f"{query:>7} {name:>8} {len(dataset.files):>6} "
+                    f"{read / 2**20:>10.1f} {elapsed:>9.2f}"
+                )
+            if results[0] != results[1]:
+                raise Exception(f"Pruned dataset gave different results for {query}")
+
+
+if __name__ == "__main__":
+    typer.run(benchmark_table_dataset)
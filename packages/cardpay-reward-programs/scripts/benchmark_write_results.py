@@ -0,0 +1,79 @@
+import multiprocessing
+import resource
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+import typer
+from cardpay_reward_programs.payment_tree import PaymentTree
+from cardpay_reward_programs.utils import write_parquet_batches, write_parquet_file
+from cloudpathlib import AnyPath
+
+
+def random_payments(n, seed=0):
+    rng = np.random.default_rng(seed)
+    payees = rng.bytes(n * 20)
+    return pd.DataFrame(
+        {
+            "rewardProgramID": "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72",
+            "paymentCycle": 100,
+            "validFrom": 100,
+            "validTo": 200,
+            "payee": ["0x" + payees[i : i + 20].hex() for i in range(0, n * 20, 20)],
+            "token": "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f",
+            "amount": rng.integers(1, 10**18, n),
+            "explanationData": [{"rank": i} for i in range(n)],
+        }
+    )
+
+
+def write_results(n, mode, max_batch_mb, results):
+    payments = random_payments(n)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    tree = PaymentTree(payments, {})
+    with tempfile.TemporaryDirectory() as path:
+        if mode == "table":
+            write_parquet_file(AnyPath(path), tree.as_arrow())
+        else:
+            write_parquet_batches(
+                AnyPath(path),
+                tree.schema(),
+                tree.record_batches(max_batch_bytes=max_batch_mb * 1024 * 1024),
+            )
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed, baseline / 1024, peak / 1024))
+
+
+def benchmark_write_results(
+    sizes: List[int] = typer.Option(
+        [100_000, 1_000_000], help="Number of payments to benchmark"
+    ),
+    max_batch_mb: int = typer.Option(64, help="Batch size used when streaming"),
+):
+    """
+    Compare peak memory of writing results as one table against streaming record batches.
+    Each run happens in a fresh process so that peaks don't carry over between runs.
+    """
+    context = multiprocessing.get_context("spawn")
+    print(
+        f"{'payments':>10} {'mode':>7} {'time (s)':>9} {'input (MB)':>11} {'peak (MB)':>10}"
+    )
+    for n in sizes:
+        for mode in ["table", "stream"]:
+            results = context.Queue()
+            process = context.Process(
+                target=write_results, args=(n, mode, max_batch_mb, results)
+            )
+            process.start()
+            elapsed, baseline, peak = results.get()
+            process.join()
+            print(f"{n:>10} {mode:>7} {elapsed:>9.2f} {baseline:>11.0f} {peak:>10.0f}")
+
+
+if __name__ == "__main__":
+    typer.run(benchmark_write_results)
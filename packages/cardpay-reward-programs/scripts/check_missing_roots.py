@@ -1,78 +1,33 @@
-import json
 import re
-from typing import Any, Callable, Dict, TypedDict
 
 import boto3
 import pandas as pd
-import requests
 import typer
 from cardpay_reward_programs.config import config
+from python_subgraph_client import get_client
 from scripts.utils import Environment
 
 
-class SubgraphQuery(TypedDict):
-    name: str
-    query: str
-
-
-def merkle_root_submissions_query(
-    skip: int, blockNumber_gt=0, **filters
-) -> SubgraphQuery:
-    query = """{{
-        merkleRootSubmissions(
-            skip: {skip},
-            orderBy: blockNumber,
-            where: {{ blockNumber_gt: {blockNumber_gt} }}
-        )
-        {{
-            rewardProgram {{
-                id
-            }}
-            paymentCycle
-        }}
-    }}""".format(
-        **{"skip": skip, "blockNumber_gt": blockNumber_gt, **filters}
+def get_all_merkle_root_submissions(env: Environment):
+    submissions = get_client(config[env]["subgraph_url"]).paginate(
+        "merkleRootSubmissions",
+        """
+        rewardProgram {
+            id
+        }
+        paymentCycle
+        """,
+        cursor="blockNumber",
     )
-    return {"name": "merkleRootSubmissions", "query": query}
-
-
-def query_subgraph(
-    env: str, skip: int, query: Callable[[int, int, Dict[str, Any]], SubgraphQuery]
-):
-    print(f"Skipping {skip}")
-    subgraph_url = config[env]["subgraph_url"]
-    subgraph_query = query(skip)
-    r = requests.post(
-        subgraph_url,
-        json={"query": subgraph_query["query"]},
+    df = pd.DataFrame(
+        [
+            {
+                "reward_program_id": o["rewardProgram"]["id"],
+                "payment_cycle": o["paymentCycle"],
+            }
+            for o in submissions
+        ]
     )
-    if r.ok:
-        json_data = json.loads(r.text)
-        data = json_data["data"]
-        return data[subgraph_query["name"]]
-
-
-def get_all_merkle_root_submissions(env: Environment):
-    paginate_size = 100
-    res = []
-
-    i = 0
-    while c := query_subgraph(env, i * paginate_size, merkle_root_submissions_query):
-        if len(c) == 0:
-            break
-        transformed_c = list(
-            map(
-                lambda o: {
-                    "reward_program_id": o["rewardProgram"]["id"],
-                    "payment_cycle": o["paymentCycle"],
-                },
-                c,
-            )
-        )
-
-        res = res + transformed_c
-        i = i + 1
-    df = pd.DataFrame(res)
     return df
 
 
@@ -0,0 +1,37 @@
+import os
+from typing import List
+
+import typer
+from boto3.session import Session
+from cardpay_reward_programs.partition_cache import PartitionCache
+from cardpay_reward_programs.utils import prewarm_partition_cache
+from cloudpathlib import S3Client
+
+
+def prewarm_cache(
+    config_location: str = typer.Argument(
+        ..., help="The root of the subgraph extraction, containing latest.yaml"
+    ),
+    tables: List[str] = typer.Option(..., "--table", help="Tables to download"),
+    min_block: int = typer.Option(None, help="First block needed"),
+    max_block: int = typer.Option(None, help="Last block needed"),
+    cache_dir: str = typer.Option(
+        os.environ.get("PARTITION_CACHE_DIR", ".cache/partitions")
+    ),
+    max_size_gb: float = typer.Option(
+        float(os.environ.get("PARTITION_CACHE_MAX_GB", 20))
+    ),
+):
+    """
+    Download the complete partitions of subgraph tables for a block range into the
+    partition cache, so that rule runs over that range don't need to
+    """
+    S3Client(boto3_session=Session()).set_as_default_client()
+    PartitionCache(cache_dir, max_size=int(max_size_gb * 1024**3)).set_as_default()
+    for table in tables:
+        files = prewarm_partition_cache(config_location, table, min_block, max_block)
+        print(f"{table}: {files} files")
+
+
+if __name__ == "__main__":
+    typer.run(prewarm_cache)
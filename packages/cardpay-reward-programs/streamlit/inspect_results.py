@@ -1,7 +1,6 @@
 import pandas as pd
 import streamlit as st
-from eth_abi import decode_abi
-from hexbytes import HexBytes
+from cardpay_reward_programs.payment_tree import decode_payments
 
 
 @st.cache
@@ -15,36 +14,12 @@ decimals = st.number_input("Decimals for token", value=18)
 
 results_file = st.file_uploader("Upload parquet file", type="parquet")
 if results_file is not None:
-    results_df = pd.read_parquet(results_file)
-    results_list = results_df.to_records("dict")
-    payments = []
-    for result in results_list:
-        (
-            rewardProgramID,
-            paymentCycle,
-            validFrom,
-            validTo,
-            tokenType,
-            payee,
-            transferData,
-        ) = decode_abi(
-            ["address", "uint256", "uint256", "uint256", "uint256", "address", "bytes"],
-            HexBytes(result["leaf"]),
-        )
-        if tokenType == 1:
-            token, amount = decode_abi(["address", "uint256"], transferData)
-            payments.append(
-                {
-                    "rewardProgramID": rewardProgramID,
-                    "amount": amount / (10**decimals),
-                    "paymentCycle": paymentCycle,
-                    "validFrom": validFrom,
-                    "validTo": validTo,
-                    "payee": payee,
-                    "token": token,
-                }
-            )
-    payments_df = pd.DataFrame.from_records(payments)
+    results_df = pd.read_parquet(results_file, columns=["leaf"])
+    payments_df = decode_payments(results_df["leaf"])
+    payments_df = payments_df[payments_df["tokenType"] == 1].drop(columns=["tokenType"])
+    payments_df["amount"] = payments_df["amount"].map(
+        lambda amount: amount / (10**decimals)
+    )
     st.write(payments_df)
 
     csv = convert_df(payments_df)
@@ -52,10 +52,12 @@ def view_multiple(program):
     start_block, end_block = slider_partition(type="two_end")
     progress = st.progress(0.0)
     payment_lists = []
-    for i in range(start_block, end_block, program.payment_cycle_length):
-        progress.progress((i - start_block) / (end_block - start_block))
-        tail = min(end_block, i + program.payment_cycle_length)
-        payment_list = program.run(tail, "0x0")
+    tails = [
+        min(end_block, i + program.payment_cycle_length)
+        for i in range(start_block, end_block, program.payment_cycle_length)
+    ]
+    for tail, payment_list in program.run_cycles(tails, "0x0"):
+        progress.progress((tail - start_block) / (end_block - start_block))
         if not payment_list.empty:
             payment_lists.append(payment_list)
     combined_payment_list = pd.concat(payment_lists)
@@ -2,12 +2,13 @@ import binascii
 from tempfile import TemporaryDirectory
 from unittest.mock import patch
 
+import pandas as pd
 import pyarrow as pa
 import pytest
 from cardpay_reward_programs.config import config
 from cardpay_reward_programs.payment_tree import PaymentTree
 from cardpay_reward_programs.rules import FlatPayment
-from cardpay_reward_programs.utils import write_parquet_file
+from cardpay_reward_programs.utils import get_unclaimed_rewards, write_parquet_file
 from cloudpathlib import AnyPath
 
 
@@ -206,3 +207,134 @@ def test_default_rollover_amount_when_no_previous_output(_, rollover_rule):
         }
         payment_list = rollover_rule.get_payments(**run_parameters).to_dict("records")
         assert payment_list[0]["explanationData"]["rollover_amount"] == "0"
+
+
+def test_merge_rollover_sums_big_amounts_exactly(rollover_rule):
+    program = "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72"
+    token = config["staging"]["tokens"]["card"]
+    payees = [
+        "0x12AE66CDc592e10B60f9097a7b0D3C59fce29876",
+        "0x999999cf1046e68e36E1aA2E0E07105eDDD1f08E",
+        "0xc0ffee254729296a45a3885639AC7E10F9d54979",
+    ]
+    big = 2**200 + 1
+    current = rollover_rule.run(200, program)
+    current = pd.DataFrame(
+        [
+            {**payment, "payee": payee, "amount": amount}
+            for payment, payee, amount in zip(
+                current.to_dict("records") * 2, payees[:2], [big, 1000]
+            )
+        ]
+    )
+    unclaimed = pd.DataFrame(
+        [
+            {
+                "rewardProgramID": program.lower(),
+                "paymentCycle": 100,
+                "validFrom": 100,
+                "validTo": 200,
+                "tokenType": 1,
+                "payee": payee.lower(),
+                "token": token.lower(),
+                "amount": amount,
+            }
+            for payee, amount in [
+                (payees[2], 2**64),
+                (payees[0], big),
+                (payees[2], 2**63),
+            ]
+        ]
+    )
+    merged = rollover_rule.merge_rollover(current, unclaimed, 200)
+    assert list(merged.columns) == list(current.columns)
+    assert merged["payee"].tolist() == [payees[0], payees[1], payees[2].lower()]
+    assert merged["amount"].tolist() == [2 * big, 1000, 2**64 + 2**63]
+    assert [row["rollover_amount"] for row in merged["explanationData"]] == [
+        str(big),
+        "0",
+        str(2**63),
+    ]
+    assert (merged["paymentCycle"] == 200).all()
+    assert (merged["validTo"] == 300).all()
+
+
+@patch("cardpay_reward_programs.utils.get_table_dataset")
+def test_get_unclaimed_rewards_anti_joins_claims(get_table_dataset):
+    program = "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72"
+    token = config["staging"]["tokens"]["card"]
+    payees = [
+        "0x12AE66CDc592e10B60f9097a7b0D3C59fce29876",
+        "0x999999cf1046e68e36E1aA2E0E07105eDDD1f08E",
+        "0xc0ffee254729296a45a3885639AC7E10F9d54979",
+        "0x0000000000000000000000000000000000000001",
+    ]
+    amounts = [2**200 + 1, 1000, 2**64, 5]
+    payments = [
+        {
+            "rewardProgramID": program,
+            "paymentCycle": 100,
+            "validFrom": 100,
+            "validTo": 200 if i < 3 else 400,
+            "payee": payee,
+            "token": token,
+            "amount": amount,
+            "explanationData": {},
+        }
+        for i, (payee, amount) in enumerate(zip(payees, amounts))
+    ]
+    with TemporaryDirectory() as tempdir:
+        output = AnyPath(tempdir)
+        table = PaymentTree(payments).as_arrow()
+        write_parquet_file(output, table)
+        leaves = table["leaf"].to_pylist()
+        get_table_dataset.return_value = claims_table(
+            [
+                # Claimed twice
+                (leaves[1], 150),
+                (leaves[1], 160),
+                # Claimed after "now", so still unclaimed
+                (leaves[2], 301),
+            ]
+        )
+        unclaimed = get_unclaimed_rewards(output / "results.parquet", "claims", 300)
+    assert list(unclaimed.columns) == [
+        "rewardProgramID",
+        "paymentCycle",
+        "validFrom",
+        "validTo",
+        "tokenType",
+        "payee",
+        "token",
+        "amount",
+    ]
+    # The reward that is still valid isn't rolled over
+    assert unclaimed["payee"].tolist() == [payees[0], payees[2]]
+    assert unclaimed["amount"].tolist() == [amounts[0], amounts[2]]
+    assert unclaimed["token"].tolist() == [token.lower()] * 2
+    assert (unclaimed["tokenType"] == 1).all()
+
+
+@patch("cardpay_reward_programs.utils.get_table_dataset")
+def test_get_unclaimed_rewards_when_nothing_has_expired(get_table_dataset):
+    with TemporaryDirectory() as tempdir:
+        output = AnyPath(tempdir)
+        tree = PaymentTree(
+            [
+                {
+                    "rewardProgramID": "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72",
+                    "paymentCycle": 100,
+                    "validFrom": 100,
+                    "validTo": 200,
+                    "payee": "0x12AE66CDc592e10B60f9097a7b0D3C59fce29876",
+                    "token": config["staging"]["tokens"]["card"],
+                    "amount": 1000,
+                    "explanationData": {},
+                }
+            ]
+        )
+        write_parquet_file(output, tree.as_arrow())
+        get_table_dataset.return_value = claims_table([])
+        unclaimed = get_unclaimed_rewards(output / "results.parquet", "claims", 150)
+    assert unclaimed.empty
+    assert "amount" in unclaimed.columns
@@ -1,5 +1,9 @@
+import hypothesis.strategies as st
 import pandas as pd
 from cardpay_reward_programs.rules import safe_ownership
+from hypothesis import given, settings
+from hypothesis.extra.pandas import column, data_frames, range_indexes
+from pytest import MonkeyPatch
 
 
 def create_rule(
@@ -24,7 +28,7 @@ def create_rule(
     }
     user_config.update(user_config_overrides)
 
-    def register_tables(self):
+    def register_tables(self, payment_cycle, first_payment_cycle=None):
         self.connection.register("safe_owner", fake_data)
 
     monkeypatch.setattr(
@@ -157,3 +161,43 @@ def test_users_are_only_rewarded_if_in_current_cycle(monkeypatch):
     # Only 0xB was in the latest cycle
     assert len(result) == 1
     assert get_amount(result, "0xB") == 1
+
+
+safe_owner_df = data_frames(
+    index=range_indexes(min_size=0, max_size=30),
+    columns=[
+        column("owner", elements=st.sampled_from(["0xA", "0xB", "0xC"])),
+        column("safe", elements=st.sampled_from([f"0x{n}" for n in range(10)])),
+        column("type", elements=st.sampled_from(["type_a", "type_b"])),
+        column("_block_number", elements=st.integers(min_value=0, max_value=600)),
+    ],
+)
+
+
+@settings(deadline=None)
+@given(
+    safe_owner_df,
+    st.integers(min_value=0, max_value=300),  # start analysis block
+    st.lists(st.integers(min_value=100, max_value=600), min_size=1, max_size=5),
+    st.integers(min_value=0, max_value=5),  # max rewards
+)
+def test_running_cycles_together_matches_running_each(
+    fake_data, start_analysis_block, payment_cycles, max_rewards
+):
+    config = (
+        {"payment_cycle_length": 100},
+        {"start_analysis_block": start_analysis_block, "max_rewards": max_rewards},
+    )
+    with MonkeyPatch.context() as monkeypatch:
+        rule = create_rule(monkeypatch, fake_data, *config)
+        results = list(rule.run_cycles(set(payment_cycles), "0x0"))
+        assert [payment_cycle for payment_cycle, _ in results] == sorted(
+            set(payment_cycles)
+        )
+        for payment_cycle, result in results:
+            expected = rule.run(payment_cycle, "0x0")
+            pd.testing.assert_frame_equal(
+                result.sort_values("payee").reset_index(drop=True),
+                expected.sort_values("payee").reset_index(drop=True),
+                check_dtype=False,
+            )
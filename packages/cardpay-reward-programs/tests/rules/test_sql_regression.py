@@ -0,0 +1,74 @@
+import hypothesis.strategies as st
+import pandas as pd
+import pytest
+from cardpay_reward_programs.rules import safe_ownership, staking
+from hypothesis import given, settings
+from pytest import MonkeyPatch
+
+from . import legacy_sql
+from . import test_safe_ownership as safe_ownership_tests
+from . import test_staking as staking_tests
+
+
+def payments(result):
+    return result.sort_values("payee")[["payee", "amount"]].reset_index(drop=True)
+
+
+def compare_staking(monkeypatch, token_holder, safe_owner, payment_cycles):
+    rule = staking_tests.create_rule(monkeypatch, token_holder, safe_owner)
+    results = [rule.run(payment_cycle, "0x0") for payment_cycle in payment_cycles]
+    with MonkeyPatch.context() as legacy:
+        legacy.setattr(staking.Staking, "sql", legacy_sql.staking_sql)
+        legacy_rule = staking_tests.create_rule(legacy, token_holder, safe_owner)
+        for payment_cycle, result in zip(payment_cycles, results):
+            pd.testing.assert_frame_equal(
+                payments(result), payments(legacy_rule.run(payment_cycle, "0x0"))
+            )
+
+
+@settings(deadline=None)
+@given(staking_tests.token_holder_df, staking_tests.safe_owner_df)
+def test_staking_matches_legacy_sql(token_holder_df, safe_owner_df):
+    with MonkeyPatch.context() as monkeypatch:
+        compare_staking(
+            monkeypatch,
+            token_holder_df,
+            safe_owner_df,
+            [staking_tests.CYCLE_LENGTH, staking_tests.END_BLOCK],
+        )
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_staking_matches_legacy_sql_over_many_cycles(monkeypatch, seed):
+    token_holder, safe_owner = staking_tests.random_history(seed)
+    compare_staking(monkeypatch, token_holder, safe_owner, list(range(30, 330, 30)))
+
+
+@settings(deadline=None)
+@given(
+    safe_ownership_tests.safe_owner_df,
+    st.integers(min_value=0, max_value=300),  # start analysis block
+    st.integers(min_value=100, max_value=600),  # payment cycle
+    st.integers(min_value=0, max_value=5),  # max rewards
+)
+def test_safe_ownership_matches_legacy_sql(
+    safe_owner_df, start_analysis_block, payment_cycle, max_rewards
+):
+    config = (
+        {"payment_cycle_length": 100},
+        {"start_analysis_block": start_analysis_block, "max_rewards": max_rewards},
+    )
+    with MonkeyPatch.context() as monkeypatch:
+        rule = safe_ownership_tests.create_rule(monkeypatch, safe_owner_df, *config)
+        result = rule.run(payment_cycle, "0x0")
+        monkeypatch.setattr(
+            safe_ownership.SafeOwnership,
+            "sql",
+            lambda self: legacy_sql.SAFE_OWNERSHIP_SQL,
+        )
+        legacy_rule = safe_ownership_tests.create_rule(
+            monkeypatch, safe_owner_df, *config
+        )
+        pd.testing.assert_frame_equal(
+            payments(result), payments(legacy_rule.run(payment_cycle, "0x0"))
+        )
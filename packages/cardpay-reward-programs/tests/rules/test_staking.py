@@ -1,4 +1,5 @@
 import hypothesis.strategies as st
+import numpy as np
 import pandas as pd
 import pytest
 from cardpay_reward_programs.rules import staking
@@ -68,7 +69,7 @@ def create_rule(
 
     user_config.update(user_config_overrides)
 
-    def register_tables(self):
+    def register_tables(self, end_block, start_block=None):
         self.connection.register("token_holder", fake_data_token_holder)
         self.connection.register("safe_owner", fake_data_safe_owner)
 
@@ -525,3 +526,113 @@ def test_rewards_identically_if_balance_never_changes(blocks):
         result_multiple_balance = rule_multiple_balance.run(30, "0x0")
         assert pytest.approx(sum(result_single_balance["amount"])) == 10e9
         assert pytest.approx(sum(result_multiple_balance["amount"])) == 10e9
+
+
+def random_history(seed, safes=5, owners=3, blocks=300, events=200):
+    rng = np.random.default_rng(seed)
+    token_holder = pd.DataFrame(
+        {
+            "safe": [f"safe{n}" for n in rng.integers(0, safes, events)],
+            "token": rng.choice(["card-0", "card-1"], events, p=[0.8, 0.2]),
+            "balance_downscale_e9_uint64": rng.integers(0, 10_000, events),
+            "_block_number": rng.integers(0, blocks, events),
+        }
+    ).drop_duplicates(["safe", "token", "_block_number"])
+    safe_owner = pd.DataFrame(
+        {
+            "safe": [f"safe{n}" for n in rng.integers(0, safes, events // 10)],
+            "owner": [f"owner{n}" for n in rng.integers(0, owners, events // 10)],
+            "type": rng.choice(["depot", "prepaid"], events // 10, p=[0.8, 0.2]),
+            "_block_number": rng.integers(0, blocks, events // 10),
+        }
+    )
+    return token_holder, safe_owner
+
+
+def sorted_payments(result):
+    return result.sort_values("payee")[["payee", "amount"]].reset_index(drop=True)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_incremental_cycles_match_full_recomputation(monkeypatch, seed):
+    token_holder, safe_owner = random_history(seed)
+    incremental_rule = create_rule(monkeypatch, token_holder, safe_owner)
+    incremental_rule.keep_state = True
+    for payment_cycle in range(CYCLE_LENGTH, 330, CYCLE_LENGTH):
+        incremental = incremental_rule.run(payment_cycle, "0x0")
+        assert incremental_rule.state_block == payment_cycle
+        full = create_rule(monkeypatch, token_holder, safe_owner).run(
+            payment_cycle, "0x0"
+        )
+        pd.testing.assert_frame_equal(
+            sorted_payments(incremental), sorted_payments(full)
+        )
+
+
+def test_incremental_state_is_saved_and_loaded(monkeypatch, tmp_path):
+    token_holder, safe_owner = random_history(0)
+    rule = create_rule(monkeypatch, token_holder, safe_owner)
+    rule.keep_state = True
+    rule.run(60, "0x0")
+    assert rule.save_state(tmp_path / "state.parquet")
+    expected = rule.run(90, "0x0")
+
+    resumed = create_rule(monkeypatch, token_holder, safe_owner)
+    resumed.load_state(tmp_path / "state.parquet")
+    assert resumed.state_block == 60
+    pd.testing.assert_frame_equal(
+        sorted_payments(resumed.run(90, "0x0")), sorted_payments(expected)
+    )
+    # Without the state of the previous cycle the rule recomputes from scratch
+    resumed.load_state(tmp_path / "state.parquet")
+    pd.testing.assert_frame_equal(
+        sorted_payments(resumed.run(120, "0x0")),
+        sorted_payments(
+            create_rule(monkeypatch, token_holder, safe_owner).run(120, "0x0")
+        ),
+    )
+
+
+def test_state_is_only_computed_when_kept(monkeypatch, tmp_path):
+    token_holder, safe_owner = random_history(0)
+    rule = create_rule(monkeypatch, token_holder, safe_owner)
+    state_sql = rule.state_sql
+    queries = []
+
+    def record_state_sql(start_block=None):
+        queries.append(start_block)
+        return state_sql(start_block)
+
+    monkeypatch.setattr(rule, "state_sql", record_state_sql)
+    rule.run(60, "0x0")
+    assert queries == []
+    assert not rule.save_state(tmp_path / "state.parquet")
+    list(rule.run_cycles([90, 120], "0x0"))
+    assert len(queries) == 2
+    assert rule.state_block == 120
+    assert not rule.keep_state
+
+
+@pytest.mark.parametrize(
+    "payment_cycles", [list(range(30, 330, 30)), [60, 90, 180, 210]]
+)
+def test_running_cycles_together_registers_tables_once(monkeypatch, payment_cycles):
+    token_holder, safe_owner = random_history(0)
+    rule = create_rule(monkeypatch, token_holder, safe_owner)
+    registered = []
+    register_tables = staking.Staking.register_tables
+    monkeypatch.setattr(
+        staking.Staking,
+        "register_tables",
+        lambda self, *args: registered.append(args) or register_tables(self, *args),
+    )
+    results = list(rule.run_cycles(payment_cycles, "0x0"))
+    assert registered == [(payment_cycles[-1],)]
+    assert [payment_cycle for payment_cycle, _ in results] == payment_cycles
+    for payment_cycle, result in results:
+        expected = create_rule(monkeypatch, token_holder, safe_owner).run(
+            payment_cycle, "0x0"
+        )
+        pd.testing.assert_frame_equal(
+            sorted_payments(result), sorted_payments(expected)
+        )
@@ -0,0 +1,96 @@
+import json
+
+import pyarrow.parquet as pq
+import typer
+from cardpay_reward_programs.backfill import backfill, get_payment_cycles, plan_tasks
+from typer.testing import CliRunner
+
+PROGRAMS = [
+    "0x0000000000000000000000000000000000000001",
+    "0x0000000000000000000000000000000000000002",
+]
+ACCOUNTS = [
+    "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72",
+    "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f",
+]
+
+
+def program(reward_program_id, rollover=False, start_block=0, end_block=1000):
+    return {
+        "core": {
+            "payment_cycle_length": 100,
+            "start_block": start_block,
+            "end_block": end_block,
+            "duration": 100,
+            "subgraph_config_locations": {},
+            "rollover": rollover,
+        },
+        "user_defined": {
+            "reward_per_user": 10,
+            "token": "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f",
+            "accounts": ACCOUNTS,
+        },
+        "run": {"reward_program_id": reward_program_id},
+    }
+
+
+def test_payment_cycles_match_the_scheduler():
+    core = program("0x1")["core"]
+    assert get_payment_cycles(core) == list(range(0, 1000, 100))
+    assert get_payment_cycles(core, 250, 700) == [300, 400, 500, 600, 700]
+
+
+def test_rollover_cycles_run_in_order_in_one_task():
+    rollover = program("0x1", rollover=True)
+    independent = program("0x2")
+    tasks = plan_tasks(
+        [
+            (rollover, get_payment_cycles(rollover["core"])),
+            (independent, get_payment_cycles(independent["core"])),
+        ],
+        workers=4,
+    )
+    assert [(task["run"]["reward_program_id"], cycles) for task, cycles in tasks] == [
+        ("0x1", list(range(0, 1000, 100))),
+        ("0x2", [0, 100, 200]),
+        ("0x2", [300, 400, 500]),
+        ("0x2", [600, 700, 800]),
+        ("0x2", [900]),
+    ]
+
+
+def test_backfill_writes_every_cycle(tmp_path):
+    parameters_files = []
+    for n, reward_program_id in enumerate(PROGRAMS):
+        parameters_file = tmp_path / f"{n}.json"
+        parameters_file.write_text(json.dumps(program(reward_program_id)))
+        parameters_files.append(str(parameters_file))
+    app = typer.Typer()
+    app.command()(backfill)
+    result = CliRunner().invoke(
+        app,
+        parameters_files
+        + [
+            "--output-location",
+            str(tmp_path / "output"),
+            "--rule",
+            "FlatPayment",
+            "--workers",
+            "2",
+            "--last-payment-cycle",
+            "500",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.count("\n") == 14
+    for reward_program_id in PROGRAMS:
+        for payment_cycle in range(0, 600, 100):
+            table = pq.read_table(
+                tmp_path
+                / "output"
+                / f"rewardProgramID={reward_program_id}"
+                / f"paymentCycle={payment_cycle}"
+                / "results.parquet"
+            )
+            assert table.column("paymentCycle").to_pylist() == [payment_cycle] * 2
+            assert table.column("payee").to_pylist() == ACCOUNTS
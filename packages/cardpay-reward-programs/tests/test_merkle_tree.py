@@ -0,0 +1,105 @@
+import hypothesis.strategies as st
+import numpy as np
+import pyarrow as pa
+import pytest
+from cardpay_reward_programs.merkle import (
+    MerkleTree,
+    hex_string_array,
+    unhex_rows,
+    verify_proof,
+)
+from cardpay_reward_programs.payment_tree import PaymentTree, hashfunc
+from hypothesis import given, settings
+from merklelib import MerkleTree as ReferenceMerkleTree
+
+
+def make_leaves(n):
+    return [i.to_bytes(4, "big") * 8 for i in range(n)]
+
+
+def make_payments(n):
+    return [
+        {
+            "rewardProgramID": "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72",
+            "paymentCycle": 100,
+            "validFrom": 100,
+            "validTo": 200,
+            "payee": "0x" + (i + 1).to_bytes(20, "big").hex(),
+            "token": "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f",
+            "amount": (i + 1) * 1_000_000_000_000_000_000,
+            "explanationData": {},
+        }
+        for i in range(n)
+    ]
+
+
+def assert_matches_reference(leaves):
+    tree = MerkleTree(leaves)
+    reference = ReferenceMerkleTree(leaves, hashfunc)
+    assert tree.hex_root == reference.merkle_root
+    proofs = tree.hex_proofs().to_pylist()
+    for leaf, proof in zip(leaves, proofs):
+        assert proof == reference.get_proof(leaf).hex_nodes
+        assert verify_proof(leaf, proof, tree.hex_root)
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 5, 7, 8, 9, 20, 33, 100, 257])
+def test_matches_merklelib(n):
+    assert_matches_reference(make_leaves(n))
+
+
+@settings(max_examples=50, deadline=None)
+@given(
+    st.lists(st.binary(min_size=1, max_size=64), min_size=1, max_size=70, unique=True)
+)
+def test_matches_merklelib_for_arbitrary_leaves(leaves):
+    assert_matches_reference(leaves)
+
+
+def test_empty_tree():
+    tree = MerkleTree([])
+    assert tree.root is None
+    assert tree.hex_root is None
+    assert tree.hex_proofs().to_pylist() == []
+
+
+def test_proofs_can_be_generated_for_a_slice_of_leaves():
+    leaves = make_leaves(37)
+    tree = MerkleTree(leaves)
+    all_proofs = tree.hex_proofs().to_pylist()
+    assert tree.hex_proofs(10, 20).to_pylist() == all_proofs[10:20]
+    assert tree.get_hex_proof(5) == all_proofs[5]
+
+
+@pytest.mark.parametrize("n", [1, 2, 5, 64])
+def test_payment_tree_matches_merklelib(n):
+    tree = PaymentTree(make_payments(n))
+    reference = ReferenceMerkleTree(tree.data, hashfunc)
+    assert tree.get_hex_root() == "0x" + reference.merkle_root
+    table = tree.as_arrow().to_pydict()
+    for leaf, hex_leaf, proof in zip(tree.data, table["leaf"], table["proof"]):
+        assert hex_leaf == leaf.hex()
+        assert proof == reference.get_proof(leaf).hex_nodes
+        assert tree.verify_inclusion(leaf)
+
+
+def test_unhex_rows_inverts_hex_string_array():
+    rows = np.random.default_rng(0).integers(0, 256, (9, 40), dtype=np.uint8)
+    hex_strings = hex_string_array(rows)
+    assert (unhex_rows(hex_strings, 40) == rows).all()
+    assert (unhex_rows(hex_strings.slice(2, 5), 40) == rows[2:7]).all()
+    prefixed = pa.array(
+        [
+            ("0x" + row if i % 2 else row.upper())
+            for i, row in enumerate(hex_strings.to_pylist())
+        ]
+    )
+    assert (unhex_rows(prefixed, 40) == rows).all()
+    assert unhex_rows(pa.array([], pa.string()), 40).shape == (0, 40)
+    with pytest.raises(ValueError, match="do not all encode 40 bytes"):
+        unhex_rows(pa.array(["00"]), 40)
+    with pytest.raises(ValueError, match="Invalid hex digit"):
+        unhex_rows(pa.array(["zz" * 40]), 40)
+    # The right length for a prefixed row, but the first two digits aren't a prefix
+    with pytest.raises(ValueError, match="must start with 0x"):
+        unhex_rows(pa.array(["0x" + "00" * 40, "ab" + "00" * 40]), 40)
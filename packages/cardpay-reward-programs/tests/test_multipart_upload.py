@@ -0,0 +1,149 @@
+import os
+import time
+from tempfile import TemporaryDirectory
+
+import pyarrow.parquet as pq
+import pytest
+from cardpay_reward_programs.multipart import (
+    LocalMultipartBackend,
+    MultipartUploadFile,
+    S3MultipartBackend,
+)
+from cardpay_reward_programs.utils import _write_batches
+
+from .test_write_results import make_tree
+
+
+class RecordingS3Client:
+    """Records the multipart calls made, in place of a boto3 s3 client"""
+
+    def __init__(self):
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+
+    def create_multipart_upload(self, Bucket, Key):
+        return {"UploadId": "upload"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts[PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed = MultipartUpload["Parts"]
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+
+@pytest.mark.parametrize("part_size", [1000, 4096, 10_000_000])
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_streams_parquet_through_local_backend(part_size, concurrency):
+    tree = make_tree(200)
+    with TemporaryDirectory() as path:
+        target = os.path.join(path, "results.parquet")
+        backend = LocalMultipartBackend(target)
+        with MultipartUploadFile(backend, part_size, concurrency) as sink:
+            _write_batches(sink, tree.schema(), tree.record_batches(batch_size=32))
+            # Nothing is visible until the upload completes
+            assert not os.path.exists(target)
+        assert os.listdir(path) == ["results.parquet"]
+        assert os.path.getsize(target) == sink.tell()
+        assert pq.read_table(target).equals(tree.as_arrow())
+
+
+def test_parts_are_uploaded_in_order_of_part_size():
+    client = RecordingS3Client()
+    backend = S3MultipartBackend(client, "bucket", "results.parquet")
+    backend.min_part_size = 0
+    data = os.urandom(10_500)
+    with MultipartUploadFile(backend, part_size=1000, concurrency=4) as sink:
+        for start in range(0, len(data), 333):
+            sink.write(data[start : start + 333])
+    assert [len(client.parts[n]) for n in sorted(client.parts)] == [1000] * 10 + [500]
+    assert b"".join(client.parts[n] for n in sorted(client.parts)) == data
+    assert client.completed == [
+        {"PartNumber": n, "ETag": f"etag-{n}"} for n in range(1, 12)
+    ]
+    assert not client.aborted
+
+
+def test_empty_upload_has_one_part():
+    client = RecordingS3Client()
+    with MultipartUploadFile(S3MultipartBackend(client, "bucket", "key")):
+        pass
+    assert client.parts == {1: b""}
+    assert client.completed == [{"PartNumber": 1, "ETag": "etag-1"}]
+
+
+def test_aborts_on_error():
+    with TemporaryDirectory() as path:
+        target = os.path.join(path, "results.parquet")
+        with pytest.raises(RuntimeError):
+            with MultipartUploadFile(LocalMultipartBackend(target), 10) as sink:
+                sink.write(b"x" * 100)
+                raise RuntimeError("Failed while writing")
+        assert os.listdir(path) == []
+
+
+def test_aborts_when_a_part_fails():
+    class FailingClient(RecordingS3Client):
+        def upload_part(self, **kwargs):
+            raise ConnectionError("Upload failed")
+
+    client = FailingClient()
+    backend = S3MultipartBackend(client, "bucket", "key")
+    with pytest.raises(ConnectionError):
+        with MultipartUploadFile(backend) as sink:
+            sink.write(b"x" * 100)
+    assert client.aborted
+    assert client.completed is None
+
+
+def test_aborts_when_an_earlier_part_fails_on_close():
+    class SlowFailingClient(RecordingS3Client):
+        def upload_part(self, **kwargs):
+            time.sleep(0.1)
+            raise ConnectionError("Upload failed")
+
+    client = SlowFailingClient()
+    backend = S3MultipartBackend(client, "bucket", "key")
+    backend.min_part_size = 0
+    sink = MultipartUploadFile(backend, part_size=1000, concurrency=1)
+    sink.write(b"x" * 1500)
+    # The last part waits for the first, which fails
+    with pytest.raises(ConnectionError):
+        sink.close()
+    assert client.aborted
+    assert client.completed is None
+    assert sink.closed
+
+
+def test_aborts_when_completing_fails():
+    class FailingClient(RecordingS3Client):
+        def complete_multipart_upload(self, **kwargs):
+            raise ConnectionError("Complete failed")
+
+    client = FailingClient()
+    with pytest.raises(ConnectionError):
+        with MultipartUploadFile(S3MultipartBackend(client, "bucket", "key")) as sink:
+            sink.write(b"x" * 100)
+    assert client.aborted
+
+
+def test_rejects_parts_smaller_than_s3_allows():
+    backend = S3MultipartBackend(RecordingS3Client(), "bucket", "key")
+    with pytest.raises(ValueError, match="Part size must be at least"):
+        MultipartUploadFile(backend, part_size=1024)
+    with pytest.raises(ValueError, match="Concurrency must be at least 1"):
+        MultipartUploadFile(backend, concurrency=0)
+
+
+def test_rejects_empty_parts():
+    with TemporaryDirectory() as tmpdir:
+        backend = LocalMultipartBackend(os.path.join(tmpdir, "out"))
+        for part_size in (0, -1):
+            with pytest.raises(ValueError, match="Part size must be at least 1 byte"):
+                MultipartUploadFile(backend, part_size=part_size)
+        # Nothing was staged for the rejected uploads
+        assert os.listdir(tmpdir) == []
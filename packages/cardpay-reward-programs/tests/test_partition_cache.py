@@ -0,0 +1,231 @@
+import gc
+import io
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+import yaml
+from boto3.session import Session
+from cardpay_reward_programs import partition_cache
+from cardpay_reward_programs.partition_cache import PartitionCache
+from cardpay_reward_programs.utils import get_local_file, get_table_dataset
+from cloudpathlib import S3Client
+from cloudpathlib.local import LocalS3Client
+
+from .test_table_dataset import CONFIG_LOCATION, count_payments
+
+
+class Remote:
+    """Remote files that count how often they are downloaded"""
+
+    def __init__(self, files):
+        self.files = files
+        self.opened = []
+
+    def opener(self, location):
+        def open_remote():
+            self.opened.append(location)
+            return io.BytesIO(self.files[location])
+
+        return open_remote
+
+    def get(self, cache, location):
+        return cache.get(location, self.opener(location))
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # Tests set it as the default cache, reset it afterwards
+    monkeypatch.setattr(partition_cache, "_default_cache", None)
+    return PartitionCache(tmp_path / "cache")
+
+
+def test_cached_files_are_not_downloaded_again(tmp_path):
+    remote = Remote({"s3://bucket/a": b"a" * 100})
+    cache = PartitionCache(tmp_path)
+    path = remote.get(cache, "s3://bucket/a")
+    assert Path(path).read_bytes() == b"a" * 100
+    assert remote.get(cache, "s3://bucket/a") == path
+    # Another process sharing the cache directory
+    assert remote.get(PartitionCache(tmp_path), "s3://bucket/a") == path
+    assert remote.opened == ["s3://bucket/a"]
+
+
+@pytest.mark.parametrize("damage", [b"", b"a" * 50, b"b" * 100])
+def test_damaged_files_are_downloaded_again(tmp_path, damage):
+    remote = Remote({"s3://bucket/a": b"a" * 100})
+    path = remote.get(PartitionCache(tmp_path), "s3://bucket/a")
+    Path(path).write_bytes(damage)
+    assert remote.get(PartitionCache(tmp_path), "s3://bucket/a") == path
+    assert Path(path).read_bytes() == b"a" * 100
+    assert len(remote.opened) == 2
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    remote = Remote({f"s3://bucket/{name}": name.encode() * 100 for name in "abcd"})
+    cache = PartitionCache(tmp_path, max_size=300)
+    paths = {name: remote.get(cache, f"s3://bucket/{name}") for name in "abc"}
+    remote.get(cache, "s3://bucket/a")
+    remote.get(cache, "s3://bucket/d")
+    assert cache.size() == 300
+    assert not Path(paths["b"]).exists()
+    assert Path(paths["a"]).exists() and Path(paths["c"]).exists()
+    remote.opened.clear()
+    remote.get(cache, "s3://bucket/b")
+    assert remote.opened == ["s3://bucket/b"]
+
+
+def test_requested_file_is_kept_even_if_larger_than_the_cache(tmp_path):
+    remote = Remote({"s3://bucket/a": b"a" * 100, "s3://bucket/b": b"b" * 1000})
+    cache = PartitionCache(tmp_path, max_size=500)
+    remote.get(cache, "s3://bucket/a")
+    assert Path(remote.get(cache, "s3://bucket/b")).read_bytes() == b"b" * 1000
+    assert cache.size() == 1000
+
+
+def test_pinned_files_are_not_evicted(tmp_path):
+    remote = Remote({f"s3://bucket/{name}": name.encode() * 100 for name in "abc"})
+    cache = PartitionCache(tmp_path, max_size=100)
+    paths = cache.get_many(
+        [(location, remote.opener(location)) for location in remote.files]
+    )
+    # Files fetched together don't evict each other
+    assert all(Path(path).exists() for path in paths)
+    assert cache.size() == 300
+    with cache.pin(["s3://bucket/a"]):
+        # Another process sharing the cache directory
+        PartitionCache(tmp_path, max_size=100).evict()
+        assert Path(paths[0]).exists()
+        assert cache.size() == 100
+    remote.get(cache, "s3://bucket/c")
+    assert not Path(paths[0]).exists()
+
+
+def test_pins_of_exited_processes_are_dropped(tmp_path):
+    remote = Remote({f"s3://bucket/{name}": name.encode() * 100 for name in "ab"})
+    cache = PartitionCache(tmp_path, max_size=100)
+    path = remote.get(cache, "s3://bucket/a")
+    process = subprocess.Popen(["true"])
+    process.wait()
+    with cache._index:
+        cache._index.execute(
+            "insert into pins values ('token', 's3://bucket/a', ?)", (process.pid,)
+        )
+    remote.get(cache, "s3://bucket/b")
+    assert not Path(path).exists()
+
+
+def test_identical_files_are_stored_once(tmp_path):
+    remote = Remote({"s3://bucket/a": b"same" * 25, "s3://bucket/b": b"same" * 25})
+    cache = PartitionCache(tmp_path, max_size=150)
+    assert remote.get(cache, "s3://bucket/a") == remote.get(cache, "s3://bucket/b")
+    assert cache.size() == 100
+    assert remote.get(cache, "s3://bucket/a")
+    assert remote.opened == ["s3://bucket/a", "s3://bucket/b"]
+
+
+def test_failed_downloads_leave_nothing_behind(tmp_path):
+    def open_remote():
+        raise IOError("connection reset")
+
+    cache = PartitionCache(tmp_path)
+    with pytest.raises(IOError):
+        cache.get("s3://bucket/a", open_remote)
+    assert cache.size() == 0
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "index.sqlite",
+        "objects",
+    ]
+
+
+def test_table_dataset_reads_complete_partitions_from_the_cache(cache, tmp_path):
+    # Pretend the extraction stopped part way through the last partition
+    config_location = tmp_path / "extraction"
+    shutil.copytree(CONFIG_LOCATION, config_location)
+    latest = yaml.safe_load((config_location / "latest.yaml").read_text())
+    latest["latest_block"] = 24859000
+    (config_location / "latest.yaml").write_text(yaml.safe_dump(latest))
+    uncached = get_table_dataset(
+        CONFIG_LOCATION, "prepaid_card_payment", 24000000, 24859648
+    )
+    expected = count_payments(uncached, 24000000, 24859648)
+
+    cache.set_as_default()
+    dataset = get_table_dataset(
+        config_location, "prepaid_card_payment", 24000000, 24859648
+    )
+    assert count_payments(dataset, 24000000, 24859648) == expected
+    files = [fragment.path for fragment in dataset.get_fragments()]
+    assert len(files) == len(uncached.files)
+    remote = [file for file in files if not file.startswith(str(cache.cache_dir))]
+    assert [file.split("/")[-2] for file in remote] == ["end_partition=24859648"]
+    assert cache.size() > 0
+
+
+def test_local_file_is_read_through_the_cache(cache, tmp_path):
+    remote = tmp_path / "remote.txt"
+    remote.write_text("results")
+    cache.set_as_default()
+    client = LocalS3Client(local_storage_dir=tmp_path / "s3")
+    location = client.CloudPath("s3://bucket/results.txt")
+    location.upload_from(remote)
+    local = get_local_file(location)
+    assert local.startswith(str(cache.cache_dir))
+    assert Path(local).read_text() == "results"
+    assert get_local_file(location) == local
+
+
+def test_table_dataset_larger_than_the_cache(cache, tmp_path):
+    config_location = tmp_path / "extraction"
+    shutil.copytree(CONFIG_LOCATION, config_location)
+    latest = yaml.safe_load((config_location / "latest.yaml").read_text())
+    latest["latest_block"] = 10**9
+    (config_location / "latest.yaml").write_text(yaml.safe_dump(latest))
+    expected = count_payments(
+        get_table_dataset(CONFIG_LOCATION, "prepaid_card_payment"), 0, 10**9
+    )
+
+    cache.max_size = 1
+    cache.set_as_default()
+    dataset = get_table_dataset(config_location, "prepaid_card_payment")
+    files = [fragment.path for fragment in dataset.get_fragments()]
+    assert len(files) > 1
+    assert all(file.startswith(str(cache.cache_dir)) for file in files)
+    # A backfill worker sharing the cache directory evicts what it can
+    remote = Remote({"s3://bucket/other": b"other"})
+    remote.get(PartitionCache(cache.cache_dir, max_size=1), "s3://bucket/other")
+    assert count_payments(dataset, 0, 10**9) == expected
+
+    # Once the dataset is gone its partitions can be evicted
+    del dataset
+    gc.collect()
+    cache.evict()
+    assert not any(Path(file).exists() for file in files)
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[f"s3://{Bucket}/{Key}"])}
+
+
+def test_s3_file_is_streamed_into_the_cache(cache, tmp_path):
+    cache.set_as_default()
+    client = S3Client(
+        local_cache_dir=tmp_path / "cloudpathlib",
+        boto3_session=Session(
+            aws_access_key_id="key",
+            aws_secret_access_key="secret",
+            region_name="us-east-1",
+        ),
+    )
+    client.client = FakeS3({"s3://bucket/results.txt": b"results"})
+    local = get_local_file(client.CloudPath("s3://bucket/results.txt"))
+    assert Path(local).read_bytes() == b"results"
+    # Only the partition cache holds a copy
+    assert not (tmp_path / "cloudpathlib").exists() or not any(
+        path.is_file() for path in (tmp_path / "cloudpathlib").rglob("*")
+    )
@@ -0,0 +1,131 @@
+import hypothesis.strategies as st
+import pandas as pd
+import pyarrow as pa
+import pytest
+from cardpay_reward_programs.payment_tree import (
+    amount_limbs,
+    amounts_from_limbs,
+    decode_payment,
+    decode_payments,
+    encode_payment,
+    encode_payments,
+)
+from eth_utils import to_checksum_address
+from hypothesis import given, settings
+
+address_st = st.binary(min_size=20, max_size=20).map(
+    lambda b: to_checksum_address("0x" + b.hex())
+)
+block_st = st.integers(min_value=0, max_value=2**63 - 1)
+payment_st = st.fixed_dictionaries(
+    {
+        "rewardProgramID": address_st,
+        "paymentCycle": block_st,
+        "validFrom": block_st,
+        "validTo": block_st,
+        "payee": address_st,
+        "token": address_st,
+        "amount": st.integers(min_value=0, max_value=2**256 - 1),
+        "explanationData": st.just({}),
+    }
+)
+
+
+@settings(max_examples=50, deadline=None)
+@given(st.lists(payment_st, min_size=1, max_size=20))
+def test_batch_encoding_matches_encode_payment(payments):
+    leaves = encode_payments(payments)
+    assert [leaf.tobytes() for leaf in leaves] == list(map(encode_payment, payments))
+    # DataFrames as returned by the rules encode identically
+    dataframe_leaves = encode_payments(pd.DataFrame(payments))
+    assert (dataframe_leaves == leaves).all()
+
+
+@settings(max_examples=50, deadline=None)
+@given(st.lists(payment_st, min_size=1, max_size=20))
+def test_batch_decoding_matches_decode_payment(payments):
+    encoded = list(map(encode_payment, payments))
+    expected = [decode_payment(leaf) for leaf in encoded]
+    for leaves in [
+        encoded,
+        [leaf.hex() for leaf in encoded],
+        ["0x" + leaf.hex() for leaf in encoded],
+        pa.array(encoded, type=pa.binary()),
+        encode_payments(payments),
+    ]:
+        decoded = decode_payments(leaves).to_dict("records")
+        assert decoded == expected
+
+
+def test_float_amounts_are_encoded_like_encode_payment():
+    # Staking computes amounts as floats
+    payments = pd.DataFrame(
+        [
+            {
+                "rewardProgramID": "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72",
+                "paymentCycle": 100,
+                "validFrom": 100,
+                "validTo": 200,
+                "payee": "0x12AE66CDc592e10B60f9097a7b0D3C59fce29876",
+                "token": "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f",
+                "amount": amount,
+            }
+            for amount in [82.26866088e9, 1e21, 0.5]
+        ]
+    )
+    leaves = encode_payments(payments)
+    for leaf, payment in zip(leaves, payments.to_dict("records")):
+        assert leaf.tobytes() == encode_payment(payment)
+
+
+def test_empty_batches():
+    assert encode_payments([]).shape == (0, 320)
+    assert len(decode_payments([])) == 0
+
+
+def test_rejects_invalid_addresses():
+    payment = {
+        "rewardProgramID": "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72",
+        "paymentCycle": 100,
+        "validFrom": 100,
+        "validTo": 200,
+        # Invalid checksum
+        "payee": "0x12AE66CDc592e10B60f9097a7b0D3C59fce29877",
+        "token": "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f",
+        "amount": 1,
+    }
+    with pytest.raises(ValueError, match=r".* is not a valid address"):
+        encode_payments([payment])
+
+
+def test_rejects_leaves_that_are_not_payments():
+    with pytest.raises(ValueError, match=r"Leaves are not all encoded payments"):
+        decode_payments([b"\x00" * 64])
+
+
+@settings(max_examples=50, deadline=None)
+@given(st.lists(st.integers(min_value=0, max_value=2**250), min_size=1, max_size=50))
+def test_amount_limbs_sum_exactly(amounts):
+    limbs = amount_limbs(amounts)
+    assert amounts_from_limbs(limbs).tolist() == amounts
+    assert amounts_from_limbs(limbs.sum(axis=0, keepdims=True))[0] == sum(amounts)
+
+
+def test_amount_limbs_reject_overflow():
+    limbs = amount_limbs([2**256 - 1, 1])
+    with pytest.raises(ValueError, match="does not fit in a uint256"):
+        amounts_from_limbs(limbs.sum(axis=0, keepdims=True))
+
+
+def test_lists_mixing_small_and_large_amounts_are_exact():
+    payment = {
+        "rewardProgramID": "0x0885ce31D73b63b0Fcb1158bf37eCeaD8Ff0fC72",
+        "paymentCycle": 100,
+        "validFrom": 100,
+        "validTo": 200,
+        "payee": "0x12AE66CDc592e10B60f9097a7b0D3C59fce29876",
+        "token": "0xB0427e9F03Eb448D030bE3EBC96F423857ceEb2f",
+    }
+    payments = [{**payment, "amount": amount} for amount in [0, 2**63 + 1]]
+    leaves = encode_payments(payments)
+    assert [leaf.tobytes() for leaf in leaves] == list(map(encode_payment, payments))
@@ -0,0 +1,84 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import duckdb
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+from cardpay_reward_programs.utils import (
+    get_block_column,
+    get_table_dataset,
+    prune_dataset,
+)
+
+CONFIG_LOCATION = Path(
+    "./tests/resources/partitioned-graph-data/data/staging_rewards/0.0.1/"
+).absolute()
+
+
+def count_payments(dataset, min_block, max_block):
+    con = duckdb.connect(":memory:")
+    con.register("prepaid_card_payment", dataset)
+    return con.execute(
+        """select count(*), count(distinct prepaid_card_owner) from prepaid_card_payment
+        where block_number_uint64 >= ? and block_number_uint64 <= ?""",
+        [min_block, max_block],
+    ).fetchall()
+
+
+@pytest.mark.parametrize(
+    "min_block,max_block",
+    [
+        (23592960, 24859648),
+        (23600000, 23700000),
+        (24117248, 24641535),
+        (24840000, 24850000),
+        (24859000, 24859648),
+        (30000000, 30000001),
+    ],
+)
+def test_pruned_dataset_matches_full_dataset(min_block, max_block):
+    full = get_table_dataset(CONFIG_LOCATION, "prepaid_card_payment")
+    pruned = get_table_dataset(
+        CONFIG_LOCATION, "prepaid_card_payment", min_block, max_block
+    )
+    assert len(pruned.files) <= len(full.files)
+    assert count_payments(pruned, min_block, max_block) == count_payments(
+        full, min_block, max_block
+    )
+
+
+def test_pruning_skips_partitions_outside_the_range():
+    full = get_table_dataset(CONFIG_LOCATION, "prepaid_card_payment")
+    pruned = get_table_dataset(
+        CONFIG_LOCATION, "prepaid_card_payment", 24840192, 24841215
+    )
+    assert len(full.files) == 29
+    assert [file.split("/")[-3:-1] for file in pruned.files] == [
+        ["start_partition=24840192", "end_partition=24841216"]
+    ]
+
+
+def test_block_column_follows_column_mappings():
+    schema = get_table_dataset(CONFIG_LOCATION, "prepaid_card_payment").schema
+    assert (
+        get_block_column(CONFIG_LOCATION, "prepaid_card_payment", schema)
+        == "block_number_uint64"
+    )
+    # Tables that aren't configured are partitioned on _block_number
+    schema = pa.schema([("_block_number", pa.uint64())])
+    assert get_block_column(CONFIG_LOCATION, "safe_owner", schema) == "_block_number"
+    assert get_block_column(CONFIG_LOCATION, "safe_owner", pa.schema([])) is None
+
+
+def test_row_groups_are_pruned_by_statistics():
+    table = pa.table({"_block_number": list(range(100)), "value": list(range(100))})
+    with TemporaryDirectory() as path:
+        pq.write_table(table, Path(path) / "data.parquet", row_group_size=10)
+        dataset = ds.dataset(Path(path) / "data.parquet", format="parquet")
+        pruned = prune_dataset(dataset, "_block_number", 25, 44)
+        [fragment] = pruned.get_fragments()
+        assert [row_group.id for row_group in fragment.row_groups] == [2, 3, 4]
+        assert pruned.to_table().column("value").to_pylist() == list(range(20, 50))
+        assert prune_dataset(dataset, "_block_number", 200).files == []
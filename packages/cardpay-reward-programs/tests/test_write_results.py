@@ -0,0 +1,72 @@
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from cardpay_reward_programs.payment_tree import PaymentTree
+from cardpay_reward_programs.utils import write_parquet_batches
+from cloudpathlib import AnyPath
+
+from .test_merkle_tree import make_payments
+
+parameters = {"metadata": {"explanation_id": "flat_payment"}}
+
+
+def make_tree(n):
+    payments = make_payments(n)
+    for i, payment in enumerate(payments):
+        payment["explanationData"] = {"amount": payment["amount"], "rank": i}
+    return PaymentTree(payments, parameters)
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 10, 64, 1000])
+def test_record_batches_match_whole_table(batch_size):
+    tree = make_tree(64)
+    batches = list(tree.record_batches(batch_size=batch_size))
+    assert max(len(batch) for batch in batches) <= batch_size
+    table = pa.Table.from_batches(batches, schema=tree.schema())
+    assert table.equals(tree.as_arrow())
+    assert table.schema.metadata == tree.schema().metadata
+
+
+def test_dataframe_payments_match_list_payments():
+    payments = make_payments(20)
+    from_list = PaymentTree(payments, parameters).as_arrow()
+    from_dataframe = PaymentTree(pd.DataFrame(payments), parameters).as_arrow()
+    assert from_dataframe.equals(from_list)
+
+
+def test_batches_are_bounded_by_memory():
+    tree = make_tree(100)
+    row_size = tree.estimated_row_size()
+    batches = list(tree.record_batches(max_batch_bytes=row_size * 7))
+    assert [len(batch) for batch in batches] == [7] * 14 + [2]
+    for batch in batches:
+        assert batch.nbytes <= row_size * 7
+
+
+def test_empty_tree_has_empty_output():
+    tree = PaymentTree([], parameters)
+    assert list(tree.record_batches()) == []
+    table = tree.as_arrow()
+    assert table.num_rows == 0
+    assert table.schema == tree.schema()
+
+
+def test_rejects_duplicate_payments():
+    with pytest.raises(Exception, match="There are duplicate leafs"):
+        PaymentTree(make_payments(3) * 2)
+
+
+def test_streamed_parquet_matches_whole_table():
+    tree = make_tree(50)
+    with TemporaryDirectory() as path:
+        write_parquet_batches(
+            AnyPath(path), tree.schema(), tree.record_batches(batch_size=16)
+        )
+        parquet_file = pq.ParquetFile(AnyPath(path) / "results.parquet")
+        assert parquet_file.metadata.num_row_groups == 4
+        table_on_disk = parquet_file.read()
+    assert table_on_disk.equals(tree.as_arrow())
+    assert table_on_disk.schema.metadata == tree.schema().metadata
@@ -7,6 +7,7 @@ import requests
 from cloudpathlib import AnyPath
 from did_resolver import Resolver
 from python_did_resolver import get_resolver
+from python_subgraph_client import SubgraphUnavailable, get_client
 
 from .utils import get_latest_written_block, get_table_dataset, run_job
 
@@ -63,33 +64,26 @@ class RewardProgram:
         logging.info(
             f"Updating processed payment cycles for {self.reward_program_id} from subgraph"
         )
-        # graphql check
-        query = f"""query {{
-            merkleRootSubmissions(orderBy:blockNumber, orderDirection:asc,
-                where:{{rewardProgram:"{self.reward_program_id}", blockNumber_gt:{self.last_update_block}}}) {{
-                blockNumber
-                paymentCycle
-            }}
-        }}"""
         try:
-            r = requests.post(
-                self.subgraph_url,
-                json={"query": query},
+            # Read every page before updating anything, so that a failure part way
+            # through can't move last_update_block past submissions not yet read
+            submissions = list(
+                get_client(self.subgraph_url).paginate(
+                    "merkleRootSubmissions",
+                    "paymentCycle",
+                    where={"rewardProgram": self.reward_program_id},
+                    cursor="blockNumber",
+                    after=self.last_update_block,
+                )
+            )
+        except SubgraphUnavailable as e:
+            logging.warning(f"Could not query subgraph: {e}")
+            return
+        for submission in submissions:
+            self.processed_cycles.add(int(submission["paymentCycle"]))
+            self.last_update_block = max(
+                self.last_update_block, int(submission["blockNumber"])
             )
-            if r.ok:
-                json_data = r.json()
-                for submission in json_data["data"]["merkleRootSubmissions"]:
-                    self.processed_cycles.add(int(submission["paymentCycle"]))
-                    self.last_update_block = max(
-                        self.last_update_block, int(submission["blockNumber"])
-                    )
-            else:
-                raise (r.raise_for_status())
-        except requests.exceptions.ConnectionError:
-            logging.warn("Connection error during query subgraph")
-        except Exception as e:
-            logging.warn("Error when querying subgraph")
-            raise (e)
 
     def get_latest_data_block(self, rule):
         """
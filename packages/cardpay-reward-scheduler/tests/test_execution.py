@@ -5,6 +5,7 @@ from unittest.mock import patch
 import pandas as pd
 import pytest
 from cloudpathlib import AnyPath
+from python_subgraph_client import SubgraphUnavailable
 from reward_scheduler.reward_program import RewardProgram
 
 
@@ -172,3 +173,26 @@ def test_rollover_cant_run_if_rewards_extracts_too_old(
         reward_program.run_rule(rollover_rule)
 
         assert mock_run_job.call_count == 0
+
+
+class FailingPages:
+    """A subgraph client that fails after returning its first page"""
+
+    def paginate(self, *args, **kwargs):
+        yield {"paymentCycle": "1000", "blockNumber": "1050"}
+        raise SubgraphUnavailable("timed out")
+
+
+@patch("reward_scheduler.reward_program.get_client", return_value=FailingPages())
+@patch(
+    "reward_scheduler.reward_program.get_table_dataset",
+    return_value=create_submission_dataset([900]),
+)
+def test_failed_subgraph_update_keeps_last_update_block(dataset, mock_client):
+    with TemporaryDirectory() as temp_dir:
+        rewards_root = create_rewards_latest(temp_dir)
+        reward_program = RewardProgram("0x0", "0x0", "http://", temp_dir, rewards_root)
+        reward_program.processed_cycles = {900}
+        reward_program.update_processed()
+        assert reward_program.processed_cycles == {900}
+        assert reward_program.last_update_block == 900
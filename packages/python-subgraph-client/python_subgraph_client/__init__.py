@@ -0,0 +1,3 @@
+from .client import SubgraphClient, SubgraphError, SubgraphUnavailable, get_client
+
+__all__ = [SubgraphClient, SubgraphError, SubgraphUnavailable, get_client]
@@ -0,0 +1,203 @@
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# graph-node's limit on `first`
+MAX_PAGE_SIZE = 1000
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SubgraphError(Exception):
+    """The subgraph answered a query with an error"""
+
+
+class SubgraphUnavailable(SubgraphError):
+    """The subgraph couldn't be reached, even after retrying"""
+
+
+def graphql_value(value):
+    """Render a python value as a GraphQL input literal"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, (list, tuple, set)):
+        return "[" + ", ".join(graphql_value(v) for v in value) + "]"
+    if isinstance(value, dict):
+        return (
+            "{" + ", ".join(f"{k}: {graphql_value(v)}" for k, v in value.items()) + "}"
+        )
+    return json.dumps(str(value))
+
+
+def query_name(query):
+    """The first field selected by a query, e.g. merkleRootSubmissions"""
+    match = re.search(r"{\s*(\w+)", query)
+    return match.group(1) if match else "query"
+
+
+def page_query(entity, fields, where, order_by, first):
+    return f"""{{
+        {entity}(
+            first: {first},
+            orderBy: {order_by},
+            orderDirection: asc,
+            where: {graphql_value(where)}
+        ) {{
+            id
+            {order_by}
+            {fields}
+        }}
+    }}"""
+
+
+class SubgraphClient:
+    """
+    Queries a subgraph over a pool of keep-alive connections, retrying
+    connection errors and overloaded responses with exponential backoff,
+    and keeping latency stats for each query name.
+    """
+
+    def __init__(
+        self, url, pool_size=10, retries=3, backoff=0.5, timeout=60, page_size=1000
+    ):
+        self.url = url
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.page_size = min(page_size, MAX_PAGE_SIZE)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def _record(self, name, seconds=None, error=False, retry=False):
+        with self.lock:
+            stats = self.stats.setdefault(
+                name,
+                {
+                    "queries": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                },
+            )
+            if seconds is not None:
+                stats["queries"] += 1
+                stats["total_seconds"] += seconds
+                stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["errors"] += error
+            stats["retries"] += retry
+
+    def latency(self):
+        """Query counts, errors, retries and latencies by query name"""
+        with self.lock:
+            return {
+                name: {
+                    **stats,
+                    "mean_seconds": stats["total_seconds"] / max(stats["queries"], 1),
+                }
+                for name, stats in self.stats.items()
+            }
+
+    def query(self, query, name=None):
+        """
+        The data of a query. Raises SubgraphError if the subgraph answers with
+        errors, and SubgraphUnavailable if it can't be reached after retrying.
+        """
+        name = name or query_name(query)
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                r = self.session.post(
+                    self.url, json={"query": query}, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if r.status_code not in RETRY_STATUSES:
+                    elapsed = time.perf_counter() - start
+                    logging.debug(f"Subgraph query {name} took {elapsed:.3f}s")
+                    if not r.ok:
+                        self._record(name, elapsed, error=True)
+                        raise SubgraphError(
+                            f"Subgraph query {name} failed with {r.status_code}: {r.text}"
+                        )
+                    body = r.json()
+                    if body.get("errors"):
+                        self._record(name, elapsed, error=True)
+                        raise SubgraphError(
+                            f"Subgraph query {name} failed: {body['errors']}"
+                        )
+                    self._record(name, elapsed)
+                    return body["data"]
+                error = SubgraphError(f"Subgraph answered with {r.status_code}")
+            if attempt == self.retries:
+                self._record(name, error=True)
+                raise SubgraphUnavailable(
+                    f"Subgraph query {name} failed after {attempt + 1} attempts: {error}"
+                ) from error
+            delay = self.backoff * 2**attempt
+            logging.warning(
+                f"Subgraph query {name} failed ({error}), retrying in {delay}s"
+            )
+            self._record(name, retry=True)
+            time.sleep(delay)
+
+    def paginate(self, entity, fields="", where=None, cursor="id", after=None):
+        """
+        All the entities matching where, in cursor order, fetched a page at a
+        time with {cursor}_gt rather than skip, which graph-node caps and
+        slows down with. Only entities after the cursor value after are fetched.
+
+        The next page is requested as soon as a full page arrives, while the
+        caller works through the current one.
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            yield from self._paginate(
+                executor, entity, fields, where or {}, cursor, after
+            )
+
+    def _paginate(self, executor, entity, fields, where, cursor, after):
+        def fetch(after):
+            page_where = dict(where)
+            if after is not None:
+                page_where[f"{cursor}_gt"] = after
+            query = page_query(entity, fields, page_where, cursor, self.page_size)
+            return executor.submit(self.query, query, entity)
+
+        next_page = fetch(after)
+        while next_page is not None:
+            page = next_page.result()[entity]
+            next_page = None
+            if len(page) == self.page_size:
+                last = page[-1][cursor]
+                next_page = fetch(last)
+            yield from page
+            if next_page is not None and cursor != "id":
+                # Entities with the same cursor value as the last one of the page
+                # may not have fitted in it, so page through those by id
+                seen = {o["id"] for o in page if o[cursor] == last}
+                for o in self._paginate(
+                    executor, entity, fields, {**where, cursor: last}, "id", None
+                ):
+                    if o["id"] not in seen:
+                        yield o
+
+
+@lru_cache
+def get_client(url):
+    """A client for url, shared so that its connections are reused"""
+    return SubgraphClient(url)
@@ -0,0 +1,159 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN = re.compile(r'\s*(?:("(?:[^"\\]|\\.)*")|(-?\d+(?:\.\d+)?)|(\w+)|(.))', re.S)
+
+
+class ArgumentParser:
+    """Parses the arguments of a GraphQL field, like `first: 10, where: {a: "b"}`"""
+
+    def __init__(self, text):
+        self.tokens = [
+            m.group(1) or m.group(2) or m.group(3) or m.group(4)
+            for m in TOKEN.finditer(text)
+            if m.group(0).strip()
+        ]
+        self.position = 0
+
+    def next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def arguments(self, end=None):
+        values = {}
+        while self.position < len(self.tokens) and self.tokens[self.position] != end:
+            if self.tokens[self.position] == ",":
+                self.position += 1
+                continue
+            key = self.next()
+            assert self.next() == ":"
+            values[key] = self.value()
+        self.position += 1
+        return values
+
+    def value(self):
+        token = self.next()
+        if token.startswith('"'):
+            return json.loads(token)
+        if token == "{":
+            return self.arguments("}")
+        if token == "[":
+            items = []
+            while self.tokens[self.position] != "]":
+                if self.tokens[self.position] == ",":
+                    self.position += 1
+                else:
+                    items.append(self.value())
+            self.position += 1
+            return items
+        if re.fullmatch(r"-?\d+", token):
+            return int(token)
+        return {"true": True, "false": False, "null": None}.get(token, token)
+
+
+def comparable(value):
+    """Compares BigInts, which the subgraph serialises as strings, as numbers"""
+    if isinstance(value, dict):
+        value = value["id"]
+    if isinstance(value, str) and re.fullmatch(r"-?\d+", value):
+        return int(value)
+    return value
+
+
+def matches(entity, where):
+    for key, expected in where.items():
+        field, _, op = key.partition("_")
+        value = comparable(entity.get(field))
+        if op == "in":
+            ok = value in [comparable(v) for v in expected]
+        elif op == "not_in":
+            ok = value not in [comparable(v) for v in expected]
+        else:
+            expected = comparable(expected)
+            ok = {
+                "": lambda: value == expected,
+                "not": lambda: value != expected,
+                "gt": lambda: value > expected,
+                "gte": lambda: value >= expected,
+                "lt": lambda: value < expected,
+                "lte": lambda: value <= expected,
+            }[op]()
+        if not ok:
+            return False
+    return True
+
+
+class MockSubgraph:
+    """
+    A local GraphQL server for tests, holding lists of entities by name.
+
+    It answers queries of a single collection of entities, with the first,
+    skip, orderBy, orderDirection and where arguments that graph-node takes
+    (with where filters on plain fields and their _gt, _gte, _lt, _lte, _not,
+    _in and _not_in variants). Whole entities are returned, whatever fields
+    are selected. Use it as a context manager, which sets url.
+    """
+
+    def __init__(self, entities=None, delay=0):
+        self.entities = entities or {}
+        self.delay = delay
+        self.failures = []
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def fail(self, *statuses):
+        """Answer the next requests with these http statuses"""
+        self.failures.extend(statuses)
+
+    def answer(self, query):
+        match = re.search(r"{\s*(\w+)\s*(\((.*?)\))?\s*{", query, re.S)
+        name = match.group(1)
+        arguments = ArgumentParser(match.group(3) or "").arguments()
+        if name not in self.entities:
+            return {"errors": [{"message": f"Type Query has no field {name}"}]}
+        entities = [
+            e for e in self.entities[name] if matches(e, arguments.get("where", {}))
+        ]
+        order_by = arguments.get("orderBy", "id")
+        entities.sort(
+            key=lambda e: comparable(e.get(order_by)),
+            reverse=arguments.get("orderDirection") == "desc",
+        )
+        skip = arguments.get("skip", 0)
+        entities = entities[skip : skip + arguments.get("first", 100)]
+        return {"data": {name: entities}}
+
+    def __enter__(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock.lock:
+                    mock.queries.append(body["query"])
+                    status = mock.failures.pop(0) if mock.failures else 200
+                time.sleep(mock.delay)
+                response = json.dumps(
+                    mock.answer(body["query"]) if status == 200 else {}
+                ).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
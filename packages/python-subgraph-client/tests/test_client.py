@@ -0,0 +1,98 @@
+import time
+
+import pytest
+from python_subgraph_client import SubgraphClient, SubgraphError, SubgraphUnavailable
+from python_subgraph_client.testing import MockSubgraph
+
+submissions = [
+    {
+        "id": f"{n:04d}",
+        # Several submissions share each block
+        "blockNumber": str(100 + n // 3),
+        "paymentCycle": str(n),
+        "rewardProgram": {"id": "0xprogram" if n % 2 else "0xother"},
+    }
+    for n in range(25)
+]
+
+
+def client(url, **kwargs):
+    return SubgraphClient(url, backoff=0, **kwargs)
+
+
+def test_paginate_by_id():
+    with MockSubgraph({"merkleRootSubmissions": submissions}) as subgraph:
+        results = list(
+            client(subgraph.url, page_size=4).paginate(
+                "merkleRootSubmissions", "paymentCycle"
+            )
+        )
+        assert results == submissions
+        assert "skip" not in "".join(subgraph.queries)
+        # 7 pages, the last of them partial
+        assert len(subgraph.queries) == 7
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 4, 5, 100])
+def test_paginate_by_block_number_keeps_submissions_of_the_same_block(page_size):
+    with MockSubgraph({"merkleRootSubmissions": submissions}) as subgraph:
+        results = list(
+            client(subgraph.url, page_size=page_size).paginate(
+                "merkleRootSubmissions",
+                "paymentCycle rewardProgram { id }",
+                where={"rewardProgram": "0xprogram"},
+                cursor="blockNumber",
+                after=101,
+            )
+        )
+    assert sorted(o["id"] for o in results) == [
+        o["id"]
+        for o in submissions
+        if o["rewardProgram"]["id"] == "0xprogram" and int(o["blockNumber"]) > 101
+    ]
+
+
+def test_next_page_is_prefetched():
+    with MockSubgraph({"merkleRootSubmissions": submissions}) as subgraph:
+        pages = client(subgraph.url, page_size=10).paginate("merkleRootSubmissions")
+        next(pages)
+        # The second page is requested while the first is being read
+        for _ in range(100):
+            if len(subgraph.queries) == 2:
+                break
+            time.sleep(0.01)
+        assert len(subgraph.queries) == 2
+        assert len(list(pages)) == len(submissions) - 1
+
+
+def test_retries_unavailable_subgraph():
+    with MockSubgraph({"rewardPrograms": [{"id": "0x1"}]}) as subgraph:
+        subgraph.fail(502, 429)
+        c = client(subgraph.url)
+        assert c.query("{ rewardPrograms { id } }") == {
+            "rewardPrograms": [{"id": "0x1"}]
+        }
+        assert c.latency()["rewardPrograms"]["retries"] == 2
+        assert c.latency()["rewardPrograms"]["queries"] == 1
+
+        subgraph.fail(503, 503, 503, 503)
+        with pytest.raises(SubgraphUnavailable):
+            c.query("{ rewardPrograms { id } }")
+        assert len(subgraph.queries) == 7
+
+
+def test_unreachable_subgraph():
+    with MockSubgraph() as subgraph:
+        url = subgraph.url
+    with pytest.raises(SubgraphUnavailable):
+        client(url, retries=1).query("{ rewardPrograms { id } }")
+
+
+def test_query_errors_are_not_retried():
+    with MockSubgraph() as subgraph:
+        c = client(subgraph.url)
+        with pytest.raises(SubgraphError) as e:
+            c.query("{ safes { id } }")
+        assert not isinstance(e.value, SubgraphUnavailable)
+        assert len(subgraph.queries) == 1
+        assert c.latency()["safes"]["errors"] == 1
@@ -1,16 +1,12 @@
-import logging
 import re
-from typing import Any, Callable, Dict, TypedDict
 
 import pandas as pd
-import requests
 from cloudpathlib import AnyPath
+from python_subgraph_client import get_client
 from web3 import Web3
 
 from .config import Config
 
-DEFAULT_SUBGRAPH_PAGINATE_SIZE = 100
-
 
 def safe_regex_group_search(regex, string, group):
     """
@@ -23,71 +19,27 @@ def safe_regex_group_search(regex, string, group):
         return None
 
 
-class SubgraphQuery(TypedDict):
-    name: str
-    query: str
-
-
-def merkle_root_submissions_query(
-    skip: int, blockNumber_gt=0, **filters
-) -> SubgraphQuery:
-    query = """{{
-        merkleRootSubmissions(
-            skip: {skip},
-            orderBy: blockNumber,
-            orderDirection: asc,
-            where: {{ blockNumber_gt: {blockNumber_gt} }}
-        )
-        {{
-            rewardProgram {{
-                id
-            }}
-            paymentCycle
-        }}
-    }}""".format(
-        **{"skip": skip, "blockNumber_gt": blockNumber_gt, **filters}
-    )
-    return {"name": "merkleRootSubmissions", "query": query}
-
-
-def query_subgraph(
-    config: Config,
-    skip: int,
-    blockNumber_gt: int,
-    query: Callable[[int, int, Dict[str, Any]], SubgraphQuery],
-):
-    logging.info(f"Skipping {skip}")
-    subgraph_url = config.subgraph_url
-    subgraph_query = query(skip, blockNumber_gt)
-    r = requests.post(
-        subgraph_url,
-        json={"query": subgraph_query["query"]},
-    )
-    if r.ok:
-        json_data = r.json()
-        data = json_data["data"]
-        return data[subgraph_query["name"]]
-
-
 def get_roots_subgraph(config: Config, min_scan_block=0):
-    paginate_size = 100
-    res = []
-
-    i = 0
-    while c := query_subgraph(
-        config, i * paginate_size, min_scan_block, merkle_root_submissions_query
-    ):
-        if len(c) == 0:
-            break
-        res.extend(
+    submissions = get_client(config.subgraph_url).paginate(
+        "merkleRootSubmissions",
+        """
+        rewardProgram {
+            id
+        }
+        paymentCycle
+        """,
+        cursor="blockNumber",
+        after=min_scan_block,
+    )
+    df = pd.DataFrame(
+        [
             {
                 "reward_program_id": root_submission["rewardProgram"]["id"],
                 "payment_cycle": int(root_submission["paymentCycle"]),
             }
-            for root_submission in c
-        )
-        i = i + 1
-    df = pd.DataFrame(res)
+            for root_submission in submissions
+        ]
+    )
     return df
 
 
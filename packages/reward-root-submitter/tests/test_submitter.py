@@ -4,9 +4,11 @@ import pytest
 from cloudpathlib import AnyPath
 from eth_utils import denoms
 from hexbytes import HexBytes
+from python_subgraph_client.testing import MockSubgraph
 from reward_root_submitter.config import Config
 from reward_root_submitter.contracts import RewardPool
 from reward_root_submitter.main import get_merkle_root_details
+from reward_root_submitter.utils import get_roots_subgraph
 from web3 import EthereumTesterProvider, Web3
 
 
@@ -237,3 +239,30 @@ def test_validates_cycle_matches_reward_program():
                 "tests/resources/reward_output_with_mismatched_contents/rewardProgramID=0xBb2B1638a16268b4ACFB4B38fbB9D6081F876BA1/paymentCycle=24000000/results.parquet"
             )
         )
+
+
+def test_get_roots_subgraph():
+    submissions = [
+        {
+            "id": str(n),
+            "blockNumber": str(100 + n),
+            "paymentCycle": str(n),
+            "rewardProgram": {"id": reward_programs()[n % 2]},
+        }
+        for n in range(5)
+    ]
+    with MockSubgraph({"merkleRootSubmissions": submissions}) as subgraph:
+        config = Config(
+            environment="test",
+            evm_full_node_url="test",
+            reward_root_submitter_address="0x" + "00" * 20,
+            reward_root_submitter_private_key="test",
+            reward_root_submitter_sentry_dsn="test",
+            reward_program_output="tests/resources/reward_output/",
+            subgraph_url=subgraph.url,
+        )
+        df = get_roots_subgraph(config, 101)
+    assert df.to_dict("records") == [
+        {"reward_program_id": reward_programs()[n % 2], "payment_cycle": n}
+        for n in range(2, 5)
+    ]
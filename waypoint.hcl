@@ -8,7 +8,9 @@ app "reward-submit-lambda" {
 
   build {
     use "docker" {
-      dockerfile = "Dockerfile"
+      # Built from the packages directory, to include the local python-subgraph-client
+      context    = "${path.app}/.."
+      dockerfile = "${path.app}/Dockerfile"
       buildkit   = true
       platform   = "linux/amd64"
     }